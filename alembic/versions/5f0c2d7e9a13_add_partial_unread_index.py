@@ -0,0 +1,32 @@
+"""add partial unread index on user group stats
+
+Revision ID: 5f0c2d7e9a13
+Revises: b1e7d8d64b84
+Create Date: 2026-10-19 08:12:31.204518+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f0c2d7e9a13'
+down_revision = 'b1e7d8d64b84'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        "ix_user_group_stats_user_id_unread",
+        "user_group_stats",
+        ["user_id"],
+        postgresql_where=sa.text("bookmark = true OR unread_count > 0 OR mentions > 0")
+    )
+
+
+def downgrade():
+    op.drop_index(
+        "ix_user_group_stats_user_id_unread",
+        table_name="user_group_stats"
+    )
@@ -0,0 +1,321 @@
+import re
+import time
+from abc import ABC
+from abc import abstractmethod
+from collections import defaultdict
+from typing import Dict
+from typing import List
+from typing import Optional
+
+import redis
+from redis.exceptions import RedisClusterException
+
+from dinofw.utils import config_or_default
+from dinofw.utils.config import ConfigKeys
+from dinofw.utils.config import DefaultValues
+from dinofw.utils.config import RedisKeys
+
+# commands that read a cached value; an empty reply means the caller falls back to the db
+READ_COMMANDS = {
+    "GET", "MGET", "GETRANGE", "HGET", "HMGET", "HGETALL", "HKEYS", "HLEN", "HSCAN",
+    "SMEMBERS", "SCARD", "LLEN", "LRANGE", "ZRANGE", "ZSCORE", "EXISTS",
+}
+
+OTHER_FAMILY = "other"
+
+
+def _key_families_pattern() -> re.Pattern:
+    """
+    one pattern for all key templates in RedisKeys, e.g. 'group:users:{}' becomes the named group
+    'users_in_group'; ids never contain a colon, but might be hash tagged
+    """
+    families = list()
+
+    for name, template in vars(RedisKeys).items():
+        if not name.startswith("RKEY_") or not isinstance(template, str):
+            continue
+
+        family = name[len("RKEY_"):].lower()
+        pattern = "[^:]+".join(re.escape(part) for part in template.split("{}"))
+        families.append(f"(?P<{family}>{pattern})")
+
+    return re.compile("|".join(families))
+
+
+KEY_FAMILIES = _key_families_pattern()
+
+
+def key_family(key) -> str:
+    if isinstance(key, bytes):
+        key = key.decode()
+
+    match = KEY_FAMILIES.fullmatch(str(key))
+    if match is None:
+        return OTHER_FAMILY
+
+    return match.lastgroup
+
+
+def _command_key(args) -> Optional[str]:
+    if len(args) < 2:
+        return None
+
+    # EVALSHA sha numkeys key [key ...] arg [arg ...]
+    if str(args[0]).upper() in {"EVAL", "EVALSHA"}:
+        if len(args) < 4 or int(args[2]) == 0:
+            return None
+        return args[3]
+
+    return args[1]
+
+
+def _is_hit(reply) -> bool:
+    if reply is None:
+        return False
+
+    # HSCAN replies with (cursor, values), MGET and HMGET with one value per key/field
+    if isinstance(reply, tuple):
+        reply = reply[1]
+    if isinstance(reply, list):
+        return any(value is not None for value in reply)
+
+    if isinstance(reply, (dict, set, str, bytes)):
+        return len(reply) > 0
+
+    return reply != 0
+
+
+class FamilyMetrics:
+    __slots__ = ("calls", "timed", "hits", "misses", "l1_hits", "l1_misses", "latency_ms", "max_latency_ms")
+
+    def __init__(self):
+        self.calls = 0
+
+        # commands sent on their own, not in a pipeline
+        self.timed = 0
+        self.hits = 0
+        self.misses = 0
+        self.l1_hits = 0
+        self.l1_misses = 0
+        self.latency_ms = 0.0
+        self.max_latency_ms = 0.0
+
+    def to_dict(self) -> dict:
+        n_reads = self.hits + self.misses
+        n_l1_reads = self.l1_hits + self.l1_misses
+
+        return {
+            "calls": self.calls,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / n_reads if n_reads else None,
+            "l1_hits": self.l1_hits,
+            "l1_misses": self.l1_misses,
+            "l1_hit_ratio": self.l1_hits / n_l1_reads if n_l1_reads else None,
+            "avg_latency_ms": self.latency_ms / self.timed if self.timed else 0.0,
+            "max_latency_ms": self.max_latency_ms,
+        }
+
+
+class CacheMetrics:
+    """
+    hits, misses and round-trip latency of the cache per key family, i.e. the RedisKeys template a
+    key was created from; commands in a pipeline are counted per family, but the latency is only
+    known for the pipeline as a whole. The totals since startup are available from the stats api,
+    and the changes since the last report are sent to the stats service every `metrics_interval`
+    seconds, instead of once per command
+    """
+
+    def __init__(self, env):
+        self.env = env
+        self.interval = float(config_or_default(
+            env, ConfigKeys.METRICS_INTERVAL, ConfigKeys.CACHE_SERVICE, DefaultValues.CACHE_METRICS_INTERVAL
+        ))
+
+        self.families: Dict[str, FamilyMetrics] = defaultdict(FamilyMetrics)
+        self.pipelines = 0
+        self.pipeline_commands = 0
+        self.max_pipeline_size = 0
+        self.pipeline_latency_ms = 0.0
+
+        self.reported: Dict[str, dict] = dict()
+        self.last_report = time.monotonic()
+
+    def record_l1(self, key, hit: bool) -> None:
+        family = self.families[key_family(key)]
+
+        if hit:
+            family.l1_hits += 1
+        else:
+            family.l1_misses += 1
+
+    def record_command(self, args, reply, elapsed_ms: float) -> None:
+        family = self._record(args, reply)
+        if family is not None:
+            family.timed += 1
+            family.latency_ms += elapsed_ms
+            family.max_latency_ms = max(family.max_latency_ms, elapsed_ms)
+
+        self._maybe_report()
+
+    def record_pipeline(self, commands: List[tuple], replies: List, elapsed_ms: float) -> None:
+        if not len(commands):
+            return
+
+        for args, reply in zip(commands, replies or [None] * len(commands)):
+            self._record(args, reply)
+
+        self.pipelines += 1
+        self.pipeline_commands += len(commands)
+        self.max_pipeline_size = max(self.max_pipeline_size, len(commands))
+        self.pipeline_latency_ms += elapsed_ms
+
+        self._maybe_report()
+
+    def _record(self, args, reply) -> Optional[FamilyMetrics]:
+        key = _command_key(args)
+        if key is None:
+            return None
+
+        family = self.families[key_family(key)]
+        family.calls += 1
+
+        if str(args[0]).upper() in READ_COMMANDS:
+            if _is_hit(reply):
+                family.hits += 1
+            else:
+                family.misses += 1
+
+        return family
+
+    def snapshot(self) -> dict:
+        return {
+            "families": {
+                name: family.to_dict()
+                for name, family in sorted(self.families.items())
+            },
+            "pipelines": {
+                "count": self.pipelines,
+                "avg_size": self.pipeline_commands / self.pipelines if self.pipelines else 0.0,
+                "max_size": self.max_pipeline_size,
+                "avg_latency_ms": self.pipeline_latency_ms / self.pipelines if self.pipelines else 0.0,
+            },
+        }
+
+    def _maybe_report(self) -> None:
+        now = time.monotonic()
+        if now - self.last_report < self.interval:
+            return
+
+        self.last_report = now
+
+        stats = getattr(self.env, "stats", None)
+        if stats is None:
+            return
+
+        for name, family in self.families.items():
+            current = {
+                "calls": family.calls,
+                "timed": family.timed,
+                "hits": family.hits,
+                "misses": family.misses,
+                "l1_hits": family.l1_hits,
+                "latency_ms": family.latency_ms,
+            }
+            before = self.reported.get(name, dict())
+            delta = {key: value - before.get(key, 0) for key, value in current.items()}
+            self.reported[name] = current
+
+            if delta["hits"] + delta["misses"] > 0:
+                hit_ratio = delta["hits"] / (delta["hits"] + delta["misses"])
+                stats.gauge(f"cache.{name}.hit_ratio", int(hit_ratio * 100))
+
+            if delta["calls"] > 0:
+                stats.gauge(f"cache.{name}.calls", delta["calls"])
+
+            if delta["timed"] > 0:
+                stats.timing(f"cache.{name}.latency", delta["latency_ms"] / delta["timed"])
+
+            if delta["l1_hits"] > 0:
+                stats.gauge(f"cache.{name}.l1_hits", delta["l1_hits"])
+
+        before = self.reported.get("pipelines", dict())
+        current = {"count": self.pipelines, "commands": self.pipeline_commands, "latency_ms": self.pipeline_latency_ms}
+        delta = {key: value - before.get(key, 0) for key, value in current.items()}
+        self.reported["pipelines"] = current
+
+        if delta["count"] > 0:
+            stats.gauge("cache.pipeline.size", int(delta["commands"] / delta["count"]))
+            stats.timing("cache.pipeline.latency", delta["latency_ms"] / delta["count"])
+
+
+class _MetricsClient:
+    metrics: CacheMetrics = None
+
+    async def execute_command(self, *args, **options):
+        before = time.perf_counter()
+        reply = await super().execute_command(*args, **options)
+        self.metrics.record_command(args, reply, (time.perf_counter() - before) * 1000)
+        return reply
+
+
+class _MetricsPipeline(ABC):
+    metrics: CacheMetrics = None
+
+    @abstractmethod
+    def _queued_commands(self) -> List[tuple]:
+        """
+        the args of each command queued so far; the single node and cluster pipelines keep them differently
+        """
+
+    async def execute(self, *args, **kwargs):
+        commands = self._queued_commands()
+
+        before = time.perf_counter()
+        replies = await super().execute(*args, **kwargs)
+        self.metrics.record_pipeline(commands, replies, (time.perf_counter() - before) * 1000)
+
+        return replies
+
+
+class MetricsPipeline(_MetricsPipeline, redis.asyncio.client.Pipeline):
+    def _queued_commands(self) -> List[tuple]:
+        return [args for args, _ in self.command_stack]
+
+
+class MetricsClusterPipeline(_MetricsPipeline, redis.asyncio.cluster.ClusterPipeline):
+    def _queued_commands(self) -> List[tuple]:
+        return [command.args for command in self._command_stack]
+
+    def __await__(self):
+        # queued commands are awaited, like on a single node, but awaiting a cluster pipeline
+        # clears the commands queued so far, so only the client is initialized instead
+        return self._initialize_client().__await__()
+
+    async def _initialize_client(self) -> "MetricsClusterPipeline":
+        if self._client._initialize:
+            await self._client.initialize()
+        return self
+
+
+class MetricsStandaloneClient(_MetricsClient):
+    def pipeline(self, transaction: bool = True, shard_hint: Optional[str] = None):
+        p = MetricsPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+        p.metrics = self.metrics
+        return p
+
+
+class MetricsRedis(MetricsStandaloneClient, redis.asyncio.Redis):
+    pass
+
+
+class MetricsRedisCluster(_MetricsClient, redis.asyncio.RedisCluster):
+    def pipeline(self, transaction=None, shard_hint=None):
+        if shard_hint:
+            raise RedisClusterException("shard_hint is deprecated in cluster mode")
+        if transaction:
+            raise RedisClusterException("transaction is deprecated in cluster mode")
+
+        p = MetricsClusterPipeline(self)
+        p.metrics = self.metrics
+        return p
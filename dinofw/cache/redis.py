@@ -1,8 +1,17 @@
+import asyncio
+import base64
+import json
 import socket
+import struct
 import sys
+import time
+import weakref
+from array import array
+from collections import OrderedDict
 from contextlib import asynccontextmanager
 from datetime import datetime as dt
-from datetime import timedelta
+from itertools import accumulate
+from typing import AsyncIterator
 from typing import Dict, Set
 from typing import List
 from typing import Optional
@@ -13,8 +22,14 @@ import redis
 from loguru import logger
 
 from dinofw.cache import ICache
+from dinofw.cache.metrics import CacheMetrics
+from dinofw.cache.metrics import MetricsRedis
+from dinofw.cache.metrics import MetricsRedisCluster
+from dinofw.cache.metrics import MetricsStandaloneClient
 from dinofw.utils import to_dt, split_into_chunks, to_ts
+from dinofw.utils import config_or_default
 from dinofw.utils.config import ConfigKeys
+from dinofw.utils.config import DefaultValues
 from dinofw.utils.config import RedisKeys
 
 ONE_MINUTE = 60
@@ -23,6 +38,167 @@ ONE_HOUR = ONE_MINUTE * 60
 ONE_DAY = 24 * ONE_HOUR
 ONE_WEEK = 7 * ONE_DAY
 
+# how long the near-immutable keys are kept in the in-process cache in front of redis; the group
+# type never changes, but other instances may change the status or the members of a group
+L1_GROUP_TYPE_TTL = ONE_HOUR
+L1_GROUP_STATUS_TTL = 10
+L1_GROUP_USERS_TTL = 5
+
+# while subscribed to invalidations, keys changed by other instances are evicted right away
+L1_SUBSCRIBED_TTL = ONE_MINUTE
+INVALIDATION_RETRY_DELAY = 1
+
+# KEYS: the total unread count of each user; ARGV: amount, ttl
+#
+# if not cached before, don't increase, make a total count next time it's
+# requested, and then it will be cached correctly
+LUA_INCREASE_TOTAL_UNREAD = """
+for _, key in ipairs(KEYS) do
+    if redis.call("EXISTS", key) == 1 then
+        redis.call("INCRBY", key, ARGV[1])
+        redis.call("EXPIRE", key, ARGV[2])
+    end
+end
+"""
+
+# KEYS: the unread-in-group hash, the unread groups set of each receiver, then the
+# total unread count of each user to increase; ARGV: group_id, ttl, number of
+# receivers, the receiver ids, then the amount to increase each total unread count by
+LUA_INCREASE_UNREAD_FOR_NEW_MESSAGE = """
+local group_id = ARGV[1]
+local ttl = ARGV[2]
+local n_receivers = tonumber(ARGV[3])
+
+for i = 1, n_receivers do
+    redis.call("HINCRBY", KEYS[1], ARGV[3 + i], 1)
+    redis.call("SADD", KEYS[1 + i], group_id)
+    redis.call("EXPIRE", KEYS[1 + i], ttl)
+end
+
+for i = n_receivers + 2, #KEYS do
+    if redis.call("EXISTS", KEYS[i]) == 1 then
+        redis.call("INCRBY", KEYS[i], ARGV[2 + i])
+        redis.call("EXPIRE", KEYS[i], ttl)
+    end
+end
+"""
+
+# KEYS: the users in group hash, and the packed users in the group; ARGV: pairs of user id and join time
+#
+# a packed value can't be added to, so it's removed and rebuilt from the db on the next read; the
+# hash isn't created if it doesn't exist (expired or packed), since it would only have the new users
+LUA_ADD_USERS_TO_GROUP = """
+redis.call("DEL", KEYS[2])
+
+if redis.call("EXISTS", KEYS[1]) == 0 then
+    return 0
+end
+
+for i = 1, #ARGV, 2 do
+    redis.call("HSET", KEYS[1], ARGV[i], ARGV[i + 1])
+end
+
+return 1
+"""
+
+# KEYS: the deletion candidates in progress, and the new deletion candidates
+#
+# the new candidates are added to the ones in progress (left by a previous run that didn't finish),
+# and removed, so groups added while the deleter is running are kept for the next run
+LUA_TAKE_DELETION_CANDIDATES = """
+redis.call("SUNIONSTORE", KEYS[1], KEYS[1], KEYS[2])
+redis.call("DEL", KEYS[2])
+
+return redis.call("SMEMBERS", KEYS[1])
+"""
+
+# KEYS: the online users; ARGV: all users currently online
+#
+# only the users that came online or went offline are added or removed, in one atomic call, so changes from
+# the real-time session api can't be overwritten in between, and overlapping reconciliations don't interfere
+LUA_RECONCILE_ONLINE_USERS = """
+local online = {}
+for _, user_id in ipairs(ARGV) do
+    online[user_id] = true
+end
+
+local was_online = {}
+local went_offline = {}
+for _, user_id in ipairs(redis.call("SMEMBERS", KEYS[1])) do
+    was_online[user_id] = true
+    if not online[user_id] then
+        table.insert(went_offline, user_id)
+    end
+end
+
+local came_online = {}
+for _, user_id in ipairs(ARGV) do
+    if not was_online[user_id] then
+        table.insert(came_online, user_id)
+    end
+end
+
+-- unpack() is limited by the size of the lua stack
+for i = 1, #went_offline, 1000 do
+    redis.call("SREM", KEYS[1], unpack(went_offline, i, math.min(i + 999, #went_offline)))
+end
+for i = 1, #came_online, 1000 do
+    redis.call("SADD", KEYS[1], unpack(came_online, i, math.min(i + 999, #came_online)))
+end
+
+return went_offline
+"""
+
+# flags and number of users; 6 bytes, so the header is the first 8 characters when base64 encoded
+PACKED_USERS_HEADER = struct.Struct("<BxI")
+PACKED_USERS_DELTA = 1
+
+
+def _pack_users(users: Dict[int, float]) -> str:
+    """
+    the user ids sorted, followed by the join times in the same order, in native byte order; the
+    ids are delta encoded as uint32 if all deltas fit, otherwise stored as int64; base64 encoded,
+    since the clients decode all responses
+    """
+    user_ids = sorted(users.keys())
+    join_times = array("d", [users[user_id] for user_id in user_ids])
+    deltas = [b - a for a, b in zip([0] + user_ids, user_ids)]
+
+    if len(user_ids) and user_ids[0] >= 0 and max(deltas) < 2 ** 32:
+        flags, ids = PACKED_USERS_DELTA, array("I", deltas)
+    else:
+        flags, ids = 0, array("q", user_ids)
+
+    header = PACKED_USERS_HEADER.pack(flags, len(user_ids))
+    return base64.b64encode(header + ids.tobytes() + join_times.tobytes()).decode("ascii")
+
+
+def _unpack_users(value: str) -> Dict[int, float]:
+    data = base64.b64decode(value)
+    flags, count = PACKED_USERS_HEADER.unpack_from(data)
+
+    ids = array("I" if flags & PACKED_USERS_DELTA else "q")
+    ids_start = PACKED_USERS_HEADER.size
+    ids_end = ids_start + count * ids.itemsize
+    ids.frombytes(data[ids_start:ids_end])
+
+    join_times = array("d")
+    join_times.frombytes(data[ids_end:])
+
+    if flags & PACKED_USERS_DELTA:
+        return dict(zip(accumulate(ids), join_times))
+    return dict(zip(ids, join_times))
+
+
+def _unpack_user_count(header: str) -> int:
+    _, count = PACKED_USERS_HEADER.unpack(base64.b64decode(header))
+    return count
+
+
+async def _iter_chunks(objects: list, n: int) -> AsyncIterator[list]:
+    for chunk in split_into_chunks(objects, n):
+        yield chunk
+
 
 def _to_str(b):
     if isinstance(b, (bytes, bytearray)):
@@ -40,56 +216,140 @@ def _to_float(b):
     return float(s)
 
 
-class MemoryCache:
-    def __init__(self):
-        self.vals = dict()
+def _l1_weight(value) -> int:
+    # the users of a group count once per user, so a few big groups can't use up all memory
+    if isinstance(value, (dict, set, list, tuple)):
+        return max(1, len(value))
+    return 1
+
+
+class LruCache:
+    """
+    size-bounded in-process cache with a ttl per key; the size is the total weight of the values,
+    where a value weighs 1, or its number of items if it's a collection (e.g. the users of a group).
+    When full, the least recently used key is evicted, and expired keys are removed when read or
+    when evicted. Values weighing more than a tenth of the max size are not cached at all
+    """
+    def __init__(self, max_size: int = DefaultValues.L1_CACHE_MAX_SIZE):
+        self.max_size = max_size
+        self.max_weight = max(1, max_size // 10)
+        self.vals = OrderedDict()
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+        self.too_big = 0
 
     def set(self, key, value, ttl=30):
-        try:
-            expires_at = (dt.utcnow() + timedelta(seconds=ttl)).timestamp()
-            self.vals[key] = (expires_at, value)
-        except:
-            pass
+        self.delete(key)
+
+        weight = _l1_weight(value)
+        if weight > self.max_weight:
+            self.too_big += 1
+            return
+
+        self.vals[key] = (time.monotonic() + ttl, value, weight)
+        self.size += weight
+
+        while self.size > self.max_size:
+            _, (_, _, evicted_weight) = self.vals.popitem(last=False)
+            self.size -= evicted_weight
+            self.evicted += 1
 
     def get(self, key):
-        try:
-            if key not in self.vals:
-                return None
-            expires_at, value = self.vals[key]
-            now = dt.utcnow().timestamp()
-            if now > expires_at:
-                del self.vals[key]
-                return None
-            return value
-        except:
+        item = self.vals.get(key)
+        if item is None:
+            self.misses += 1
             return None
 
+        expires_at, value, _ = item
+        if time.monotonic() > expires_at:
+            self.delete(key)
+            self.expired += 1
+            self.misses += 1
+            return None
+
+        self.vals.move_to_end(key)
+        self.hits += 1
+
+        return value
+
     def delete(self, key):
-        if key in self.vals:
-            del self.vals[key]
+        item = self.vals.pop(key, None)
+        if item is not None:
+            self.size -= item[2]
 
     def flushall(self):
-        self.vals = dict()
+        self.vals.clear()
+        self.size = 0
+
+    def stats(self) -> dict:
+        return {
+            "keys": len(self.vals),
+            "size": self.size,
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "too_big": self.too_big,
+        }
 
 
 class CacheRedis(ICache):
     def __init__(self, env, host: str, port: int = 6379, db: int = 0):
+        # hits, misses and latencies per key family, for all clients created by this instance
+        self.metrics = CacheMetrics(env)
+
         if env.config.get(ConfigKeys.TESTING, default=False) or host == "mock":
             from fakeredis import FakeAsyncRedis
 
-            self.redis_pool = None
-            self.redis_instance = FakeAsyncRedis(host=host, port=port, db=db, decode_responses=True)
+            class MetricsFakeRedis(MetricsStandaloneClient, FakeAsyncRedis):
+                pass
+
+            self.redis_pool_kwargs = None
+            self.redis_instance = MetricsFakeRedis(host=host, port=port, db=db, decode_responses=True)
+            self.redis_instance.metrics = self.metrics
 
             # fakeredis doesn't use execute on pipelines...
             self.redis_instance.execute = lambda: None
 
             self.testing = True
+            self.cluster = False
         else:
-            self.redis_pool = redis.asyncio.ConnectionPool(host=host, port=port, db=db, decode_responses=True)
+            self.redis_pool_kwargs = self._redis_pool_kwargs(env, host, port, db)
             self.redis_instance = None
             self.testing = False
+            self.cluster = self._is_enabled(env, ConfigKeys.CLUSTER)
+
+        # the cluster needs the keys of one group (or user) in the same slot, but the layout
+        # can be changed on a single node first, see docs/md/redis.md for migrating
+        hash_tags = self.cluster or self._is_enabled(env, ConfigKeys.HASH_TAGS)
+        RedisKeys.use_hash_tags(hash_tags)
+
+        # old and new keys can be in different slots in a cluster, so only moved on a single node
+        self.legacy_keys = hash_tags and not self.cluster and self._is_enabled(env, ConfigKeys.LEGACY_KEYS)
+
+        # connections can't be shared between event loops, so each loop gets its own client and pool
+        self.redis_clients = weakref.WeakKeyDictionary()
 
-        self.cache = MemoryCache()
+        # the client is passed when calling the scripts, since there's one client per loop; only
+        # the sha is kept, and the script is loaded the first time the server doesn't know it
+        self.increase_total_unread_script = self._register_script(LUA_INCREASE_TOTAL_UNREAD)
+        self.increase_unread_for_new_message_script = self._register_script(LUA_INCREASE_UNREAD_FOR_NEW_MESSAGE)
+        self.add_users_to_group_script = self._register_script(LUA_ADD_USERS_TO_GROUP)
+        self.take_deletion_candidates_script = self._register_script(LUA_TAKE_DELETION_CANDIDATES)
+        self.reconcile_online_users_script = self._register_script(LUA_RECONCILE_ONLINE_USERS)
+
+        self.invalidation_task = None
+        self.invalidation_subscribed = False
+
+        # in-process cache in front of redis, hits never touch the network
+        self.cache = LruCache(max_size=int(float(config_or_default(
+            env, ConfigKeys.L1_MAX_SIZE, ConfigKeys.CACHE_SERVICE, DefaultValues.L1_CACHE_MAX_SIZE
+        ))))
 
         args = sys.argv
         for a in ["--bind", "-b"]:
@@ -107,6 +367,110 @@ class CacheRedis(ICache):
             env.config.get(ConfigKeys.MAX_CLIENT_IDS, domain=ConfigKeys.CACHE_SERVICE, default=10)
         ))
 
+        # groups with at least this many users are cached as one packed value instead of a hash
+        self.packed_users_threshold = int(float(config_or_default(
+            env, ConfigKeys.PACKED_USERS_THRESHOLD, ConfigKeys.CACHE_SERVICE, DefaultValues.PACKED_USERS_THRESHOLD
+        )))
+
+    @staticmethod
+    def _redis_pool_kwargs(env, host: str, port: int, db: int) -> dict:
+        def get(key, default):
+            return config_or_default(env, key, ConfigKeys.CACHE_SERVICE, default)
+
+        kwargs = {
+            "host": host,
+            "port": port or 6379,
+            "db": db,
+            "decode_responses": True,
+            "health_check_interval": int(float(get(
+                ConfigKeys.HEALTH_CHECK_INTERVAL, DefaultValues.REDIS_HEALTH_CHECK_INTERVAL
+            ))),
+            "socket_keepalive": str(get(
+                ConfigKeys.SOCKET_KEEPALIVE, DefaultValues.REDIS_SOCKET_KEEPALIVE
+            )).lower() in ["yes", "1", "true"],
+        }
+
+        max_connections = get(ConfigKeys.MAX_CONNECTIONS, DefaultValues.REDIS_MAX_CONNECTIONS)
+        if max_connections is not None:
+            kwargs["max_connections"] = int(float(max_connections))
+
+        return kwargs
+
+    @staticmethod
+    def _is_enabled(env, key: str) -> bool:
+        value = config_or_default(env, key, ConfigKeys.CACHE_SERVICE, False)
+        return str(value).lower() in ["yes", "1", "true"]
+
+    def _create_redis_client(self) -> redis.asyncio.Redis:
+        kwargs = self.redis_pool_kwargs
+
+        # the startup node is used to discover the other nodes; max connections is per node
+        if self.cluster:
+            kwargs = {key: value for key, value in kwargs.items() if key != "db"}
+            client = MetricsRedisCluster(**kwargs)
+            client.metrics = self.metrics
+            return client
+
+        # a bounded pool waits for a free connection, instead of failing the request
+        if "max_connections" in kwargs:
+            pool = redis.asyncio.BlockingConnectionPool(**kwargs)
+        else:
+            pool = redis.asyncio.ConnectionPool(**kwargs)
+
+        client = MetricsRedis(connection_pool=pool)
+        client.metrics = self.metrics
+        return client
+
+    def _create_pubsub_client(self) -> redis.asyncio.Redis:
+        # a cluster client can't subscribe, but messages are published to all nodes, so any will do
+        kwargs = {
+            key: value for key, value in self.redis_pool_kwargs.items()
+            if key not in {"db", "max_connections"}
+        }
+        return redis.asyncio.Redis(**kwargs)
+
+    @staticmethod
+    def _register_script(script: str) -> redis.commands.core.AsyncScript:
+        return redis.commands.core.AsyncScript(None, script.encode("utf-8"))
+
+    async def _run_script(self, script: redis.commands.core.AsyncScript, keys: list, args: list, r):
+        # cluster pipelines don't allow EVALSHA, since they can't load a script missing on
+        # a node (e.g. after a failover), so the script itself is sent instead of its sha
+        if self.cluster and r is not self.redis:
+            return await r.eval(script.script, len(keys), *keys, *args)
+
+        return await script(keys=keys, args=args, client=r)
+
+    async def _move_legacy_key(self, key: str) -> None:
+        """
+        while migrating to hash tagged keys, keys that aren't rebuilt from the db when
+        missing are moved to their new name when read; cached values are not moved, they're
+        read from the db on the next miss instead
+        """
+        legacy_key = RedisKeys.untagged(key)
+        if not self.legacy_keys or legacy_key == key:
+            return
+
+        try:
+            await self.redis.renamenx(legacy_key, key)
+        except redis.exceptions.ResponseError:
+            # no such key, already moved or never existed
+            pass
+
+    async def _move_legacy_set(self, key: str) -> None:
+        """
+        same as _move_legacy_key(), but for sets that might've been added to with the new
+        name already, so the old members are added instead of renaming the key
+        """
+        legacy_key = RedisKeys.untagged(key)
+        if not self.legacy_keys or legacy_key == key:
+            return
+
+        p = self.redis.pipeline()
+        await p.sunionstore(key, [key, legacy_key])
+        await p.delete(legacy_key)
+        await p.execute()
+
     @asynccontextmanager
     async def pipeline(self):
         """
@@ -124,6 +488,8 @@ class CacheRedis(ICache):
 
     async def get_next_client_id(self, domain: str, user_id: int) -> str:
         key = RedisKeys.client_id(domain, user_id)
+        await self._move_legacy_key(key)
+
         current_idx = await self.redis.llen(key)
 
         # start from 0 if no pool found
@@ -217,17 +583,76 @@ class CacheRedis(ICache):
             await r.execute()
 
     async def increase_total_unread_message_count(self, user_ids: List[int], amount: int, pipeline=None):
-        for user_id in user_ids:
-            key = RedisKeys.total_unread_count(user_id)
-            current_cached_unread = await self.redis.get(key)
+        if not len(user_ids):
+            return
 
-            # if not cached before, don't increase, make a total count next time it's
-            # requested, and then it will be cached correctly
-            if current_cached_unread is None:
-                continue
+        keys = [RedisKeys.total_unread_count(user_id) for user_id in user_ids]
+
+        # the keys of each user are in different slots, so one call per user, but still one round trip per node
+        if self.cluster:
+            p = pipeline or self.redis.pipeline()
+
+            for key in keys:
+                await self._run_script(self.increase_total_unread_script, [key], [amount, ONE_HOUR], p)
+
+            if pipeline is None:
+                await p.execute()
+            return
+
+        # use pipeline if provided
+        r = pipeline or self.redis
+        await self._run_script(self.increase_total_unread_script, keys, [amount, ONE_HOUR], r)
 
-            await self.redis.incrby(key, amount)
-            await self.redis.expire(key, ONE_HOUR)
+    async def increase_unread_for_new_message(
+        self, group_id: str, receiver_ids: List[int], total_unread: Dict[int, int], pipeline=None
+    ) -> None:
+        """
+        increase the unread count in the group and add it to the unread groups of each receiver, and
+        increase the total unread count of each user in `total_unread` by the given amount (only if
+        already cached), all in one atomic call instead of a few round trips per receiver
+        """
+        if not len(receiver_ids) and not len(total_unread):
+            return
+
+        if self.cluster:
+            await self._increase_unread_for_new_message_in_cluster(group_id, receiver_ids, total_unread, pipeline)
+            return
+
+        # use pipeline if provided
+        r = pipeline or self.redis
+
+        keys = [RedisKeys.unread_in_group(group_id)]
+        keys.extend(RedisKeys.unread_groups(user_id) for user_id in receiver_ids)
+        keys.extend(RedisKeys.total_unread_count(user_id) for user_id in total_unread.keys())
+
+        args = [group_id, ONE_HOUR, len(receiver_ids)]
+        args.extend(str(user_id) for user_id in receiver_ids)
+        args.extend(total_unread.values())
+
+        await self._run_script(self.increase_unread_for_new_message_script, keys, args, r)
+
+    async def _increase_unread_for_new_message_in_cluster(
+        self, group_id: str, receiver_ids: List[int], total_unread: Dict[int, int], pipeline=None
+    ) -> None:
+        """
+        the keys of the group and of each receiver are in different slots, so they can't be
+        updated in one call; instead the keys in each slot are updated separately, but still
+        in one round trip per node
+        """
+        p = pipeline or self.redis.pipeline()
+        key = RedisKeys.unread_in_group(group_id)
+
+        for user_id in receiver_ids:
+            await p.hincrby(key, str(user_id), 1)
+            await p.sadd(RedisKeys.unread_groups(user_id), group_id)
+            await p.expire(RedisKeys.unread_groups(user_id), ONE_HOUR)
+
+        for user_id, amount in total_unread.items():
+            keys = [RedisKeys.total_unread_count(user_id)]
+            await self._run_script(self.increase_total_unread_script, keys, [amount, ONE_HOUR], p)
+
+        if pipeline is None:
+            await p.execute()
 
     async def add_unread_group(self, user_ids: List[int], group_id: str, pipeline=None) -> None:
         # use pipeline if provided
@@ -279,13 +704,27 @@ class CacheRedis(ICache):
     """
 
     async def get_group_exists(self, group_id: str) -> Optional[bool]:
-        value = await self.redis.get(RedisKeys.group_exists(group_id))
+        key = RedisKeys.group_exists(group_id)
+
+        exists = self._get(key)
+        if exists is not None:
+            return exists
+
+        value = await self.redis.get(key)
         if value is None:
             return None
-        return value == '1'
+
+        exists = value == '1'
+        self._set(key, exists, ttl=L1_GROUP_STATUS_TTL)
+
+        return exists
 
     async def set_group_exists(self, group_id: str, exists: bool) -> None:
-        await self.redis.set(RedisKeys.group_exists(group_id), '1' if exists else '0')
+        key = RedisKeys.group_exists(group_id)
+
+        await self.redis.set(key, '1' if exists else '0')
+        self._set(key, exists, ttl=L1_GROUP_STATUS_TTL)
+        await self._publish_invalidation([key])
 
     async def get_sent_message_count_in_group_for_user(self, group_id: str, user_id: int) -> Optional[int]:
         key = RedisKeys.sent_message_count_in_group(group_id)
@@ -298,12 +737,19 @@ class CacheRedis(ICache):
 
     async def get_group_status(self, group_id: str) -> Optional[int]:
         key = RedisKeys.group_status(group_id)
-        status = await self.redis.get(key)
 
+        status = self._get(key)
+        if status is not None:
+            return status
+
+        status = await self.redis.get(key)
         if status is None:
             return None
 
-        return int(float(status))
+        status = int(float(status))
+        self._set(key, status, ttl=L1_GROUP_STATUS_TTL)
+
+        return status
 
     async def count_online(self):
         key = RedisKeys.online_users()
@@ -335,33 +781,19 @@ class CacheRedis(ICache):
     async def get_online_users(self) -> Set[int]:
         return {int(user_id) for user_id in await self.redis.smembers(RedisKeys.online_users())}
 
-    async def set_online_users(self, offline: List[int] = None, online: List[int] = None) -> None:
-        key = RedisKeys.online_users()
-        logger.debug(f"offline: {offline}, online: {online}")
-
-        if offline and len(offline):
-            for rem_chunk in split_into_chunks(offline, 100):
-                await self.redis.srem(key, *rem_chunk)
-
-        if online and len(online):
-            for add_chunk in split_into_chunks(online, 100):
-                await self.redis.sadd(key, *add_chunk)
-
-        await self.set_online_users_ttl_expired()
-
-    async def set_online_users_only(self, online: List[int] = None) -> None:
-        key = RedisKeys.online_users()
-
-        in_cache = {int(user_id) for user_id in await self.redis.smembers(RedisKeys.online_users())}
-        to_remove = in_cache - set(online)
+    async def reconcile_online_users(self, online: List[int]) -> List[int]:
+        """
+        update the set of online users to the given full list of online users from the
+        mqtt bridge; only the differences are added and removed, atomically in one script
 
-        if len(to_remove):
-            for rem_chunk in split_into_chunks(list(to_remove), 100):
-                await self.redis.srem(key, *rem_chunk)
+        :return: users that were online but are not anymore
+        """
+        args = [str(user_id) for user_id in set(online)]
+        went_offline = await self._run_script(
+            self.reconcile_online_users_script, [RedisKeys.online_users()], args, self.redis
+        )
 
-        if online and len(online):
-            for add_chunk in split_into_chunks(online, 100):
-                await self.redis.sadd(key, *add_chunk)
+        return [int(user_id) for user_id in went_offline]
 
     async def set_online_user(self, user_id: int) -> None:
         await self.redis.sadd(RedisKeys.online_users(), user_id)
@@ -374,6 +806,9 @@ class CacheRedis(ICache):
         await self.redis.set(key, status)
         await self.redis.expire(key, ONE_HOUR)
 
+        self._set(key, status, ttl=L1_GROUP_STATUS_TTL)
+        await self._publish_invalidation([key])
+
     async def get_group_archived(self, group_id: str) -> Optional[bool]:
         key = RedisKeys.group_archived(group_id)
         archived = await self.redis.get(key)
@@ -388,9 +823,14 @@ class CacheRedis(ICache):
         await self.redis.set(key, '1' if archived else '0')
         await self.redis.expire(key, ONE_HOUR)
 
-    async def set_sent_message_count_in_group_for_user(self, group_id: str, user_id: int, count: int) -> None:
+    async def set_sent_message_count_in_group_for_user(
+        self, group_id: str, user_id: int, count: int, pipeline=None
+    ) -> None:
         key = RedisKeys.sent_message_count_in_group(group_id)
-        await self.redis.hset(key, str(user_id), str(count))
+
+        # use pipeline if provided
+        r = pipeline or self.redis
+        await r.hset(key, str(user_id), str(count))
 
     async def get_last_read_in_group_oldest(self, group_id: str) -> Optional[float]:
         key = RedisKeys.oldest_last_read_time(group_id)
@@ -464,16 +904,19 @@ class CacheRedis(ICache):
         }
 
     async def set_last_read_in_groups_for_user(
-        self, group_ids: List[str], user_id: int, last_read: float
+        self, group_ids: List[str], user_id: int, last_read: float, pipeline=None
     ) -> None:
-        p = self.redis.pipeline()
+        # use pipeline if provided
+        p = pipeline or self.redis.pipeline()
 
         for group_id in group_ids:
             key = RedisKeys.last_read_time(group_id)
             await p.hset(key, str(user_id), str(last_read))
             await p.expire(key, 7 * ONE_DAY)
 
-        await p.execute()
+        # only execute if we weren't provided a pipeline
+        if pipeline is None:
+            await p.execute()
 
     async def set_last_read_in_group_for_user(
         self, group_id: str, user_id: int, last_read: float, pipeline=None
@@ -499,6 +942,8 @@ class CacheRedis(ICache):
         # use pipeline if provided
         r = pipeline or self.redis
         await r.hdel(key, str(user_id))
+        await r.delete(RedisKeys.user_in_group_packed(group_id))
+        await self._invalidate([key], pipeline=r)
 
     async def increase_unread_in_group_for(self, group_id: str, user_ids: List[int], pipeline=None) -> None:
         key = RedisKeys.unread_in_group(group_id)
@@ -513,14 +958,17 @@ class CacheRedis(ICache):
         if pipeline is None:
             await r.execute()
 
-    async def reset_unread_in_groups(self, user_id: int, group_ids: List[str]):
-        p = self.redis.pipeline()
+    async def reset_unread_in_groups(self, user_id: int, group_ids: List[str], pipeline=None):
+        # use pipeline if provided
+        p = pipeline or self.redis.pipeline()
 
         for group_id in group_ids:
             key = RedisKeys.unread_in_group(group_id)
             await p.hset(key, str(user_id), "0")
 
-        await p.execute()
+        # only execute if we weren't provided a pipeline
+        if pipeline is None:
+            await p.execute()
 
     async def clear_unread_in_group_for_user(self, group_id: str, user_id, pipeline=None) -> None:
         key = RedisKeys.unread_in_group(group_id)
@@ -548,13 +996,85 @@ class CacheRedis(ICache):
 
     async def get_user_count_in_group(self, group_id: str) -> Optional[int]:
         key = RedisKeys.user_in_group(group_id)
-        n_users = await self.redis.hlen(key)
 
-        if n_users is None:
+        users = self._get(key)
+        if users is not None:
+            return len(users)
+
+        # only the header of a packed value is needed for the count
+        p = self.redis.pipeline()
+        await p.hlen(key)
+        await p.getrange(RedisKeys.user_in_group_packed(group_id), 0, 7)
+        n_users, packed_header = await p.execute()
+
+        if packed_header:
+            return _unpack_user_count(packed_header)
+
+        # there's no empty hashes, so it's not cached
+        if not n_users:
             return None
 
         return n_users
 
+    async def is_user_in_group(self, group_id: str, user_id: int) -> Optional[bool]:
+        """
+        :return: None if the users of the group are not cached
+        """
+        key = RedisKeys.user_in_group(group_id)
+
+        users = self._get(key)
+        if users is not None:
+            return user_id in users
+
+        p = self.redis.pipeline()
+        await p.hexists(key, str(user_id))
+        await p.exists(key)
+        await p.exists(RedisKeys.user_in_group_packed(group_id))
+        in_group, is_hashed, is_packed = await p.execute()
+
+        if in_group:
+            return True
+        if is_hashed:
+            return False
+
+        # a packed value has to be read entirely, but is then kept in the in-process cache
+        if is_packed:
+            users = await self.get_user_ids_and_join_time_in_group(group_id)
+            if users is not None:
+                return user_id in users
+
+        return None
+
+    async def iter_user_ids_in_group(
+        self, group_id: str, batch_size: int = DefaultValues.USER_ID_BATCH_SIZE
+    ) -> Optional[AsyncIterator[List[int]]]:
+        """
+        for fan-out to all users in a group, without building the whole map of join times
+        for big groups at once; only the ids are read from a hash, then used in batches
+
+        :return: None if the users of the group are not cached, otherwise batches of user ids
+        """
+        key = RedisKeys.user_in_group(group_id)
+
+        users = self._get(key)
+        if users is None:
+            # HSCAN could return a user more than once if the hash is changed while scanning, and
+            # big groups are packed instead of hashed, so all ids are read at once
+            p = self.redis.pipeline()
+            await p.hkeys(key)
+            await p.get(RedisKeys.user_in_group_packed(group_id))
+            user_ids, packed = await p.execute()
+
+            if packed is not None:
+                users = _unpack_users(packed)
+                self._set(key, users, ttl=L1_GROUP_USERS_TTL)
+            elif not len(user_ids):
+                return None
+            else:
+                return _iter_chunks([int(user_id) for user_id in user_ids], batch_size)
+
+        return _iter_chunks(list(users.keys()), batch_size)
+
     async def get_messages_in_group(self, group_id: str) -> (Optional[int], Optional[float]):
         key = RedisKeys.messages_in_group(group_id)
         messages_until = await self.redis.get(key)
@@ -589,18 +1109,52 @@ class CacheRedis(ICache):
 
     async def get_group_type(self, group_id: str) -> Optional[int]:
         key = RedisKeys.group_type(group_id)
-        group_type = await self.redis.get(key)
 
+        group_type = self._get(key)
+        if group_type is not None:
+            return group_type
+
+        group_type = await self.redis.get(key)
         if group_type is None:
             return None
 
-        return int(group_type)
+        group_type = int(group_type)
+        self._set(key, group_type, ttl=L1_GROUP_TYPE_TTL)
+
+        return group_type
 
     async def set_group_type(self, group_id: str, group_type: int) -> None:
         key = RedisKeys.group_type(group_id)
         await self.redis.set(key, group_type)
         await self.redis.expire(key, ONE_DAY)
 
+        self._set(key, group_type, ttl=L1_GROUP_TYPE_TTL)
+
+    async def set_missing_group_types_and_status(
+        self, group_types: Dict[str, int], group_statuses: Dict[str, int]
+    ) -> None:
+        """
+        used when warming up the cache; only the missing keys are set, since the values
+        might have been changed by another instance after they were read from the db
+        """
+        values = [
+            (RedisKeys.group_type(group_id), group_type, ONE_DAY, L1_GROUP_TYPE_TTL)
+            for group_id, group_type in group_types.items()
+        ]
+        values.extend([
+            (RedisKeys.group_status(group_id), status, ONE_HOUR, L1_GROUP_STATUS_TTL)
+            for group_id, status in group_statuses.items()
+        ])
+
+        p = self.redis.pipeline()
+        for key, value, ttl, _ in values:
+            await p.set(key, value, ex=ttl, nx=True)
+
+        # no need to invalidate, other instances can't have cached a key that was missing
+        for (key, value, _, l1_ttl), was_set in zip(values, await p.execute()):
+            if was_set:
+                self._set(key, value, ttl=l1_ttl)
+
     async def increase_count_group_types_for_user(self, user_id: int, group_type: int) -> None:
         for is_hidden in {True, False}:
             current_group_types = await self.get_count_group_types_for_user(user_id, hidden=is_hidden)
@@ -616,12 +1170,12 @@ class CacheRedis(ICache):
 
             await self.set_count_group_types_for_user(user_id, new_group_types, is_hidden)
 
-    async def reset_count_group_types_for_user(self, user_id: int) -> None:
-        key = RedisKeys.count_group_types_including_hidden(user_id)
-        await self.redis.delete(key)
+    async def reset_count_group_types_for_user(self, user_id: int, pipeline=None) -> None:
+        # use pipeline if provided
+        r = pipeline or self.redis
 
-        key = RedisKeys.count_group_types_not_including_hidden(user_id)
-        await self.redis.delete(key)
+        await r.delete(RedisKeys.count_group_types_including_hidden(user_id))
+        await r.delete(RedisKeys.count_group_types_not_including_hidden(user_id))
 
     async def get_delete_before(self, group_id: str, user_id: int) -> Optional[dt]:
         key = RedisKeys.delete_before(group_id, user_id)
@@ -743,19 +1297,34 @@ class CacheRedis(ICache):
 
     async def get_user_ids_and_join_time_in_groups(self, group_ids: List[str]):
         join_times = dict()
+        not_cached = list()
 
-        p = self.redis.pipeline()
         for group_id in group_ids:
+            users = self._get(RedisKeys.user_in_group(group_id))
+
+            # copy, since callers may change it
+            if users is not None:
+                join_times[group_id] = dict(users)
+            else:
+                not_cached.append(group_id)
+
+        if not len(not_cached):
+            return join_times
+
+        p = self.redis.pipeline()
+        for group_id in not_cached:
             await p.hgetall(RedisKeys.user_in_group(group_id))
+            await p.get(RedisKeys.user_in_group_packed(group_id))
+
+        results = await p.execute()
 
-        for group_id, users in zip(group_ids, await p.execute()):
-            if not len(users):
+        for group_id, users, packed in zip(not_cached, results[0::2], results[1::2]):
+            users = self._to_users(users, packed)
+            if users is None:
                 continue
 
-            join_times[group_id] = {
-                int(user_id): float(join_time)
-                for user_id, join_time in users.items()
-            }
+            self._set(RedisKeys.user_in_group(group_id), users, ttl=L1_GROUP_USERS_TTL)
+            join_times[group_id] = dict(users)
 
         return join_times
 
@@ -765,25 +1334,34 @@ class CacheRedis(ICache):
         p = self.redis.pipeline()
 
         for group_id, users in group_users.items():
-            key = RedisKeys.user_in_group(group_id)
-            await p.delete(key)
-
-            if len(users):
-                for user_id, join_time in users.items():
-                    await p.hset(key, str(user_id), str(join_time))
-                await p.expire(key, FIVE_MINUTES)
+            await self._replace_users_in_group(group_id, users, FIVE_MINUTES, p)
 
+        keys = [RedisKeys.user_in_group(group_id) for group_id in group_users.keys()]
+        await self._invalidate(keys, pipeline=p)
         await p.execute()
 
     async def get_user_ids_and_join_time_in_group(
         self, group_id: str
     ) -> Optional[Dict[int, float]]:
-        users = await self.redis.hgetall(RedisKeys.user_in_group(group_id))
+        key = RedisKeys.user_in_group(group_id)
 
-        if not len(users):
+        # copy, since callers may change it
+        users = self._get(key)
+        if users is not None:
+            return dict(users)
+
+        p = self.redis.pipeline()
+        await p.hgetall(key)
+        await p.get(RedisKeys.user_in_group_packed(group_id))
+        users, packed = await p.execute()
+
+        users = self._to_users(users, packed)
+        if users is None:
             return None
 
-        return {int(user_id): float(join_time) for user_id, join_time in users.items()}
+        self._set(key, users, ttl=L1_GROUP_USERS_TTL)
+
+        return dict(users)
 
     async def last_read_was_updated(
             self,
@@ -806,22 +1384,48 @@ class CacheRedis(ICache):
         key = RedisKeys.user_in_group(group_id)
         p = self.redis.pipeline()
 
-        await p.delete(key)
-
-        if len(users):
-            await self.add_user_ids_and_join_time_in_group(group_id, users, pipeline=p, execute=False)
-            await p.expire(key, FIVE_MINUTES + random.randint(0, ONE_MINUTE))
+        await self._replace_users_in_group(group_id, users, FIVE_MINUTES + random.randint(0, ONE_MINUTE), p)
+        await self._invalidate([key], pipeline=p)
 
         await p.execute()
 
+    async def _replace_users_in_group(self, group_id: str, users: Dict[int, float], ttl: int, pipeline) -> None:
+        key = RedisKeys.user_in_group(group_id)
+        packed_key = RedisKeys.user_in_group_packed(group_id)
+
+        await pipeline.delete(key, packed_key)
+
+        if len(users) >= self.packed_users_threshold:
+            await pipeline.set(packed_key, _pack_users(users), ex=ttl)
+
+        elif len(users):
+            await pipeline.hset(key, mapping={
+                str(user_id): str(join_time)
+                for user_id, join_time in users.items()
+            })
+            await pipeline.expire(key, ttl)
+
+    @staticmethod
+    def _to_users(users: Dict[str, str], packed: Optional[str]) -> Optional[Dict[int, float]]:
+        if packed is not None:
+            return _unpack_users(packed)
+
+        if not len(users):
+            return None
+
+        return {int(user_id): float(join_time) for user_id, join_time in users.items()}
+
     async def remove_user_id_and_join_time_in_groups_for_user(self, group_ids: List[str], user_id: int, pipeline=None):
         # use pipeline if provided
         r = pipeline or self.redis.pipeline()
         user_id = str(user_id)
 
-        for group_id in group_ids:
-            key = RedisKeys.user_in_group(group_id)
+        keys = [RedisKeys.user_in_group(group_id) for group_id in group_ids]
+        for group_id, key in zip(group_ids, keys):
             await r.hdel(key, user_id)
+            await r.delete(RedisKeys.user_in_group_packed(group_id))
+
+        await self._invalidate(keys, pipeline=r)
 
         # only execute if we weren't provided a pipeline
         if pipeline is None:
@@ -830,13 +1434,22 @@ class CacheRedis(ICache):
     async def add_user_ids_and_join_time_in_group(
         self, group_id: str, users: Dict[int, float], pipeline=None, execute: bool = True
     ) -> None:
+        """
+        only added if the users of the group are cached in a hash; if they're packed, or not
+        cached, they're read from the db the next time they're needed instead
+        """
         key = RedisKeys.user_in_group(group_id)
+        keys = [key, RedisKeys.user_in_group_packed(group_id)]
+
+        args = list()
+        for user_id, join_time in users.items():
+            args.extend([str(user_id), str(join_time)])
 
         # use pipeline if provided
         r = pipeline or self.redis.pipeline()
 
-        for user_id, join_time in users.items():
-            await r.hset(key, str(user_id), str(join_time))
+        await self._run_script(self.add_users_to_group_script, keys, args, r)
+        await self._invalidate([key], pipeline=r)
 
         # only execute if we weren't provided a pipeline
         if pipeline is None and execute:
@@ -844,33 +1457,226 @@ class CacheRedis(ICache):
 
     async def clear_user_ids_and_join_time_in_group(self, group_id: str) -> None:
         key = RedisKeys.user_in_group(group_id)
+        await self.redis.delete(key, RedisKeys.user_in_group_packed(group_id))
+        await self._invalidate([key])
+
+    async def get_action_log_groups_done(self, user_id: int, payload_hash: str) -> Set[str]:
+        key = RedisKeys.action_logs_done(user_id, payload_hash)
+        await self._move_legacy_set(key)
+
+        return set(await self.redis.smembers(key))
+
+    async def add_action_log_groups_done(self, user_id: int, payload_hash: str, group_ids: List[str]) -> None:
+        if not len(group_ids):
+            return
+
+        key = RedisKeys.action_logs_done(user_id, payload_hash)
+        p = self.redis.pipeline()
+
+        await p.sadd(key, *group_ids)
+        await p.expire(key, ONE_DAY)
+        await p.execute()
+
+    async def remove_action_log_groups_done(self, user_id: int, payload_hash: str) -> None:
+        key = RedisKeys.action_logs_done(user_id, payload_hash)
         await self.redis.delete(key)
 
+    async def add_deletion_candidates(self, group_ids: List[str], pipeline=None) -> None:
+        """
+        groups where delete_before has changed or someone left, and might now
+        have messages that the deleter can remove
+        """
+        if not len(group_ids):
+            return
+
+        # use pipeline if provided
+        r = pipeline or self.redis
+        await r.sadd(RedisKeys.deletion_candidates(), *group_ids)
+
+    async def take_deletion_candidates(self) -> Set[str]:
+        """
+        move the current candidates to the in-progress set, so groups added while
+        the deleter is running are kept for the next run; if a previous run didn't
+        finish, its remaining candidates are included as well
+        """
+        key = RedisKeys.deletion_candidates()
+        key_in_progress = RedisKeys.deletion_candidates_in_progress()
+
+        await self._move_legacy_set(key)
+        await self._move_legacy_set(key_in_progress)
+
+        # cluster pipelines block SUNIONSTORE, and the move has to be atomic, so it's done in a script
+        group_ids = await self._run_script(
+            self.take_deletion_candidates_script, [key_in_progress, key], list(), self.redis
+        )
+        return set(group_ids)
+
+    async def get_deletion_candidates(self) -> Set[str]:
+        """
+        same groups as take_deletion_candidates() would return, but without
+        moving them, so the next run still evaluates them
+        """
+        await self._move_legacy_set(RedisKeys.deletion_candidates())
+        await self._move_legacy_set(RedisKeys.deletion_candidates_in_progress())
+
+        return set(await self.redis.sunion([
+            RedisKeys.deletion_candidates_in_progress(),
+            RedisKeys.deletion_candidates()
+        ]))
+
+    async def add_deletion_candidates_in_progress(self, group_ids: List[str]) -> None:
+        if len(group_ids):
+            await self.redis.sadd(RedisKeys.deletion_candidates_in_progress(), *group_ids)
+
+    async def remove_deletion_candidates_in_progress(self, group_ids: List[str] = None) -> None:
+        key = RedisKeys.deletion_candidates_in_progress()
+
+        if group_ids is None:
+            await self.redis.delete(key)
+        elif len(group_ids):
+            await self.redis.srem(key, *group_ids)
+
     async def set_hide_group(
         self, group_id: str, hide: bool, user_ids: List[int] = None, pipeline=None
     ) -> None:
+        """
+        only users who have hidden the group are kept in the hash, so un-hiding it for all
+        users (done on every new message) is a single delete, and a no-op if nobody has it
+        hidden, instead of reading and re-setting every user in the hash
+        """
         key = RedisKeys.hide_group(group_id)
 
-        if user_ids is None:
-            users = await self.redis.hgetall(key)
-        else:
-            users = user_ids
-
         # use pipeline if provided
         r = pipeline or self.redis.pipeline()
 
-        for user in users:
-            await r.hset(key, user, "t" if hide else "f")
+        if user_ids is None:
+            if hide:
+                raise ValueError("user ids are required when hiding a group")
+            await r.delete(key)
+        elif hide:
+            await r.hset(key, mapping={user_id: "t" for user_id in user_ids})
+        elif len(user_ids):
+            await r.hdel(key, *user_ids)
 
         # only execute if we weren't provided a pipeline
         if pipeline is None:
             await r.execute()
 
+    async def _invalidate(self, keys: List[str], pipeline=None) -> None:
+        for key in keys:
+            self._del(key)
+
+        await self._publish_invalidation(keys, pipeline=pipeline)
+
+    async def _publish_invalidation(self, keys: List[str], pipeline=None) -> None:
+        """
+        all instances, including this one, evict the keys when receiving the message; if
+        published in a pipeline, it's received after the changes have been executed
+        """
+        if not len(keys):
+            return
+
+        # use pipeline if provided
+        r = pipeline or self.redis
+
+        # a channel isn't a key, so a cluster client needs to be told where to publish, and
+        # cluster pipelines block PUBLISH for that reason, unless a node is given like this
+        if self.cluster:
+            await r.execute_command(
+                "PUBLISH", RedisKeys.cache_invalidation(), json.dumps(keys),
+                target_nodes=redis.asyncio.RedisCluster.RANDOM
+            )
+        else:
+            await r.publish(RedisKeys.cache_invalidation(), json.dumps(keys))
+
+    def start_invalidation_listener(self) -> None:
+        if self.testing or self.invalidation_task is not None:
+            return
+
+        self.invalidation_task = asyncio.create_task(self.listen_for_invalidations())
+
+    def get_metrics(self) -> dict:
+        return {
+            "l1": self.cache.stats(),
+            **self.metrics.snapshot(),
+        }
+
+    async def stop_invalidation_listener(self) -> None:
+        if self.invalidation_task is None:
+            return
+
+        self.invalidation_task.cancel()
+        try:
+            await self.invalidation_task
+        except asyncio.CancelledError:
+            pass
+
+        self.invalidation_task = None
+
+    async def listen_for_invalidations(self) -> None:
+        """
+        evict keys changed by any instance from the in-process cache; if the subscription drops,
+        the in-process cache is cleared and the short ttls are used until subscribed again, since
+        messages published in the meantime are lost; a dropped connection is detected by the
+        health check, so keys are never stale for longer than L1_SUBSCRIBED_TTL
+        """
+        while True:
+            client = self._create_pubsub_client() if self.cluster else self.redis
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+
+            try:
+                await pubsub.subscribe(RedisKeys.cache_invalidation())
+
+                # anything cached before subscribing might have missed an invalidation
+                self.cache.flushall()
+                self.invalidation_subscribed = True
+                logger.info("subscribed to cache invalidations")
+
+                while True:
+                    message = await pubsub.get_message(timeout=1.0)
+                    if message is None:
+                        continue
+
+                    try:
+                        keys = json.loads(message["data"])
+                    except (TypeError, ValueError):
+                        logger.warning(f"invalid cache invalidation message: {message['data']}")
+                        continue
+
+                    for key in keys:
+                        self._del(key)
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"lost the cache invalidation subscription, will retry: {str(e)}")
+            finally:
+                self.invalidation_subscribed = False
+                self.cache.flushall()
+
+                try:
+                    await pubsub.aclose()
+                    if client is not self.redis:
+                        await client.aclose()
+                except Exception:
+                    pass
+
+            await asyncio.sleep(INVALIDATION_RETRY_DELAY)
+
     @property
     def redis(self):
-        if self.redis_pool is None:
+        if self.redis_instance is not None:
             return self.redis_instance
-        return redis.asyncio.Redis(connection_pool=self.redis_pool, decode_responses=True)
+
+        loop = asyncio.get_running_loop()
+
+        # only created once per loop, instead of a new client on every access
+        client = self.redis_clients.get(loop)
+        if client is None:
+            client = self._create_redis_client()
+            self.redis_clients[loop] = client
+
+        return client
 
     async def _flushall(self) -> None:
         await self.redis.flushdb()
@@ -880,10 +1686,18 @@ class CacheRedis(ICache):
         if ttl is None:
             self.cache.set(key, val)
         else:
-            self.cache.set(key, val, ttl=ttl)
+            self.cache.set(key, val, ttl=self._l1_ttl(ttl))
+
+    def _l1_ttl(self, ttl: int) -> int:
+        # while subscribed, changes made by other instances evict the keys, so they can be kept longer
+        if self.invalidation_subscribed:
+            return max(ttl, L1_SUBSCRIBED_TTL)
+        return ttl
 
     def _get(self, key):
-        return self.cache.get(key)
+        value = self.cache.get(key)
+        self.metrics.record_l1(key, value is not None)
+        return value
 
     def _del(self, key) -> None:
         self.cache.delete(key)
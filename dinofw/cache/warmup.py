@@ -0,0 +1,84 @@
+import asyncio
+import time
+from typing import Optional
+
+from loguru import logger
+
+from dinofw.utils import config_or_default
+from dinofw.utils import split_into_chunks
+from dinofw.utils.config import ConfigKeys
+from dinofw.utils.config import DefaultValues
+
+
+class CacheWarmUp:
+    """
+    after a deploy, every instance starts with an empty in-process cache, and many of the
+    redis keys might have expired during the rollout; before reporting itself as ready, the
+    membership, type and status of the most recently active groups, and the total unread
+    count of their most recently active users, are loaded, for at most `warmup_budget` seconds
+    """
+
+    def __init__(self, env):
+        self.env = env
+
+        def get(key, default):
+            return int(float(config_or_default(env, key, ConfigKeys.CACHE_SERVICE, default)))
+
+        self.max_groups = get(ConfigKeys.WARMUP_GROUPS, DefaultValues.WARMUP_GROUPS)
+        self.max_users = get(ConfigKeys.WARMUP_USERS, DefaultValues.WARMUP_USERS)
+        self.budget = get(ConfigKeys.WARMUP_BUDGET, DefaultValues.WARMUP_BUDGET)
+
+        self.task: Optional[asyncio.Task] = None
+        self.finished = False
+        self.timed_out = False
+        self.n_groups = 0
+        self.n_users = 0
+        self.elapsed = None
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self.run())
+
+    async def run(self) -> None:
+        before = time.perf_counter()
+
+        try:
+            await asyncio.wait_for(self.warm_up(), timeout=self.budget)
+        except asyncio.TimeoutError:
+            self.timed_out = True
+            logger.warning(f"cache warm-up didn't finish within {self.budget}s, continuing with a partly warm cache")
+        except Exception as e:
+            # a cold cache is slower, not broken, so never fail the startup
+            logger.error(f"could not warm up cache: {str(e)}")
+            logger.exception(e)
+        finally:
+            self.elapsed = time.perf_counter() - before
+            self.finished = True
+
+        logger.info(
+            f"cache warm-up done in {self.elapsed:.2f}s: {self.n_groups} groups, {self.n_users} users"
+        )
+        self.env.stats.timing("cache.warmup", self.elapsed * 1000)
+
+    async def warm_up(self) -> None:
+        async with self.env.SessionLocal() as db:
+            groups = await self.env.db.get_recently_active_groups(self.max_groups, db)
+            group_ids = [group_id for group_id, _, _ in groups]
+
+            # in chunks, so the groups done so far stay cached if the budget runs out
+            for chunk in split_into_chunks(groups, DefaultValues.BULK_CHUNK_SIZE):
+                await self.env.cache.set_missing_group_types_and_status(
+                    {group_id: group_type for group_id, group_type, _ in chunk},
+                    {group_id: status for group_id, _, status in chunk},
+                )
+                await self.env.db.get_user_ids_and_join_time_in_groups(
+                    [group_id for group_id, _, _ in chunk], db
+                )
+                self.n_groups += len(chunk)
+
+            user_ids = await self.env.db.get_recently_active_user_ids(group_ids, self.max_users, db)
+
+            for user_id in user_ids:
+                # counts from the db and caches it, unless already cached
+                await self.env.rest.user.count_unread(user_id, db)
+                self.n_users += 1
+
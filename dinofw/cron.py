@@ -1,10 +1,24 @@
+import asyncio
 import os
 import sys
+from time import time
+from typing import List
+from typing import Set
 
 from fastapi import FastAPI
 from loguru import logger
 
+from dinofw.rest.models import DeletionPlan
+from dinofw.rest.models import DeletionPlanGroup
+from dinofw.rest.models import DeletionRunSummary
 from dinofw.utils import environ
+from dinofw.utils import split_into_chunks
+from dinofw.utils import to_ts
+from dinofw.utils.config import DefaultValues
+from dinofw.utils.config import GroupTypes
+from dinofw.utils.perf import report_gauge
+from dinofw.utils.perf import report_incr
+from dinofw.utils.perf import report_timing
 
 
 class Deleter:
@@ -13,40 +27,206 @@ class Deleter:
 
         logger.info("initializing Deleter...")
 
-    async def run_deletions(self):
-        # TODO: add timings and report to grafana
+    async def run_deletions(self, full_sweep: bool = False) -> DeletionRunSummary:
+        """
+        reports timings per phase (query, cassandra delete, first_message_time
+        update) and a summary for the whole run
+        """
+        before = time()
+        summary = DeletionRunSummary(full_sweep=full_sweep)
 
-        logger.info("fetching groups with un-deleted messages...")
-        session = environ.env.SessionLocal()
-        groups = await self.env.db.get_groups_with_undeleted_messages(session)
+        if full_sweep:
+            logger.info("fetching groups with un-deleted messages (full sweep)...")
+            groups = await self.get_groups_to_delete(summary)
 
+            report_gauge("deleter.full_sweep.groups", len(groups))
+
+            # checkpoint; if the sweep is interrupted, the remaining groups are handled by the next run
+            await self.env.cache.add_deletion_candidates_in_progress([group_id for group_id, _ in groups])
+            await self.delete_in_groups(groups, summary)
+
+        else:
+            candidates = list(await self.env.cache.take_deletion_candidates())
+            summary.candidates = len(candidates)
+
+            if len(candidates) == 0:
+                logger.info("no deletion candidates, exiting!")
+            else:
+                logger.info(f"evaluating {len(candidates)} deletion candidates...")
+                report_gauge("deleter.candidates", len(candidates))
+
+            for candidates_chunk in split_into_chunks(candidates, DefaultValues.BULK_CHUNK_SIZE):
+                groups = await self.get_groups_to_delete(summary, group_ids=candidates_chunk)
+
+                # candidates without anything to delete are done
+                nothing_to_delete = set(candidates_chunk) - {group_id for group_id, _ in groups}
+                await self.env.cache.remove_deletion_candidates_in_progress(list(nothing_to_delete))
+
+                await self.delete_in_groups(groups, summary)
+
+        summary.elapsed_ms = (time() - before) * 1000
+        self.report_summary(summary)
+
+        return summary
+
+    async def plan_deletions(self, full_sweep: bool = False) -> DeletionPlan:
+        """
+        dry run; find the same groups as run_deletions() would, and count what would
+        be deleted in them, without deleting anything or consuming the candidates
+        """
+        summary = DeletionRunSummary(full_sweep=full_sweep)
+
+        if full_sweep:
+            groups = await self.get_groups_to_delete(summary)
+        else:
+            candidates = list(await self.env.cache.get_deletion_candidates())
+            groups = list()
+
+            for candidates_chunk in split_into_chunks(candidates, DefaultValues.BULK_CHUNK_SIZE):
+                groups.extend(await self.get_groups_to_delete(summary, group_ids=candidates_chunk))
+
+        semaphore = asyncio.Semaphore(DefaultValues.DELETER_CONCURRENCY)
+
+        async def plan_group(group_id, delete_before) -> DeletionPlanGroup:
+            async with semaphore:
+                return DeletionPlanGroup(
+                    group_id=group_id,
+                    delete_before=to_ts(delete_before),
+                    message_count=await self.env.storage.count_messages_in_group_before(group_id, delete_before),
+                    attachment_count=await self.env.storage.count_attachments_in_group_before(group_id, delete_before),
+                    # messages and attachments are removed with one range delete each
+                    tombstones=2,
+                )
+
+        planned_groups = await asyncio.gather(*[
+            plan_group(group_id, delete_before)
+            for group_id, delete_before in groups
+        ])
+
+        return DeletionPlan(
+            full_sweep=full_sweep,
+            groups=planned_groups,
+            message_count=sum(group.message_count for group in planned_groups),
+            attachment_count=sum(group.attachment_count for group in planned_groups),
+            tombstones=sum(group.tombstones for group in planned_groups),
+        )
+
+    async def get_groups_to_delete(self, summary: DeletionRunSummary, group_ids: List[str] = None):
+        # messages in rooms expire by themselves if written with a ttl; a full sweep
+        # still includes rooms, to clean up messages written before ttl was enabled
+        skip_group_types = None
+        if group_ids is not None and self.env.storage.room_message_ttl is not None:
+            skip_group_types = GroupTypes.public_group_types
+
+        before = time()
+
+        async with self.env.SessionLocal() as session:
+            groups = await self.env.db.get_groups_with_undeleted_messages(
+                session, group_ids=group_ids, skip_group_types=skip_group_types
+            )
+
+        elapsed = (time() - before) * 1000
+        summary.query_ms += elapsed
+        report_timing("deleter.query", elapsed)
+
+        return groups
+
+    # noinspection PyMethodMayBeStatic
+    def report_summary(self, summary: DeletionRunSummary) -> None:
+        report_gauge("deleter.run.groups", summary.groups)
+        report_gauge("deleter.run.failed", summary.failed)
+        report_timing("deleter.run", summary.elapsed_ms)
+
+        logger.info(
+            f"deleter run finished: full_sweep={summary.full_sweep}, candidates={summary.candidates}, "
+            f"groups={summary.groups}, failed={summary.failed}, query={summary.query_ms:.0f}ms, "
+            f"delete={summary.delete_ms:.0f}ms, update={summary.update_ms:.0f}ms, "
+            f"elapsed={summary.elapsed_ms:.0f}ms"
+        )
+
+    async def delete_in_groups(self, groups, summary: DeletionRunSummary = None) -> Set[str]:
+        """
+        delete messages in multiple groups at the same time; each group is removed
+        from the in-progress candidates when done, so an interrupted run continues
+        where it left off, and failed groups are retried on the next run
+
+        :return: the ids of the groups where deletion failed
+        """
         if len(groups) == 0:
-            logger.info("no groups with un-deleted messages, exiting!")
-            return
+            logger.info("no groups with un-deleted messages")
+            return set()
+
+        if summary is None:
+            summary = DeletionRunSummary(full_sweep=False)
+
+        logger.info(f"about to range delete messages/attachments for {len(groups)} groups...")
+        semaphore = asyncio.Semaphore(DefaultValues.DELETER_CONCURRENCY)
+
+        async def delete_in_group(group_id, delete_before) -> bool:
+            async with semaphore:
+                logger.info(f"group {group_id}: delete all messages <= {delete_before}")
+
+                try:
+                    before = time()
+                    await self.env.storage.delete_messages_in_group_before(group_id, delete_before)
+                    await self.env.storage.delete_attachments_in_group_before(group_id, delete_before)
+
+                    elapsed = (time() - before) * 1000
+                    summary.delete_ms += elapsed
+                    report_timing("deleter.delete", elapsed)
+
+                    before = time()
+                    async with self.env.SessionLocal() as session:
+                        await self.env.db.update_first_message_time(group_id, delete_before, session)
+
+                    elapsed = (time() - before) * 1000
+                    summary.update_ms += elapsed
+                    report_timing("deleter.update_first_message_time", elapsed)
+
+                    await self.env.cache.remove_deletion_candidates_in_progress([group_id])
+                    report_incr("deleter.groups.deleted")
+                    return True
 
-        logger.info(f"about to batch delete messages/attachments for {len(groups)} groups...")
-        for group_id, delete_before in groups:
-            logger.info(f"group {group_id}: delete all messages <= {delete_before}")
+                except Exception as e:
+                    logger.error(f"could not delete messages for group {group_id}: {str(e)}")
+                    logger.exception(e)
+                    environ.env.capture_exception(sys.exc_info())
+                    report_incr("deleter.groups.failed")
+                    return False
 
-            try:
-                await self.env.storage.delete_messages_in_group_before(group_id, delete_before)
-                await self.env.storage.delete_attachments_in_group_before(group_id, delete_before)
-                await self.env.db.update_first_message_time(group_id, delete_before, session)
-            except Exception as e:
-                logger.error(f"could not delete messages for group {group_id}: {str(e)}")
-                logger.exception(e)
-                environ.env.capture_exception(sys.exc_info())
+        results = await asyncio.gather(*[
+            delete_in_group(group_id, delete_before)
+            for group_id, delete_before in groups
+        ])
+
+        failed = {
+            group_id for (group_id, _), deleted in zip(groups, results)
+            if not deleted
+        }
+
+        summary.groups += len(groups)
+        summary.failed += len(failed)
+
+        return failed
 
 
 deleter = Deleter(environ.env)
 app = FastAPI()
 
 
-@app.delete("/v1/run")
-async def run_deletions():
+@app.delete("/v1/run", response_model=DeletionRunSummary)
+async def run_deletions(full_sweep: bool = False):
     """
     Call periodically to delete old messages.
 
+    Only groups where `delete_before` has changed, or where a user has left,
+    since the last run are evaluated. Set `full_sweep=true` to instead evaluate
+    all groups, e.g. to verify that no candidates were missed, or after the
+    cache has been flushed.
+
+    If `history.room_message_ttl` is enabled, messages in rooms expire by ttl
+    and rooms are skipped, except during a full sweep.
+
     First we find potential groups that may have old messages:
 
     ```sql
@@ -72,7 +252,20 @@ async def run_deletions():
     Then we remove all Messages and Attachments with `created_at <= min(delete_before)`. Finally
     we update `first_message_time` on those groups to `min(delete_before)` for that group.
     """
-    await deleter.run_deletions()
+    return await deleter.run_deletions(full_sweep=full_sweep)
+
+
+@app.get("/v1/plan", response_model=DeletionPlan)
+async def plan_deletions(full_sweep: bool = False):
+    """
+    Dry run of `/v1/run`; returns the groups that would be evaluated, and how many
+    messages and attachments would be deleted in each, without deleting anything.
+
+    Each group is cleared with one range delete for messages and one for attachments,
+    so the deletion itself writes two tombstones per group, independent of how many
+    rows are removed; the counted rows are what the tombstones shadow until compaction.
+    """
+    return await deleter.plan_deletions(full_sweep=full_sweep)
 
 
 @app.on_event("startup")
@@ -1,33 +1,46 @@
 import datetime
 import json
 from datetime import datetime as dt
+from typing import AsyncIterator
 from typing import Dict, Union
 from typing import List
 from typing import Optional
+from typing import Set
 from typing import Tuple
 from uuid import uuid4 as uuid
 
 import arrow
 from loguru import logger
 from pydantic.fields import defaultdict
+from sqlalchemy import Integer
+from sqlalchemy import String
+from sqlalchemy import DateTime
 from sqlalchemy import case
+from sqlalchemy import cast
 from sqlalchemy import func
+from sqlalchemy import delete
+from sqlalchemy import insert
 from sqlalchemy import update
 from sqlalchemy import literal
 from sqlalchemy import distinct
 from sqlalchemy import or_
+from sqlalchemy import select
 from sqlalchemy import and_
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import load_only
+from sqlalchemy.orm import aliased
 
 from dinofw.db.rdbms.handler_stats import UpdateUserGroupStatsHandler
 from dinofw.db.rdbms.models import GroupEntity, DeletedStatsEntity
 from dinofw.db.rdbms.models import UserGroupStatsEntity
 from dinofw.db.rdbms.schemas import GroupBase, DeletedStatsBase
-from dinofw.db.rdbms.schemas import UserGroupBase
+from dinofw.db.rdbms.schemas import GroupRecord
+from dinofw.db.rdbms.schemas import UserGroupRecord
+from dinofw.db.rdbms.schemas import UserGroupStatsRecord
 from dinofw.db.rdbms.schemas import UserGroupStatsBase
 from dinofw.db.storage.schemas import MessageBase
+from dinofw.endpoint import IClientPublishHandler
 from dinofw.rest.queries import CreateGroupQuery, PublicGroupQuery, SendMessageQuery, ActionLogQuery
 from dinofw.rest.queries import GroupQuery
 from dinofw.rest.queries import GroupUpdatesQuery
@@ -41,9 +54,12 @@ from dinofw.utils import users_to_group_id
 from dinofw.utils import utcnow_dt
 from dinofw.utils import utcnow_ts
 from dinofw.utils.config import GroupTypes, ConfigKeys, GroupStatus, MessageTypes
+from dinofw.utils.config import DefaultValues
 from dinofw.utils.exceptions import NoSuchGroupException, NoSuchUserException, UserStatsOrGroupAlreadyCreated
 from dinofw.utils.exceptions import UserNotInGroupException
 from dinofw.utils.perf import time_coroutine
+from dinofw.utils.perf import report_gauge
+from dinofw.utils.perf import report_timing
 
 
 def filter_whisper_users_if_any(
@@ -305,7 +321,7 @@ class RelationalHandler:
         user_id: int,
         query: GroupQuery,
         db: AsyncSession
-    ) -> List[UserGroupBase]:
+    ) -> List[UserGroupRecord]:
         """
         what we're doing:
 
@@ -415,9 +431,9 @@ class RelationalHandler:
 
     async def count_total_unread(self, user_id: int, db: AsyncSession) -> (int, List[str]):
         """
-        count all unread messages for a user, including bookmarked groups
-
-        postgres query:
+        count all unread messages for a user, including bookmarked groups, and collect
+        the ids of the groups that count as unread, in a single scan of the user's rows
+        (uses the partial index 'ix_user_group_stats_user_id_unread'):
 
             select
                 coalesce(
@@ -426,12 +442,17 @@ class RelationalHandler:
                 0) +
                 coalesce(
                     sum(mentions)
-                    filter (where bookmark = false and notifications = false),
+                    filter (where notifications = false),
                 0) +
                 coalesce(
                     count(1) filter (where bookmark = true),
                 0) as unread_count,
-                count(distinct group_id) as n_unread_groups
+                array_agg(group_id) filter (
+                    where
+                        bookmark = true or
+                        (notifications = true and unread_count > 0) or
+                        (notifications = false and mentions > 0)
+                ) as unread_group_ids
             from
                 user_group_stats
             where
@@ -444,8 +465,8 @@ class RelationalHandler:
                     mentions > 0
                 );
         """
-        unread_count = await db.run_sync(lambda _db:
-            _db.query(
+        result = await db.execute(
+            select(
                 func.coalesce(
                     func.sum(UserGroupStatsEntity.unread_count).filter(
                         UserGroupStatsEntity.bookmark.is_(False),
@@ -459,9 +480,25 @@ class RelationalHandler:
                 ) +
                 func.coalesce(
                     func.count(1).filter(UserGroupStatsEntity.bookmark.is_(True)), 0
+                ),
+                func.array_agg(UserGroupStatsEntity.group_id).filter(
+                    or_(
+                        # any bookmarked group counts as having unread messages
+                        UserGroupStatsEntity.bookmark.is_(True),
+                        and_(
+                            # real unread count only counts as unread if notifications are enabled
+                            UserGroupStatsEntity.notifications.is_(True),
+                            UserGroupStatsEntity.unread_count > 0
+                        ),
+                        and_(
+                            # if they're not enabled, the user must have been mentioned to count as an unread group
+                            UserGroupStatsEntity.notifications.is_(False),
+                            UserGroupStatsEntity.mentions > 0
+                        )
+                    )
                 )
             )
-            .filter(
+            .where(
                 UserGroupStatsEntity.user_id == user_id,
                 UserGroupStatsEntity.hide.is_(False),
                 UserGroupStatsEntity.deleted.is_(False),
@@ -471,45 +508,11 @@ class RelationalHandler:
                     UserGroupStatsEntity.mentions > 0
                 )
             )
-            .first()
         )
+        unread_count, unread_group_ids = result.one()
 
-        unread_group_ids = await db.run_sync(lambda _db:
-            _db.query(
-                UserGroupStatsEntity
-            )
-            .filter(
-                UserGroupStatsEntity.user_id == user_id,
-                UserGroupStatsEntity.hide.is_(False),
-                UserGroupStatsEntity.deleted.is_(False),
-                or_(
-                    # any bookmarked group counts as having unread messages
-                    UserGroupStatsEntity.bookmark.is_(True),
-                    and_(
-                        # real unread count only counts as unread if notifications are enabled
-                        UserGroupStatsEntity.notifications.is_(True),
-                        UserGroupStatsEntity.unread_count > 0
-                    ),
-                    and_(
-                        # if they're not enabled, the user must have been mentioned to count as an unread group
-                        UserGroupStatsEntity.notifications.is_(False),
-                        UserGroupStatsEntity.mentions > 0
-                    )
-                )
-            )
-            .options(load_only("group_id"))
-            .all()
-        )
-
-        unread_group_ids = [
-            unread_group.group_id for unread_group in unread_group_ids
-        ]
-
-        # if the user has NO groups, sqlalchemy will return None not 0
-        if unread_count[0] is None:
-            unread_count = (0,)
-
-        return unread_count[0], unread_group_ids
+        # if the user has NO groups, postgres will return null for the aggregates
+        return unread_count or 0, list(unread_group_ids or [])
 
     async def get_groups_updated_since(
         self,
@@ -608,7 +611,11 @@ class RelationalHandler:
         receiver_stats: List[UserGroupStatsEntity],
         user_id: int,
         query: GroupQuery
-    ) -> List[UserGroupBase]:
+    ) -> List[UserGroupRecord]:
+        """
+        uses the slotted records instead of pydantic models, since validating
+        several models for each group on an inbox page adds up
+        """
         def count_for_group(_group, _stats):
             _unread_count = -1
             _receiver_unread_count = -1
@@ -635,7 +642,7 @@ class RelationalHandler:
 
         receivers = dict()
         for stat in receiver_stats:
-            receivers[stat.group_id] = UserGroupStatsBase(**stat.__dict__)
+            receivers[stat.group_id] = UserGroupStatsRecord.from_entity(stat)
 
         # batch all redis/db queries for join times
         group_users_join_time = await self.get_user_ids_and_join_time_in_groups(
@@ -645,8 +652,8 @@ class RelationalHandler:
 
         groups = list()
         for group_entity, user_group_stats_entity in results:
-            group = GroupBase(**group_entity.__dict__)
-            user_group_stats = UserGroupStatsBase(**user_group_stats_entity.__dict__)
+            group = GroupRecord.from_entity(group_entity)
+            user_group_stats = UserGroupStatsRecord.from_entity(user_group_stats_entity)
 
             unread_count, receiver_unread_count = count_for_group(group, user_group_stats)
 
@@ -655,7 +662,7 @@ class RelationalHandler:
                 receiver_stat = receivers[group.group_id]
 
             join_times = group_users_join_time.get(group_entity.group_id, dict())
-            user_group = UserGroupBase(
+            user_group = UserGroupRecord(
                 group=group,
                 user_stats=user_group_stats,
                 user_join_times=join_times,
@@ -704,27 +711,27 @@ class RelationalHandler:
                 )
 
                 if len(user_to_hidden_stats):
-                    for user_id in user_to_hidden_stats.keys():
-                        # if the group had unread and then notifications were disabled and
-                        # then was hidden, don't restore unread count on new message
-                        if user_id not in user_ids_with_notification_on:
-                            continue
-
-                        amount = user_to_hidden_stats[user_id].unread_count + 1
-                        await self.env.cache.increase_total_unread_message_count([user_id], amount, pipeline=p)
+                    # if the group had unread and then notifications were disabled and
+                    # then was hidden, don't restore unread count on new message
+                    total_unread = {
+                        user_id: stats.unread_count + 1
+                        for user_id, stats in user_to_hidden_stats.items()
+                        if user_id in user_ids_with_notification_on
+                    }
                 else:
                     # update total unread count for all users that have notifications enabled
-                    await self.env.cache.increase_total_unread_message_count(user_ids_with_notification_on, 1, pipeline=p)
-
-                # unread in THIS group should increase whether notifications are on or off
-                await self.env.cache.increase_unread_in_group_for(message.group_id, non_sender_user_ids, pipeline=p)
-                await self.env.cache.add_unread_group(non_sender_user_ids, message.group_id, pipeline=p)
+                    total_unread = {user_id: 1 for user_id in user_ids_with_notification_on}
 
                 # if notifications are disabled BUT the user was mentioned, increase the total unread count anyway
                 if mentions and len(mentions):
                     for mention_user_id in mentions:
                         if mention_user_id not in user_ids_with_notification_on:
-                            await self.env.cache.increase_total_unread_message_count([mention_user_id], 1, pipeline=p)
+                            total_unread[mention_user_id] = total_unread.get(mention_user_id, 0) + 1
+
+                # unread in THIS group should increase whether notifications are on or off
+                await self.env.cache.increase_unread_for_new_message(
+                    message.group_id, non_sender_user_ids, total_unread, pipeline=p
+                )
 
         async def increase_mentions():
             await db.run_sync(lambda _db:
@@ -794,9 +801,14 @@ class RelationalHandler:
 
             if unhide_group:
                 await self.env.cache.set_hide_group(group.group_id, False)
-                await db.run_sync(lambda _db: statement.update({
-                    UserGroupStatsEntity.hide: False
-                }))
+
+                # if the receivers were fetched we already know if anyone has hidden the group
+                if receivers_in_group is None or len(user_to_hidden_stats):
+                    await db.run_sync(lambda _db: statement.filter(
+                        UserGroupStatsEntity.hide.is_(True)
+                    ).update({
+                        UserGroupStatsEntity.hide: False
+                    }))
 
         group = await db.run_sync(lambda _db:
             _db.query(GroupEntity)
@@ -806,6 +818,7 @@ class RelationalHandler:
         sent_time = message.created_at
         is_whisper = False
         receivers_in_group = None
+        user_to_hidden_stats = dict()
 
         if group is None:
             raise NoSuchGroupException(message.group_id)
@@ -869,6 +882,173 @@ class RelationalHandler:
 
         return group_base
 
+    async def update_groups_new_action_logs(
+        self,
+        logs: List[MessageBase],
+        sender_user_id: int,
+        query: ActionLogQuery,
+        db: AsyncSession
+    ) -> None:
+        """
+        Bulk version of update_group_new_message() and update_last_read_and_sent_in_group_for_user(), used
+        when the same action log has been created in many groups at once (e.g. when a user leaves all groups).
+        Instead of one transaction per group, each table is updated with a single statement joined against
+        the new logs, and all cache changes are flushed in one pipeline:
+
+            update groups
+            set
+                last_message_id = logs.message_id,
+                last_message_time = logs.created_at,
+                ...
+            from
+                unnest(:group_ids, :message_ids, :created_ats) as logs(group_id, message_id, created_at)
+            where
+                groups.group_id = logs.group_id;
+        """
+        if not len(logs):
+            return
+
+        # all logs have the same sender, type and payload, only the group, id and time differ
+        logs_table = func.unnest(
+            cast([log.group_id for log in logs], ARRAY(String)),
+            cast([log.message_id for log in logs], ARRAY(String)),
+            cast([log.created_at for log in logs], ARRAY(DateTime(timezone=True)))
+        ).table_valued("group_id", "message_id", "created_at").render_derived(name="logs")
+
+        # query all receivers before updating, to know which cached values have to be changed
+        receivers = await db.execute(
+            select(UserGroupStatsEntity.group_id, UserGroupStatsEntity.user_id)
+            .where(
+                UserGroupStatsEntity.group_id == logs_table.c.group_id,
+                UserGroupStatsEntity.user_id != sender_user_id,
+                UserGroupStatsEntity.kicked.is_(False)
+            )
+        )
+        group_to_receivers = defaultdict(list)
+        for group_id, user_id in receivers.all():
+            group_to_receivers[group_id].append(user_id)
+
+        group_values = dict()
+
+        # some action logs don't need to update last message
+        if query.update_last_message:
+            group_values[GroupEntity.last_message_id] = logs_table.c.message_id
+            group_values[GroupEntity.last_message_type] = logs[0].message_type
+            group_values[GroupEntity.last_message_user_id] = logs[0].user_id
+            group_values[GroupEntity.last_message_overview] = truncate_json_message(
+                logs[0].message_payload,
+                limit=600,
+                only_content=True
+            )
+
+            # sometimes we don't want to change the order of conversations on action log creation
+            if query.update_last_message_time:
+                group_values[GroupEntity.last_message_time] = logs_table.c.created_at
+
+        # always update this, unless it's a nickname change or some other action log
+        if query.update_group_updated_at:
+            group_values[GroupEntity.updated_at] = logs_table.c.created_at
+
+        if len(group_values):
+            await db.execute(
+                update(GroupEntity)
+                .where(GroupEntity.group_id == logs_table.c.group_id)
+                .values(group_values)
+                .execution_options(synchronize_session=False)
+            )
+
+        receiver_values = {
+            UserGroupStatsEntity.last_updated_time: logs_table.c.created_at
+        }
+        if query.update_unread_count:
+            receiver_values[UserGroupStatsEntity.unread_count] = UserGroupStatsEntity.unread_count + 1
+            receiver_values[UserGroupStatsEntity.deleted] = False
+        if query.unhide_group:
+            receiver_values[UserGroupStatsEntity.hide] = False
+
+        await db.execute(
+            update(UserGroupStatsEntity)
+            .where(
+                UserGroupStatsEntity.group_id == logs_table.c.group_id,
+                UserGroupStatsEntity.user_id != sender_user_id,
+                UserGroupStatsEntity.kicked.is_(False)
+            )
+            .values(receiver_values)
+            .execution_options(synchronize_session=False)
+        )
+
+        # if the sender is still in the group, update it the same way as when sending a message
+        sender_values = {
+            UserGroupStatsEntity.last_read: logs_table.c.created_at,
+            UserGroupStatsEntity.last_sent: logs_table.c.created_at,
+            UserGroupStatsEntity.last_updated_time: logs_table.c.created_at,
+            UserGroupStatsEntity.first_sent: func.coalesce(UserGroupStatsEntity.first_sent, logs_table.c.created_at),
+            UserGroupStatsEntity.deleted: False,
+            UserGroupStatsEntity.unread_count: 0,
+
+            # -1 means it has not been counted in cassandra yet, so don't increase it
+            UserGroupStatsEntity.sent_message_count: case(
+                (UserGroupStatsEntity.sent_message_count == -1, -1),
+                else_=UserGroupStatsEntity.sent_message_count + 1
+            )
+        }
+        if query.unhide_group:
+            sender_values[UserGroupStatsEntity.hide] = False
+
+        sender_stats = await db.execute(
+            update(UserGroupStatsEntity)
+            .where(
+                UserGroupStatsEntity.group_id == logs_table.c.group_id,
+                UserGroupStatsEntity.user_id == sender_user_id,
+                UserGroupStatsEntity.kicked.is_(False)
+            )
+            .values(sender_values)
+            .returning(
+                UserGroupStatsEntity.group_id,
+                UserGroupStatsEntity.last_sent,
+                UserGroupStatsEntity.sent_message_count
+            )
+            .execution_options(synchronize_session=False)
+        )
+        sender_stats = sender_stats.all()
+
+        await db.commit()
+
+        async with self.env.cache.pipeline() as p:
+            for log in logs:
+                receiver_ids = group_to_receivers.get(log.group_id, list())
+
+                if query.update_unread_count:
+                    # for knowing if we need to send read-receipts when user opens a conversation
+                    await self.env.cache.set_last_message_time_in_group(log.group_id, to_ts(log.created_at), pipeline=p)
+                    await self.env.cache.increase_unread_for_new_message(log.group_id, receiver_ids, dict(), pipeline=p)
+
+                if query.unhide_group:
+                    await self.env.cache.set_hide_group(log.group_id, False, receiver_ids, pipeline=p)
+
+            # instead of increasing the total unread count of every receiver one by one, let it be re-counted
+            if query.update_unread_count:
+                for receiver_id in {uid for uids in group_to_receivers.values() for uid in uids}:
+                    await self.env.cache.reset_total_unread_message_count(receiver_id, pipeline=p)
+
+            for group_id, last_sent, sent_message_count in sender_stats:
+                last_sent_ts = to_ts(last_sent)
+
+                await self.env.cache.set_last_read_in_group_for_user(group_id, sender_user_id, last_sent_ts, pipeline=p)
+                await self.env.cache.set_unread_in_group(group_id, sender_user_id, 0, pipeline=p)
+                await self.env.cache.set_sent_message_count_in_group_for_user(
+                    group_id, sender_user_id, sent_message_count, pipeline=p
+                )
+
+                if query.unhide_group:
+                    await self.env.cache.set_hide_group(group_id, False, [sender_user_id], pipeline=p)
+
+            if len(sender_stats):
+                # used for user global stats api
+                last_group_id, last_sent, _ = max(sender_stats, key=lambda stats: stats[1])
+                await self.env.cache.set_last_sent_for_user(sender_user_id, last_group_id, to_ts(last_sent), pipeline=p)
+                await self.env.cache.reset_total_unread_message_count(sender_user_id, pipeline=p)
+
     async def _get_then_update_sent_count(self, group_id, user_id, db):
         async def update_cache_value(_sent_count):
             # the db default value is -1, so even if it's -1, set it in the cache so that we
@@ -934,68 +1114,95 @@ class RelationalHandler:
 
         return {user_id: last_read}
 
-    async def remove_user_stats_for_offline_users(self, user_ids: List[int], db: AsyncSession) -> None:
-        logger.info("removing user stats for users (went offline): {user_ids}")
+    async def remove_user_stats_for_offline_users(self, user_ids: List[int], db: AsyncSession) -> int:
+        """
+        users leave all public groups when they go offline; after network issues
+        thousands of users can go offline at the same time, so all of them are
+        handled with a single insert into deleted_stats, a single delete and a
+        single cache pipeline, instead of a few queries per user
 
-        groups = await db.run_sync(lambda _db:
-            _db.query(
-                GroupEntity.group_id,
-                GroupEntity.group_type,
-                UserGroupStatsEntity.user_id
-            )
-            .join(
-                UserGroupStatsEntity,
-                UserGroupStatsEntity.group_id == GroupEntity.group_id
-            )
-            .filter(
-                UserGroupStatsEntity.user_id.in_(user_ids),
-                GroupEntity.group_type.in_(GroupTypes.public_group_types)
-            )
-            .all()
+        :return: the number of removed user stats
+        """
+        if not len(user_ids):
+            return 0
+
+        logger.info(f"removing user stats for {len(user_ids)} users (went offline)")
+        before = utcnow_ts()
+
+        offline_user_ids = select(func.unnest(cast(user_ids, ARRAY(Integer)))).scalar_subquery()
+        in_public_groups = and_(
+            UserGroupStatsEntity.group_id == GroupEntity.group_id,
+            UserGroupStatsEntity.user_id.in_(offline_user_ids),
+            GroupEntity.group_type.in_(GroupTypes.public_group_types),
         )
 
-        user_to_group_and_type = dict()
-        for group_id, group_type, user_id in groups:
-            if user_id not in user_to_group_and_type:
-                user_to_group_and_type[user_id] = dict()
+        await self._insert_deleted_stats(in_public_groups, db)
 
-            user_to_group_and_type[user_id][group_id] = group_type
+        removed = await db.execute(
+            delete(UserGroupStatsEntity)
+            .where(in_public_groups)
+            .returning(UserGroupStatsEntity.group_id, UserGroupStatsEntity.user_id)
+            .execution_options(synchronize_session=False)
+        )
+        removed = removed.all()
 
-        for user_id in user_ids:
-            group_id_to_type = user_to_group_and_type.get(user_id, dict())
-            group_ids = list(group_id_to_type.keys())
+        if len(removed):
+            removed_table = func.unnest(
+                cast([group_id for group_id, _ in removed], ARRAY(String)),
+                cast([user_id for _, user_id in removed], ARRAY(Integer)),
+            ).table_valued("group_id", "user_id").render_derived(name="removed")
 
-            await self.copy_to_deleted_groups_table(group_id_to_type, user_id, db, skip_public=False)
-            await self.remove_user_group_stats_for_user(group_ids, user_id, db)
-            await self.env.cache.reset_count_group_types_for_user(user_id)
+            # reset owner if the user is one
+            await db.execute(
+                update(GroupEntity)
+                .where(
+                    GroupEntity.group_id == removed_table.c.group_id,
+                    GroupEntity.owner_id == removed_table.c.user_id,
+                )
+                .values(owner_id=None)
+                .execution_options(synchronize_session=False)
+            )
 
+        await db.commit()
 
-    async def get_online_users(self, db: AsyncSession) -> List[int]:
-        # don't actually expire the online list, since that one is
-        # used in other places to check individual users
-        expired = await self.env.cache.get_online_users_ttl_expired()
+        async with self.env.cache.pipeline() as p:
+            for group_id, user_id in removed:
+                await self.env.cache.remove_unread_group(user_id, group_id, pipeline=p)
+                await self.env.cache.remove_last_read_in_group_for_user(group_id, user_id, pipeline=p)
+                await self.env.cache.remove_join_time_in_group_for_user(group_id, user_id, pipeline=p)
 
-        if not expired:
-            online = await self.env.cache.get_online_users()
-            if online is not None and len(online):
-                return online
+            for user_id in user_ids:
+                await self.env.cache.reset_total_unread_message_count(user_id, pipeline=p)
+                await self.env.cache.reset_count_group_types_for_user(user_id, pipeline=p)
 
-        # also sync with the users in the db, since those are the ones that will be shown as dangling
-        # if we miss them when syncing from the offline detector; this API is also only called once
-        # every 5min or so, so it's not a big deal to have a big select query for it
-        online = await db.run_sync(lambda _db:
-            _db.query(UserGroupStatsEntity.user_id)
-            .filter(UserGroupStatsEntity.kicked.is_(False))
-            .all()
-        )
+            await self.env.cache.add_deletion_candidates(list({group_id for group_id, _ in removed}), pipeline=p)
 
-        if online and len(online):
-            online = [user[0] for user in online]
-        else:
-            online = list()
+        report_gauge("offline.batch_size", len(user_ids))
+        report_gauge("offline.removed_stats", len(removed))
+        report_timing("offline.remove_user_stats", (utcnow_ts() - before) * 1000)
+
+        return len(removed)
+
+    async def get_offline_users_in_public_groups(self, online: List[int], db: AsyncSession) -> List[int]:
+        """
+        users still in public groups (which they leave when going offline) that
+        are not in the online set, e.g. if the bridge missed their offline event;
+        only public memberships are checked, and the diff against the online
+        users is done in the db
+        """
+        online_user_ids = select(func.unnest(cast(online, ARRAY(Integer)))).scalar_subquery()
+
+        users = await db.execute(
+            select(distinct(UserGroupStatsEntity.user_id))
+            .join(GroupEntity, GroupEntity.group_id == UserGroupStatsEntity.group_id)
+            .where(
+                GroupEntity.group_type.in_(GroupTypes.public_group_types),
+                UserGroupStatsEntity.kicked.is_(False),
+                UserGroupStatsEntity.user_id.not_in(online_user_ids),
+            )
+        )
 
-        await self.env.cache.set_online_users_only(online)
-        return online
+        return users.scalars().all()
 
     async def get_last_reads_in_group(self, group_id: str, db: AsyncSession) -> Dict[int, float]:
         users = await self.env.cache.get_last_read_times_in_group(group_id)
@@ -1050,6 +1257,48 @@ class RelationalHandler:
             for group_id, group_type in group_types
         }
 
+    # noinspection PyMethodMayBeStatic
+    async def get_recently_active_groups(self, limit: int, db: AsyncSession) -> List[Tuple[str, int, int]]:
+        """
+        the groups with the latest messages, as (group_id, group_type, status), using the
+        index on last_message_time; used for warming up the cache on startup
+        """
+        result = await db.execute(
+            select(
+                GroupEntity.group_id,
+                GroupEntity.group_type,
+                GroupEntity.status,
+            )
+            .order_by(GroupEntity.last_message_time.desc())
+            .limit(limit)
+        )
+
+        return [
+            (group_id, group_type, status or 0)
+            for group_id, group_type, status in result.all()
+        ]
+
+    # noinspection PyMethodMayBeStatic
+    async def get_recently_active_user_ids(self, group_ids: List[str], limit: int, db: AsyncSession) -> List[int]:
+        """
+        last_updated_time isn't indexed, so only the users in the given groups are considered
+        """
+        if not len(group_ids):
+            return list()
+
+        result = await db.execute(
+            select(UserGroupStatsEntity.user_id)
+            .where(
+                UserGroupStatsEntity.group_id.in_(group_ids),
+                UserGroupStatsEntity.kicked.is_(False)
+            )
+            .group_by(UserGroupStatsEntity.user_id)
+            .order_by(func.max(UserGroupStatsEntity.last_updated_time).desc())
+            .limit(limit)
+        )
+
+        return list(result.scalars().all())
+
     async def copy_to_deleted_groups_table(
         self, group_id_to_type: Dict[str, int], user_id: int, db: AsyncSession, skip_public: bool = True
     ) -> None:
@@ -1062,33 +1311,45 @@ class RelationalHandler:
         else:
             group_ids = list(group_id_to_type.keys())
 
-        groups_to_copy = await db.run_sync(lambda _db:
-            _db.query(
-                UserGroupStatsEntity.group_id,
-                UserGroupStatsEntity.join_time
-            )
-            .filter(
+        if not len(group_ids):
+            return
+
+        await self._insert_deleted_stats(
+            and_(
                 UserGroupStatsEntity.group_id.in_(group_ids),
                 UserGroupStatsEntity.user_id == user_id
-            )
-            .all()
+            ),
+            db
         )
 
-        delete_time = utcnow_dt()
-        for group_id, join_time in groups_to_copy:
-            # save a copy of the entry to be deleted; sometimes we have to be
-            # able to access message history of deleted users, for legal cases
-            deleted_entity = DeletedStatsEntity(
-                user_id=user_id,
-                group_id=group_id,
-                join_time=join_time,
-                delete_time=delete_time,
-                group_type=group_id_to_type.get(group_id)
-            )
-            db.add(deleted_entity)
-
         await db.commit()
 
+    # noinspection PyMethodMayBeStatic
+    async def _insert_deleted_stats(self, where_clause, db: AsyncSession) -> None:
+        # save a copy of the entries to be deleted; sometimes we have to be able to access message
+        # history of deleted users, for legal cases; some users have thousands of groups, so copy
+        # them all with a single "insert into ... select ..." instead of one insert per group
+        await db.execute(
+            insert(DeletedStatsEntity).from_select(
+                [
+                    DeletedStatsEntity.user_id,
+                    DeletedStatsEntity.group_id,
+                    DeletedStatsEntity.join_time,
+                    DeletedStatsEntity.delete_time,
+                    DeletedStatsEntity.group_type,
+                ],
+                select(
+                    UserGroupStatsEntity.user_id,
+                    UserGroupStatsEntity.group_id,
+                    UserGroupStatsEntity.join_time,
+                    literal(utcnow_dt(), DateTime(timezone=True)),
+                    GroupEntity.group_type,
+                )
+                .outerjoin(GroupEntity, GroupEntity.group_id == UserGroupStatsEntity.group_id)
+                .where(where_clause)
+            )
+        )
+
     async def remove_user_group_stats_for_user(
         self, group_ids: List[str], user_id: int, db: AsyncSession
     ) -> None:
@@ -1134,6 +1395,9 @@ class RelationalHandler:
             await self.env.cache.remove_join_time_in_group_for_user(group_ids, user_id, pipeline=p)
             await self.env.cache.remove_user_id_and_join_time_in_groups_for_user(group_ids, user_id, pipeline=p)
 
+            # the user leaving might have had the oldest delete_before in the group
+            await self.env.cache.add_deletion_candidates(group_ids, pipeline=p)
+
         # delete the stats for this user in these groups
         await db.run_sync(lambda _db:
             _db.query(UserGroupStatsEntity)
@@ -1338,6 +1602,41 @@ class RelationalHandler:
 
         return GroupBase(**group.__dict__)
 
+    # noinspection PyMethodMayBeStatic
+    async def get_group_and_user_stats_for_1to1(
+        self, user_a: int, user_b: int, db: AsyncSession
+    ) -> Tuple[GroupBase, Dict[int, UserGroupStatsBase]]:
+        """
+        the 1v1 group and the stats of both users in one query; a user might not have any
+        stats in the group, e.g. if the profile has been deleted
+        """
+        group_id = users_to_group_id(user_a, user_b)
+
+        rows = await db.run_sync(lambda _db:
+            _db.query(GroupEntity, UserGroupStatsEntity)
+            .outerjoin(
+                UserGroupStatsEntity,
+                UserGroupStatsEntity.group_id == GroupEntity.group_id
+            )
+            .filter(
+                GroupEntity.group_type == GroupTypes.ONE_TO_ONE,
+                GroupEntity.group_id == group_id,
+            )
+            .all()
+        )
+
+        if not len(rows):
+            raise NoSuchGroupException(f"{user_a},{user_b}")
+
+        group = GroupBase(**rows[0][0].__dict__)
+        user_stats = {
+            stats.user_id: UserGroupStatsBase(**stats.__dict__)
+            for _, stats in rows
+            if stats is not None
+        }
+
+        return group, user_stats
+
     async def create_group_for_1to1(self, user_a: int, user_b: int, db: AsyncSession) -> GroupBase:
         users = sorted([user_a, user_b])
         group_name = ",".join([str(user_id) for user_id in users])
@@ -1412,6 +1711,50 @@ class RelationalHandler:
 
         return user_ids_join_time
 
+    async def is_user_in_group(self, group_id: str, user_id: int, db: AsyncSession) -> bool:
+        in_group = await self.env.cache.is_user_in_group(group_id, user_id)
+        if in_group is not None:
+            return in_group
+
+        # caches all users in the group, so the next check doesn't need the db
+        users = await self.get_user_ids_and_join_time_in_group(group_id, db)
+        return user_id in users
+
+    async def get_user_count_in_group(self, group_id: str, db: AsyncSession) -> int:
+        user_count = await self.env.cache.get_user_count_in_group(group_id)
+        if user_count is not None:
+            return user_count
+
+        users = await self.get_user_ids_and_join_time_in_group(group_id, db)
+        return len(users)
+
+    async def iter_user_ids_in_group(
+        self, group_id: str, db: AsyncSession, batch_size: int = DefaultValues.USER_ID_BATCH_SIZE
+    ) -> AsyncIterator[List[int]]:
+        batches = await self.env.cache.iter_user_ids_in_group(group_id, batch_size)
+
+        if batches is None:
+            users = await self.get_user_ids_and_join_time_in_group(group_id, db)
+
+            for user_ids in split_into_chunks(list(users.keys()), batch_size):
+                yield user_ids
+            return
+
+        async for user_ids in batches:
+            yield user_ids
+
+    async def get_read_receipt_receivers(self, group_id: str, user_id: int, db: AsyncSession) -> List[int]:
+        """
+        read receipts are only sent in groups with a few users, so the users of bigger
+        groups are only counted, instead of fetched just to be discarded
+        """
+        max_users = IClientPublishHandler.MAX_READ_RECEIPT_RECEIVERS + 1
+        if await self.get_user_count_in_group(group_id, db) > max_users:
+            return list()
+
+        users = await self.get_user_ids_and_join_time_in_group(group_id, db)
+        return [receiver_id for receiver_id in users.keys() if receiver_id != user_id]
+
     # noinspection PyMethodMayBeStatic
     async def group_exists(self, group_id: str, db: AsyncSession) -> bool:
         group = await db.run_sync(lambda _db:
@@ -1424,13 +1767,12 @@ class RelationalHandler:
 
     # noinspection PyMethodMayBeStatic
     async def set_groups_updated_at(self, group_ids: List[str], now: dt, db: AsyncSession) -> None:
-        await db.run_sync(lambda _db:
-            _db.query(GroupEntity)
-            .filter(GroupEntity.group_id.in_(group_ids))
-            .update(
-                {GroupEntity.updated_at: now},
-                synchronize_session='fetch'
-            )
+        await db.execute(
+            update(GroupEntity)
+            .where(GroupEntity.group_id.in_(group_ids))
+            .values(updated_at=now)
+            # no ORM state to sync, could be thousands of groups if a user is leaving all groups
+            .execution_options(synchronize_session=False)
         )
         await db.commit()
 
@@ -1558,45 +1900,68 @@ class RelationalHandler:
         return types
 
     # noinspection PyMethodMayBeStatic
-    async def set_last_updated_at_on_all_stats_related_to_user(self, user_id: int, db: AsyncSession):
+    async def set_last_updated_at_on_all_stats_related_to_user(
+            self, user_id: int, db: AsyncSession, since: dt = None
+    ) -> int:
+        """
+        set last_updated_time on all stats in all groups this user is in (e.g. if
+        the user got blocked, the other users in the group needs to re-sync);
+        the groups are selected in the db, and updated in batches of groups, each
+        batch in its own transaction, to not hold locks on the stats of users with
+        >10k conversations for too long
+
+        :param since: only update groups where this user's stats has been updated since this time
+        :return: the number of updated stats
+        """
         now = utcnow_dt()
+        before = utcnow_ts()
 
-        group_ids = await db.run_sync(lambda _db:
-            _db.query(UserGroupStatsEntity.group_id)
-            .filter(
-                UserGroupStatsEntity.user_id == user_id
-            )
-            .all()
-        )
+        last_group_id = ""
+        n_groups = 0
+        n_stats = 0
 
-        # query returns a single-item tuple of each group_id
-        if len(group_ids):
-            group_ids = [gid[0] for gid in group_ids]
+        while True:
+            group_ids = (
+                select(UserGroupStatsEntity.group_id)
+                .where(
+                    UserGroupStatsEntity.user_id == user_id,
+                    UserGroupStatsEntity.group_id > last_group_id,
+                )
+                .order_by(UserGroupStatsEntity.group_id)
+                .limit(DefaultValues.BULK_CHUNK_SIZE)
+            )
 
-        before = None
-        if len(group_ids) > 250:
-            before = utcnow_ts()
+            if since is not None:
+                group_ids = group_ids.where(UserGroupStatsEntity.last_updated_time >= since)
 
-        # some users have >10k conversations; split into chunks to not overload the db
-        for group_id_chunk in split_into_chunks(group_ids, 500):
-            await db.run_sync(lambda _db:
-                _db.query(UserGroupStatsEntity)
-                .filter(
-                    UserGroupStatsEntity.group_id.in_(group_id_chunk)
-                )
-                .update(
-                    {UserGroupStatsEntity.last_updated_time: now},
-                    synchronize_session="fetch",
-                )
+            updated = await db.execute(
+                update(UserGroupStatsEntity)
+                .where(UserGroupStatsEntity.group_id.in_(group_ids.scalar_subquery()))
+                .values(last_updated_time=now)
+                .returning(UserGroupStatsEntity.group_id)
+                .execution_options(synchronize_session=False)
             )
+            updated_group_ids = updated.scalars().all()
+            await db.commit()
 
-        await db.commit()
+            if not len(updated_group_ids):
+                break
 
-        if before is not None:
-            the_time = utcnow_ts() - before
-            the_time = "%.2f" % the_time
+            batch_group_ids = set(updated_group_ids)
+            n_groups += len(batch_group_ids)
+            n_stats += len(updated_group_ids)
+            last_group_id = max(batch_group_ids)
 
-            logger.info(f"updating {len(group_ids)} user group stats took {the_time}s")
+            if len(batch_group_ids) < DefaultValues.BULK_CHUNK_SIZE:
+                break
+
+        the_time = (utcnow_ts() - before) * 1000
+        report_timing("db.set_last_updated_related_to_user", the_time)
+
+        if n_groups > 250:
+            logger.info(f"updating {n_stats} user group stats in {n_groups} groups took {the_time:.2f}ms")
+
+        return n_stats
 
     # noinspection PyMethodMayBeStatic
     async def set_last_updated_at_for_all_in_group(self, group_id: str, db: AsyncSession):
@@ -1676,75 +2041,97 @@ class RelationalHandler:
 
         return group_to_users
 
-    async def mark_all_groups_as_read(self, user_id: int, db: AsyncSession) -> List[str]:
-        group_ids = await db.run_sync(lambda _db:
-            _db.query(UserGroupStatsEntity.group_id)
-            .join(
-                GroupEntity,
-                GroupEntity.group_id == UserGroupStatsEntity.group_id
-            )
-            .filter(
-                UserGroupStatsEntity.user_id == user_id,
-                or_(
-                    UserGroupStatsEntity.last_read < GroupEntity.last_message_time,
-                    UserGroupStatsEntity.bookmark.is_(True),
-                    UserGroupStatsEntity.unread_count > 0,
-                    UserGroupStatsEntity.mentions > 0
+    async def mark_all_groups_as_read(self, user_id: int, db: AsyncSession) -> Dict[str, int]:
+        """
+        Some users have >10k conversations, so instead of loading the group ids and updating them in
+        chunks, everything is done server-side using two statements: first reset the highlight time
+        on the other users' stats, then update the user's own stats and return the group ids (and
+        the group types, so read receipts can be sent without looking up the group members):
+
+            update user_group_stats
+            set
+                last_read = now(), unread_count = 0, mentions = 0, bookmark = false, ...
+            from
+                groups
+            where
+                user_group_stats.group_id = groups.group_id and
+                user_group_stats.user_id = 8888 and
+                (
+                    user_group_stats.last_read < groups.last_message_time or
+                    user_group_stats.bookmark = true or
+                    user_group_stats.unread_count > 0 or
+                    user_group_stats.mentions > 0
                 )
-            )
-            .all()
-        )
-
-        await self.env.cache.reset_total_unread_message_count(user_id)
-
-        # sqlalchemy returns a list of tuples: [(group_id1,), (group_id2,), ...]
-        group_ids = [group_id[0] for group_id in group_ids]
+            returning
+                user_group_stats.group_id, groups.group_type;
 
+        :return: a dict of {group_id: group_type} for all groups that were marked as read
+        """
         now = utcnow_dt()
 
-        # some users have >10k conversations; split into chunks to not overload the db
-        for group_id_chunk in split_into_chunks(group_ids, 500):
-            await self.env.cache.reset_unread_in_groups(user_id, group_id_chunk)
-            await self.env.cache.set_last_read_in_groups_for_user(group_ids, user_id, to_ts(now))
-
-            await db.run_sync(lambda _db:
-                _db.query(UserGroupStatsEntity)
-                .filter(
-                    UserGroupStatsEntity.group_id.in_(group_id_chunk),
-                    UserGroupStatsEntity.user_id == user_id
-                )
-                .update(
-                    {
-                        UserGroupStatsEntity.last_updated_time: now,
-                        UserGroupStatsEntity.last_read: now,
-                        UserGroupStatsEntity.unread_count: 0,
-                        UserGroupStatsEntity.mentions: 0,
-                        UserGroupStatsEntity.bookmark: False,
-                        UserGroupStatsEntity.highlight_time: self.long_ago
-                    },
-                    synchronize_session="fetch",
-                )
+        is_unread = and_(
+            UserGroupStatsEntity.group_id == GroupEntity.group_id,
+            UserGroupStatsEntity.user_id == user_id,
+            or_(
+                UserGroupStatsEntity.last_read < GroupEntity.last_message_time,
+                UserGroupStatsEntity.bookmark.is_(True),
+                UserGroupStatsEntity.unread_count > 0,
+                UserGroupStatsEntity.mentions > 0
             )
+        )
 
-            # need to reset the highlight time on the other user's stats too
-            await db.run_sync(lambda _db:
-                _db.query(UserGroupStatsEntity)
-                .filter(
-                    UserGroupStatsEntity.group_id.in_(group_id_chunk),
-                    UserGroupStatsEntity.user_id != user_id,
-                    UserGroupStatsEntity.receiver_highlight_time > self.long_ago
-                )
-                .update(
-                    {
-                        UserGroupStatsEntity.receiver_highlight_time: self.long_ago
-                    },
-                    synchronize_session="fetch",
+        # need to reset the highlight time on the other user's stats too; has to run
+        # before the update below, otherwise the groups are no longer unread
+        unread_stats = aliased(UserGroupStatsEntity)
+        await db.execute(
+            update(UserGroupStatsEntity)
+            .where(
+                UserGroupStatsEntity.user_id != user_id,
+                UserGroupStatsEntity.receiver_highlight_time > self.long_ago,
+                UserGroupStatsEntity.group_id.in_(
+                    select(unread_stats.group_id)
+                    .join(GroupEntity, GroupEntity.group_id == unread_stats.group_id)
+                    .where(
+                        unread_stats.user_id == user_id,
+                        or_(
+                            unread_stats.last_read < GroupEntity.last_message_time,
+                            unread_stats.bookmark.is_(True),
+                            unread_stats.unread_count > 0,
+                            unread_stats.mentions > 0
+                        )
+                    )
                 )
             )
+            .values(receiver_highlight_time=self.long_ago)
+            .execution_options(synchronize_session=False)
+        )
+
+        result = await db.execute(
+            update(UserGroupStatsEntity)
+            .where(is_unread)
+            .values(
+                last_updated_time=now,
+                last_read=now,
+                unread_count=0,
+                mentions=0,
+                bookmark=False,
+                highlight_time=self.long_ago
+            )
+            .returning(UserGroupStatsEntity.group_id, GroupEntity.group_type)
+            .execution_options(synchronize_session=False)
+        )
+        group_id_to_type = {group_id: group_type for group_id, group_type in result.all()}
 
         await db.commit()
 
-        return group_ids
+        async with self.env.cache.pipeline() as p:
+            await self.env.cache.reset_total_unread_message_count(user_id, pipeline=p)
+            await self.env.cache.reset_unread_in_groups(user_id, list(group_id_to_type.keys()), pipeline=p)
+            await self.env.cache.set_last_read_in_groups_for_user(
+                list(group_id_to_type.keys()), user_id, to_ts(now), pipeline=p
+            )
+
+        return group_id_to_type
 
     # noinspection PyMethodMayBeStatic
     async def get_all_user_stats_in_group(
@@ -2180,7 +2567,9 @@ class RelationalHandler:
         await db.commit()
 
     @time_coroutine(logger, "get_groups_with_undeleted_messages()")
-    async def get_groups_with_undeleted_messages(self, db: AsyncSession):
+    async def get_groups_with_undeleted_messages(
+            self, db: AsyncSession, group_ids: List[str] = None, skip_group_types: Set[int] = None
+    ):
         """
         Used for removing old messages from the system. It queries for the time
         of which every previous message for a group can be removed. Messages are
@@ -2207,30 +2596,44 @@ class RelationalHandler:
                         else 0 end
                     ),
                 0) = 0;
+
+        If `group_ids` is specified, only those groups are evaluated, instead of
+        aggregating over every group in the system. Groups with a type in
+        `skip_group_types` are never returned, e.g. rooms where messages expire
+        by ttl.
         """
-        return await db.run_sync(lambda _db:
-            _db.query(
+        def _query(_db):
+            query = _db.query(
                 GroupEntity.group_id,
                 func.min(UserGroupStatsEntity.delete_before)
-            )
-            .join(
+            ).join(
                 UserGroupStatsEntity,
                 UserGroupStatsEntity.group_id == GroupEntity.group_id
             )
-            .group_by(
-                GroupEntity.group_id
-            )
-            .having(
-                func.coalesce(
-                    func.sum(case(
-                        [(UserGroupStatsEntity.delete_before <= GroupEntity.first_message_time, 1)],
-                        else_=0
-                    )),
-                    0
-                ) == 0
+
+            if group_ids is not None:
+                query = query.filter(GroupEntity.group_id.in_(group_ids))
+
+            if skip_group_types:
+                query = query.filter(GroupEntity.group_type.not_in(skip_group_types))
+
+            return (
+                query.group_by(
+                    GroupEntity.group_id
+                )
+                .having(
+                    func.coalesce(
+                        func.sum(case(
+                            [(UserGroupStatsEntity.delete_before <= GroupEntity.first_message_time, 1)],
+                            else_=0
+                        )),
+                        0
+                    ) == 0
+                )
+                .all()
             )
-            .all()
-        )
+
+        return await db.run_sync(_query)
 
     # noinspection PyMethodMayBeStatic
     async def _get_user_stats_for(self, group_id: str, user_id: int, db: AsyncSession):
@@ -1,6 +1,6 @@
 from datetime import datetime
 from datetime import timedelta
-from typing import Tuple, Dict, Final
+from typing import Tuple, Final
 
 from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -164,6 +164,9 @@ class UpdateUserGroupStatsHandler:
             await self.env.cache.set_delete_before(group_id, user_id, to_ts(delete_before), pipeline=p)
             await self.env.cache.remove_attachment_count_in_group_for_users(group_id, [user_id], pipeline=p)
 
+            # messages before the new delete_before might now be removable by the deleter
+            await self.env.cache.add_deletion_candidates([group_id], pipeline=p)
+
     async def _set_hide(
             self,
             group_id: str,
@@ -233,13 +236,9 @@ class UpdateUserGroupStatsHandler:
         # check previous last read before updating it, and send read-receipts to other users
         # if last_message_time is more than the previous last_read
         if group.last_message_time > user_stats.last_read:
-            user_ids = await self.env.db.get_user_ids_and_join_time_in_group(group_id, db)
-
-            if user_id in user_ids:
-                del user_ids[user_id]
-
+            user_ids = await self.env.db.get_read_receipt_receivers(group_id, user_id, db)
             self.env.client_publisher.read(
-                group_id, user_id, list(user_ids.keys()), last_read, bookmark=user_stats.bookmark
+                group_id, user_id, user_ids, last_read, bookmark=user_stats.bookmark
             )
 
         # now check the new last read time, but only recount if there's potentially unread messages
@@ -308,15 +307,9 @@ class UpdateUserGroupStatsHandler:
             return _row
 
         async def _send_read_receipts() -> None:
-            user_ids_join_time: Dict[int, str] = \
-                await self.env.db.get_user_ids_and_join_time_in_group(group_id, db)
-
-            if user_id in user_ids_join_time:
-                user_ids_join_time = dict(user_ids_join_time)  # shallow copy
-                user_ids_join_time.pop(user_id, None)
-
+            user_ids = await self.env.db.get_read_receipt_receivers(group_id, user_id, db)
             self.env.client_publisher.read(
-                group_id, user_id, list(user_ids_join_time.keys()), new_last_read, bookmark=was_bookmarked
+                group_id, user_id, user_ids, new_last_read, bookmark=was_bookmarked
             )
 
         # 1) Fetch only what we absolutely need: previous last_read & bookmark
@@ -1,10 +1,12 @@
 from sqlalchemy import Boolean
 from sqlalchemy import Column
 from sqlalchemy import DateTime
+from sqlalchemy import Index
 from sqlalchemy import Integer
 from sqlalchemy import Text
 from sqlalchemy import String
 from sqlalchemy import UniqueConstraint
+from sqlalchemy import or_
 
 from dinofw.utils.environ import env
 
@@ -102,6 +104,20 @@ class UserGroupStatsEntity(env.Base):
 
     UniqueConstraint('group_id', 'user_id')
 
+    __table_args__ = (
+        # only the few rows that can count towards the total unread count are indexed,
+        # used when re-calculating the total unread count for a user
+        Index(
+            "ix_user_group_stats_user_id_unread",
+            "user_id",
+            postgresql_where=or_(
+                bookmark.is_(True),
+                unread_count > 0,
+                mentions > 0
+            )
+        ),
+    )
+
 
 class DeletedStatsEntity(env.Base):
     __tablename__ = "deleted_stats"
@@ -1,4 +1,6 @@
+from dataclasses import dataclass
 from datetime import datetime
+from operator import attrgetter
 from typing import Optional
 
 from pydantic import BaseModel
@@ -83,3 +85,108 @@ class UserGroupBase(BaseModel):
     user_count: int
     receiver_unread: int
     unread: int
+
+
+# Lightweight records used on hot paths (e.g. listing the inbox) between the db
+# handler and the rest layer, where validating a pydantic model for every row is
+# too slow; the api models in `dinofw.rest.models` are still pydantic. They have
+# the same fields and a `dict()` method, so they can be used in place of the
+# corresponding *Base models when converting to api models.
+
+
+@dataclass
+class GroupRecord:
+    __slots__ = (
+        "group_id", "name", "description", "created_at", "updated_at", "language",
+        "status", "status_changed_at", "first_message_time", "last_message_time",
+        "last_message_id", "last_message_overview", "last_message_type",
+        "last_message_user_id", "group_type", "owner_id", "meta",
+    )
+
+    group_id: str
+    name: str
+    description: Optional[str]
+    created_at: datetime
+    updated_at: Optional[datetime]
+    language: Optional[str]
+
+    status: int
+    status_changed_at: Optional[datetime]
+
+    first_message_time: datetime
+    last_message_time: datetime
+    last_message_id: Optional[str]
+    last_message_overview: Optional[str]
+    last_message_type: Optional[int]
+    last_message_user_id: Optional[int]
+
+    group_type: int
+    owner_id: Optional[int]
+    meta: Optional[int]
+
+    @classmethod
+    def from_entity(cls, entity) -> "GroupRecord":
+        return cls(*_group_record_values(entity))
+
+    def dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+@dataclass
+class UserGroupStatsRecord:
+    __slots__ = (
+        "group_id", "user_id", "last_read", "last_sent", "delete_before", "join_time",
+        "highlight_time", "last_updated_time", "first_sent", "receiver_highlight_time",
+        "sent_message_count", "unread_count", "deleted", "hide", "pin", "bookmark",
+        "mentions", "notifications", "kicked", "rating",
+    )
+
+    group_id: str
+    user_id: int
+
+    last_read: datetime
+    last_sent: datetime
+    delete_before: datetime
+    join_time: datetime
+    highlight_time: Optional[datetime]
+    last_updated_time: datetime
+    first_sent: Optional[datetime]
+    receiver_highlight_time: Optional[datetime]
+
+    sent_message_count: int
+    unread_count: int
+    deleted: bool
+    hide: bool
+    pin: bool
+    bookmark: bool
+    mentions: int
+    notifications: bool
+    kicked: bool
+    rating: Optional[int]
+
+    @classmethod
+    def from_entity(cls, entity) -> "UserGroupStatsRecord":
+        return cls(*_user_group_stats_record_values(entity))
+
+    def dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+@dataclass
+class UserGroupRecord:
+    __slots__ = (
+        "group", "user_stats", "receiver_user_stats", "user_join_times",
+        "user_count", "receiver_unread", "unread",
+    )
+
+    group: GroupRecord
+    user_stats: UserGroupStatsRecord
+    receiver_user_stats: Optional[UserGroupStatsRecord]
+    user_join_times: dict
+    user_count: int
+    receiver_unread: int
+    unread: int
+
+
+_group_record_values = attrgetter(*GroupRecord.__slots__)
+_user_group_stats_record_values = attrgetter(*UserGroupStatsRecord.__slots__)
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import sys
 from datetime import datetime as dt
@@ -6,6 +7,7 @@ from time import time
 from typing import Dict
 from typing import List
 from typing import Optional
+from typing import Set
 from typing import Tuple
 from uuid import UUID
 from uuid import uuid4 as uuid
@@ -56,6 +58,17 @@ class CassandraHandler:
         beginning_of_1995 = 789_000_000
         self.long_ago = arrow.get(beginning_of_1995).datetime
 
+        # if enabled, messages in rooms are written with a ttl matching the max history
+        # days, so cassandra expires them and the deleter doesn't have to tombstone them
+        self.room_message_ttl = None
+        if self._is_enabled(ConfigKeys.ROOM_MESSAGE_TTL, ConfigKeys.HISTORY):
+            max_history_days = int(float(env.config.get(
+                ConfigKeys.ROOM_MAX_HISTORY_DAYS,
+                domain=ConfigKeys.HISTORY,
+                default=30
+            )))
+            self.room_message_ttl = max_history_days * 24 * 60 * 60
+
     def setup_tables(self):
         key_space = self.env.config.get(ConfigKeys.KEY_SPACE, domain=ConfigKeys.STORAGE)
         hosts = self.env.config.get(ConfigKeys.HOST, domain=ConfigKeys.STORAGE)
@@ -123,6 +136,44 @@ class CassandraHandler:
         # sync_table(MessageModel)
         # sync_table(AttachmentModel)
 
+        if self.room_message_ttl is not None and self._is_enabled(ConfigKeys.ROOM_MESSAGE_TWCS, ConfigKeys.HISTORY):
+            self._use_time_window_compaction()
+
+    def _use_time_window_compaction(self):
+        """
+        when most rows expire by ttl, time window compaction can drop whole sstables
+        once everything in them has expired, instead of compacting away tombstones
+        """
+        for model in [MessageModel, AttachmentModel]:
+            self.session.execute(
+                f"alter table {model.__table_name__} with compaction = {{" +
+                "'class': 'TimeWindowCompactionStrategy', " +
+                "'compaction_window_unit': 'DAYS', " +
+                "'compaction_window_size': 1" +
+                "}"
+            )
+
+    def _is_enabled(self, key, domain) -> bool:
+        value = self.env.config.get(key, domain=domain, default=False)
+        if isinstance(value, bool):
+            return value
+
+        return str(value).strip().lower() in ["yes", "1", "true"]
+
+    def _remaining_ttl(self, ttl: Optional[int], created_at: dt) -> Optional[int]:
+        """
+        updating a row re-writes the updated columns with a new ttl, so use the time
+        left until the original row expires, otherwise an edit would extend its life
+        """
+        if ttl is None:
+            return None
+
+        # cassandra returns naive datetimes, arrow assumes utc for those
+        age = time() - arrow.get(created_at).timestamp()
+
+        # a ttl of 0 means no ttl in cassandra, so expire almost immediately instead
+        return max(int(ttl - age), 1)
+
     def stop(self):
         self.cluster.shutdown()
 
@@ -476,13 +527,21 @@ class CassandraHandler:
         self,
         group_created_at: List[Tuple[str, dt]],
         user_id: int,
-        query: DeleteAttachmentQuery
+        query: DeleteAttachmentQuery,
+        ttl_group_ids: Set[str] = None
     ) -> Dict[str, List[MessageBase]]:
+        """
+        :param ttl_group_ids: groups where messages are written with the room ttl
+        """
         group_to_atts = dict()
         start = time()
 
+        if ttl_group_ids is None:
+            ttl_group_ids = set()
+
         for group_id, created_at in group_created_at:
-            attachments = await self.delete_attachments(group_id, created_at, user_id, query)
+            ttl = self.room_message_ttl if group_id in ttl_group_ids else None
+            attachments = await self.delete_attachments(group_id, created_at, user_id, query, ttl=ttl)
 
             if len(attachments):
                 group_to_atts[group_id] = attachments
@@ -496,39 +555,57 @@ class CassandraHandler:
 
         return group_to_atts
 
-    async def delete_messages_in_group_before(self, group_id: str, before: dt):
-        messages = await (
-            MessageModel.objects(
-                MessageModel.group_id == group_id,
-                MessageModel.created_at <= before,
+    async def count_messages_in_group_before(self, group_id: str, before: dt) -> int:
+        return await self._count_in_group_before(MessageModel, group_id, before)
+
+    async def count_attachments_in_group_before(self, group_id: str, before: dt) -> int:
+        return await self._count_in_group_before(AttachmentModel, group_id, before)
+
+    # noinspection PyMethodMayBeStatic
+    async def _count_in_group_before(self, model, group_id: str, before: dt) -> int:
+        return await (
+            model.objects(
+                model.group_id == group_id,
             )
-            .async_all()
+            .filter(
+                model.created_at <= before,
+            )
+            .limit(None)
+            .async_count()
         )
 
-        if not len(messages):
-            return
-
-        logger.info(f"deleting {len(messages)} messages in group {group_id}...")
-        await self._delete_messages(messages, "messages")
+    async def delete_messages_in_group_before(self, group_id: str, before: dt):
+        await self._delete_range_in_group_before(MessageModel, group_id, before)
 
     async def delete_attachments_in_group_before(self, group_id: str, before: dt):
-        attachments = await (
-            AttachmentModel.objects(
-                AttachmentModel.group_id == group_id,
-                AttachmentModel.created_at <= before,
-            )
-            .async_all()
+        await self._delete_range_in_group_before(AttachmentModel, group_id, before)
+
+    async def _delete_range_in_group_before(self, model, group_id: str, before: dt) -> None:
+        """
+        created_at is the first clustering column, so everything before a certain
+        time can be deleted with a single range tombstone, instead of reading all
+        rows first and then writing one tombstone per row
+        """
+        start = time()
+
+        # the orm doesn't support range deletes, so use a raw query
+        await self.session.execute_future(
+            f"delete from {model.__table_name__} where group_id = %s and created_at <= %s",
+            (UUID(group_id), before),
+            execution_profile="batch"
         )
 
-        logger.info(f"deleting {len(attachments)} attachments in group {group_id}...")
-        await self._delete_messages(attachments, "attachments")
+        elapsed = time() - start
+        if elapsed > 1:
+            logger.info(f"range deleted {model.__table_name__} <= {before} in group {group_id} in {elapsed:.2f}s")
 
     async def delete_attachments(
         self,
         group_id: str,
         group_created_at: dt,
         user_id: int,
-        query: DeleteAttachmentQuery
+        query: DeleteAttachmentQuery,
+        ttl: int = None
     ) -> List[MessageBase]:
         attachments = await (
             AttachmentModel.objects(
@@ -573,7 +650,7 @@ class CassandraHandler:
         if payload_status is None:
             payload_status = PayloadStatus.DELETED
 
-        await self._update_payload_status_to(messages, payload_status)
+        await self._update_payload_status_to(messages, payload_status, ttl=ttl)
         await self._delete_messages(attachments, "attachments")
 
         return attachment_bases
@@ -582,7 +659,8 @@ class CassandraHandler:
         self,
         group_id: str,
         group_created_at: dt,
-        query: DeleteAttachmentQuery
+        query: DeleteAttachmentQuery,
+        ttl: int = None
     ) -> MessageBase:
         attachment = await (
             AttachmentModel.objects(
@@ -618,7 +696,7 @@ class CassandraHandler:
         if payload_status is None:
             payload_status = PayloadStatus.DELETED
 
-        await self._update_payload_status_to([message], payload_status)
+        await self._update_payload_status_to([message], payload_status, ttl=ttl)
         await attachment.async_delete()
 
         return attachment_base
@@ -687,7 +765,7 @@ class CassandraHandler:
 
     # noinspection PyMethodMayBeStatic
     async def store_attachment(
-            self, group_id: str, user_id: int, message_id: str, query: CreateAttachmentQuery
+            self, group_id: str, user_id: int, message_id: str, query: CreateAttachmentQuery, ttl: int = None
     ) -> MessageBase:
         # we should filter on the 'created_at' field, since it's a clustering key
         # and 'message_id' is not; if we don't filter by 'created_at' each edit
@@ -717,13 +795,15 @@ class CassandraHandler:
         if message is None:
             raise NoSuchMessageException(message_id)
 
-        await message.async_update(
+        ttl = self._remaining_ttl(ttl, message.created_at)
+
+        await message.ttl(ttl).async_update(
             message_payload=query.message_payload,
             file_id=query.file_id,
             updated_at=now,
         )
 
-        await AttachmentModel.async_create(
+        await AttachmentModel.ttl(ttl).async_create(
             group_id=group_id,
             user_id=user_id,
             created_at=message.created_at,
@@ -741,11 +821,12 @@ class CassandraHandler:
             self,
             user_id: int,
             group_id: str,
-            query: ActionLogQuery
+            query: ActionLogQuery,
+            ttl: int = None
     ) -> MessageBase:
         action_time = utcnow_dt()
 
-        log = await MessageModel.async_create(
+        log = await MessageModel.ttl(ttl).async_create(
             group_id=group_id,
             user_id=user_id,
             created_at=action_time,
@@ -756,8 +837,42 @@ class CassandraHandler:
 
         return CassandraHandler.message_base_from_entity(log)
 
+    async def create_action_logs(
+            self,
+            user_id: int,
+            group_ids: List[str],
+            query: ActionLogQuery,
+            ttl: int = None
+    ) -> List[MessageBase]:
+        """
+        create the same action log in many groups; each group is its own partition, so the
+        inserts are independent and can run concurrently (bounded, to not overload the cluster)
+        """
+        semaphore = asyncio.Semaphore(DefaultValues.MAX_CONCURRENT_WRITES)
+
+        async def create_one(group_id: str) -> MessageBase:
+            async with semaphore:
+                return await self.create_action_log(user_id, group_id, query, ttl=ttl)
+
+        results = await asyncio.gather(
+            *[create_one(group_id) for group_id in group_ids],
+            return_exceptions=True
+        )
+
+        logs = list()
+        for group_id, result in zip(group_ids, results):
+            if isinstance(result, Exception):
+                logger.error(f"could not create action log in group {group_id} for user {user_id}: {str(result)}")
+                continue
+
+            logs.append(result)
+
+        return logs
+
     # noinspection PyMethodMayBeStatic
-    async def store_message(self, group_id: str, user_id: int, query: SendMessageQuery) -> MessageBase:
+    async def store_message(
+            self, group_id: str, user_id: int, query: SendMessageQuery, ttl: int = None
+    ) -> MessageBase:
         message = None
 
         # if the user is sending multiple images at the same time it may happen different servers create them
@@ -772,13 +887,14 @@ class CassandraHandler:
                 created_at = utcnow_dt()
 
                 # can't use "if not exists" or serial consistency when using the ORM, so use a raw query
+                # "using ttl 0" means no ttl in cassandra
                 results = (await self.session.execute_future(
                     "insert into messages (group_id, created_at, user_id, message_id, message_payload, message_type, context)" +
                     "values (%s, %s, %s, %s, %s, %s, %s)" +
-                    "if not exists;",
+                    "if not exists using ttl %s;",
                     (
                         UUID(group_id), created_at, user_id, message_id,
-                        query.message_payload, query.message_type, query.context
+                        query.message_payload, query.message_type, query.context, ttl or 0
                     ),
                     # this profile has serial consistency level set to 'serial', to make sure we don't do an UPSERT
                     execution_profile='transaction'
@@ -813,7 +929,7 @@ class CassandraHandler:
                 )
         else:
             created_at = utcnow_dt()
-            message = await MessageModel.async_create(
+            message = await MessageModel.ttl(ttl).async_create(
                 group_id=group_id,
                 user_id=user_id,
                 created_at=created_at,
@@ -825,7 +941,9 @@ class CassandraHandler:
 
         return CassandraHandler.message_base_from_entity(message)
 
-    async def edit_message(self, group_id: str, user_id: int, message_id: str, query: EditMessageQuery) -> MessageBase:
+    async def edit_message(
+            self, group_id: str, user_id: int, message_id: str, query: EditMessageQuery, ttl: int = None
+    ) -> MessageBase:
         created_at = query.created_at
         now = utcnow_dt()
 
@@ -849,7 +967,9 @@ class CassandraHandler:
         if message is None:
             raise NoSuchMessageException(message_id)
 
-        await message.async_update(
+        ttl = self._remaining_ttl(ttl, message.created_at)
+
+        await message.ttl(ttl).async_update(
             context=query.context or message.context,
             message_payload=query.message_payload or message.message_payload,
             updated_at=now,
@@ -869,7 +989,7 @@ class CassandraHandler:
 
         # might not be an attachment
         if attachment is not None:
-            await attachment.async_update(
+            await attachment.ttl(ttl).async_update(
                 message_type=attachment.message_type or message.message_type,
                 context=query.context or attachment.context,
                 message_payload=query.message_payload or attachment.message_payload,
@@ -878,7 +998,7 @@ class CassandraHandler:
 
         return CassandraHandler.message_base_from_entity(message)
 
-    async def _update_payload_status_to(self, messages: List[MessageModel], status: int):
+    async def _update_payload_status_to(self, messages: List[MessageModel], status: int, ttl: int = None):
         start = time()
         async with AioBatchQuery() as b:
             for message in messages:
@@ -895,7 +1015,7 @@ class CassandraHandler:
                     ))
                     continue
 
-                await message.batch(b).async_save()
+                await message.batch(b).ttl(self._remaining_ttl(ttl, message.created_at)).async_save()
 
         elapsed = time() - start
         if elapsed > 1:
@@ -27,6 +27,9 @@ class IServerPublishHandler(IPublishHandler, ABC):
 
 
 class IClientPublishHandler(IPublishHandler, ABC):
+    # read receipts are only sent to 1v1 groups, i.e. at most this many other users
+    MAX_READ_RECEIPT_RECEIVERS = 2
+
     @abstractmethod
     def edit(self, message: MessageBase, user_ids: List[int]) -> None:
         """pass"""
@@ -222,7 +222,7 @@ class MqttPublishHandler(IClientPublishHandler):
 
     def read(self, group_id: str, user_id: int, user_ids: List[int], now: dt, bookmark: bool) -> None:
         # only send read receipt to 1v1 groups
-        if len(user_ids) > 2:
+        if len(user_ids) > IClientPublishHandler.MAX_READ_RECEIPT_RECEIVERS:
             return
 
         data = read_to_event(group_id, user_id, now, bookmark)
@@ -0,0 +1,68 @@
+import json
+
+from pydantic import BaseModel
+
+from dinofw.rest.queries import ActionLogQuery
+from dinofw.rest.queries import CreateActionLogQuery
+from dinofw.rest.queries import DeleteAttachmentQuery
+from dinofw.utils import environ
+from dinofw.utils.config import JobTypes
+
+
+def to_job_args(**kwargs) -> dict:
+    """
+    job arguments are stored as json in the stream, so queries are dumped to dicts
+    """
+    return {
+        key: json.loads(value.json()) if isinstance(value, BaseModel) else value
+        for key, value in kwargs.items()
+    }
+
+
+async def _update_user_stats(args: dict, db) -> None:
+    await environ.env.rest.group.set_last_updated_at_on_all_stats_related_to_user(
+        args["user_id"], db, since=args.get("since")
+    )
+
+
+async def _delete_all_groups_for_user(args: dict, db) -> None:
+    query = CreateActionLogQuery.parse_obj(args["query"])
+    await environ.env.rest.group.delete_all_groups_for_user(args["user_id"], query, db)
+
+
+async def _create_action_logs_for_user(args: dict, db) -> None:
+    query = ActionLogQuery.parse_obj(args["query"])
+    query.update_group_updated_at = False
+    await environ.env.rest.user.create_action_log_in_all_groups(args["user_id"], query, db)
+
+
+async def _mark_all_as_read(args: dict, db) -> None:
+    await environ.env.rest.group.mark_all_as_read(args["user_id"], db)
+
+
+async def _delete_attachment(args: dict, db) -> None:
+    query = DeleteAttachmentQuery.parse_obj(args["query"])
+    await environ.env.rest.message.delete_attachment(args["group_id"], query, db)
+
+
+async def _delete_all_user_attachments(args: dict, db) -> None:
+    query = DeleteAttachmentQuery.parse_obj(args["query"])
+    await environ.env.rest.user.delete_all_user_attachments(args["user_id"], query, db)
+
+
+JOB_HANDLERS = {
+    JobTypes.UPDATE_USER_STATS: _update_user_stats,
+    JobTypes.DELETE_ALL_GROUPS_FOR_USER: _delete_all_groups_for_user,
+    JobTypes.CREATE_ACTION_LOGS_FOR_USER: _create_action_logs_for_user,
+    JobTypes.MARK_ALL_AS_READ: _mark_all_as_read,
+    JobTypes.DELETE_ATTACHMENT: _delete_attachment,
+    JobTypes.DELETE_ALL_USER_ATTACHMENTS: _delete_all_user_attachments,
+}
+
+
+async def execute_job(job_type: str, args: dict, db) -> None:
+    handler = JOB_HANDLERS.get(job_type)
+    if handler is None:
+        raise ValueError(f"unknown job type '{job_type}'")
+
+    await handler(args, db)
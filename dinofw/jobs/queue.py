@@ -0,0 +1,146 @@
+import json
+from typing import List
+
+import redis
+from loguru import logger
+from pydantic import BaseModel
+
+from dinofw.utils import config_or_default
+from dinofw.utils import utcnow_ts
+from dinofw.utils.config import ConfigKeys
+from dinofw.utils.config import DefaultValues
+
+
+class Job(BaseModel):
+    job_id: str
+    job_type: str
+    args: dict
+    attempt: int = 0
+    created_at: float
+
+
+def _config_or_default(env, key: str, default):
+    return config_or_default(env, key, ConfigKeys.PUBLISHER, default)
+
+
+class JobQueue:
+    """
+    Durable job queue backed by a Redis stream and a consumer group. Jobs are
+    acknowledged only after they've been handled, so jobs being processed by a
+    worker that dies are claimed by another worker instead of being lost, which
+    is what happens to a starlette BackgroundTask if the api pod restarts.
+    """
+
+    def __init__(self, env, host: str, port: int = 6379, db: int = 0):
+        self.stream = _config_or_default(env, ConfigKeys.STREAM, DefaultValues.JOB_STREAM)
+        self.group = _config_or_default(env, ConfigKeys.GROUP, DefaultValues.JOB_GROUP)
+        self.dead_letter_stream = f"{self.stream}:dead"
+
+        self.block_ms = int(float(_config_or_default(env, ConfigKeys.BLOCK, DefaultValues.JOB_BLOCK_MS)))
+        self.concurrency = int(float(_config_or_default(env, ConfigKeys.CONCURRENCY, DefaultValues.JOB_CONCURRENCY)))
+        self.max_retries = int(float(_config_or_default(env, ConfigKeys.MAX_RETRIES, DefaultValues.JOB_MAX_RETRIES)))
+        self.claim_idle_ms = DefaultValues.JOB_CLAIM_IDLE_MS
+
+        if env.config.get(ConfigKeys.TESTING, default=False) or host == "mock":
+            from fakeredis import FakeAsyncRedis
+            self.redis = FakeAsyncRedis(decode_responses=True)
+        else:
+            self.redis = redis.asyncio.Redis(host=host, port=port or 6379, db=db, decode_responses=True)
+
+    async def enqueue(self, job_type: str, args: dict, attempt: int = 0) -> str:
+        return await self.redis.xadd(self.stream, self._to_fields(job_type, args, attempt, utcnow_ts()))
+
+    async def retry(self, job: Job) -> None:
+        """
+        re-queue a failed job at the end of the stream, and ack the original entry in the same
+        transaction, so a worker dying in between can't leave both to be run
+        """
+        p = self.redis.pipeline(transaction=True)
+        p.xadd(self.stream, self._to_fields(job.job_type, job.args, job.attempt + 1, utcnow_ts()))
+        self._ack(p, job)
+        await p.execute()
+
+    async def dead_letter(self, job: Job, error: str) -> None:
+        logger.error(f"job {job.job_type} ({job.job_id}) failed {job.attempt + 1} times, moving to dead letters: {error}")
+
+        fields = self._to_fields(job.job_type, job.args, job.attempt, job.created_at)
+        fields["error"] = error
+
+        p = self.redis.pipeline(transaction=True)
+        p.xadd(self.dead_letter_stream, fields)
+        self._ack(p, job)
+        await p.execute()
+
+    async def create_group(self) -> None:
+        try:
+            await self.redis.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except redis.exceptions.ResponseError as e:
+            # group already created by another worker
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def read(self, consumer: str, count: int) -> List[Job]:
+        response = await self.redis.xreadgroup(
+            self.group, consumer, {self.stream: ">"}, count=count, block=self.block_ms
+        )
+        if not response:
+            return list()
+
+        _, entries = response[0]
+        return [self._to_job(entry_id, fields) for entry_id, fields in entries if fields]
+
+    async def read_pending(self, consumer: str, count: int) -> List[Job]:
+        """
+        jobs previously delivered to this consumer but never acknowledged, e.g.
+        because the worker was restarted while processing them
+        """
+        pending = await self.redis.xpending_range(
+            self.stream, self.group, min="-", max="+", count=count, consumername=consumer
+        )
+        if not pending:
+            return list()
+
+        entries = await self.redis.xclaim(
+            self.stream, self.group, consumer,
+            min_idle_time=0, message_ids=[entry["message_id"] for entry in pending]
+        )
+        return [self._to_job(entry_id, fields) for entry_id, fields in entries if fields]
+
+    async def claim_stale(self, consumer: str, count: int) -> List[Job]:
+        """
+        take over jobs that has been pending on some other consumer for too long
+        """
+        response = await self.redis.xautoclaim(
+            self.stream, self.group, consumer,
+            min_idle_time=self.claim_idle_ms, start_id="0-0", count=count
+        )
+        entries = response[1] if response else list()
+        return [self._to_job(entry_id, fields) for entry_id, fields in entries if fields]
+
+    async def ack(self, job: Job) -> None:
+        p = self.redis.pipeline()
+        self._ack(p, job)
+        await p.execute()
+
+    def _ack(self, p, job: Job) -> None:
+        p.xack(self.stream, self.group, job.job_id)
+        p.xdel(self.stream, job.job_id)
+
+    @staticmethod
+    def _to_fields(job_type: str, args: dict, attempt: int, created_at: float) -> dict:
+        return {
+            "type": job_type,
+            "args": json.dumps(args),
+            "attempt": attempt,
+            "created_at": created_at,
+        }
+
+    @staticmethod
+    def _to_job(entry_id: str, fields: dict) -> Job:
+        return Job(
+            job_id=entry_id,
+            job_type=fields["type"],
+            args=json.loads(fields["args"]),
+            attempt=int(fields.get("attempt", 0)),
+            created_at=float(fields.get("created_at", 0)),
+        )
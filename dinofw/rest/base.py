@@ -1,4 +1,6 @@
+import hashlib
 from abc import ABC
+from time import time
 from typing import List
 from typing import Union, Optional
 
@@ -13,12 +15,16 @@ from dinofw.rest.models import Message
 from dinofw.rest.queries import ActionLogQuery
 from dinofw.rest.queries import SendMessageQuery
 from dinofw.utils import need_to_update_stats_in_group
+from dinofw.utils import split_into_chunks
 from dinofw.utils import users_to_group_id
 from dinofw.utils import utcnow_dt
 from dinofw.utils import utcnow_ts
+from dinofw.utils.config import DefaultValues
 from dinofw.utils.config import EventTypes
+from dinofw.utils.config import GroupTypes
 from dinofw.utils.convert import message_base_to_message
 from dinofw.utils.exceptions import NoSuchGroupException, UserStatsOrGroupAlreadyCreated
+from dinofw.utils.perf import report_timing
 
 
 class BaseResource(ABC):
@@ -29,6 +35,39 @@ class BaseResource(ABC):
         beginning_of_1995 = 789_000_000
         self.long_ago = arrow.Arrow.utcfromtimestamp(beginning_of_1995).datetime
 
+    async def _get_group_type(self, group_id: str, db) -> int:
+        group_type = await self.env.cache.get_group_type(group_id)
+
+        if group_type is None:
+            group_types = await self.env.db.get_group_types([group_id], db)
+            if group_id not in group_types:
+                raise NoSuchGroupException(group_id)
+
+            group_type = group_types[group_id]
+            await self.env.cache.set_group_type(group_id, group_type)
+
+        return group_type
+
+    async def _get_message_ttl(self, group_id: str, db, group_type: int = None) -> Optional[int]:
+        """
+        messages in rooms are written with a ttl if enabled, so they expire without
+        the deleter; returns None if the messages in this group should be kept
+        """
+        if self.env.storage.room_message_ttl is None:
+            return None
+
+        if group_type is None:
+            try:
+                group_type = await self._get_group_type(group_id, db)
+            except NoSuchGroupException:
+                # rooms are always created before messages are sent to them
+                return None
+
+        if group_type not in GroupTypes.public_group_types:
+            return None
+
+        return self.env.storage.room_message_ttl
+
     async def _user_opens_conversation(self, group_id: str, user_id: int, user_stats: UserGroupStatsBase, db):
         """
         update database and cache with everything related to opening a conversation (if needed)
@@ -58,9 +97,7 @@ class BaseResource(ABC):
         # broadcasting unnecessary read-receipts)
         # TODO: double check this; won't it cause read-receipts to not be sent when reading a new message?
         if last_message_time > user_stats.last_read:
-            user_ids = await self.env.db.get_user_ids_and_join_time_in_group(group_id, db)
-
-            del user_ids[user_id]
+            user_ids = await self.env.db.get_read_receipt_receivers(group_id, user_id, db)
             self.env.client_publisher.read(
                 group_id, user_id, user_ids, now_dt, bookmark=user_stats.bookmark
             )
@@ -90,7 +127,8 @@ class BaseResource(ABC):
         elif query.receiver_id is not None and query.receiver_id > 0:
             group_id = await self._get_or_create_group_for_1v1(user_id, query.receiver_id, db)
 
-        log = await self.env.storage.create_action_log(user_id, group_id, query)
+        ttl = await self._get_message_ttl(group_id, db)
+        log = await self.env.storage.create_action_log(user_id, group_id, query, ttl=ttl)
         await self._user_sends_a_message(
             group_id,
             user_id=user_id,
@@ -107,6 +145,97 @@ class BaseResource(ABC):
 
         return message_base_to_message(log)
 
+    async def create_action_logs_in_groups(
+            self,
+            query: ActionLogQuery,
+            group_ids: List[str],
+            user_id: int,
+            db: Session,
+            resumable: bool = False
+    ) -> List[Message]:
+        """
+        bulk version of create_action_log() for when a user needs the same action log in
+        many groups (e.g. when leaving all groups); the groups are handled in chunks, where
+        the cassandra inserts of each chunk run concurrently and the db and cache are updated
+        with one set of set-based statements and one pipeline per chunk
+
+        :param resumable: if True, the finished groups are recorded in redis after each chunk, so
+         that if the (background) task dies halfway, calling this method again with the same payload
+         only creates the action logs in the groups that were not yet done
+        """
+        # creating an action log is optional for the caller
+        if query is None or not len(group_ids):
+            return list()
+
+        if query.user_id is not None:
+            user_id = query.user_id
+
+        payload_hash = None
+        if resumable:
+            payload_hash = hashlib.sha1(query.payload.encode("utf-8")).hexdigest()
+            groups_done = await self.env.cache.get_action_log_groups_done(user_id, payload_hash)
+
+            if len(groups_done):
+                logger.info(
+                    f"resuming action logs for user {user_id}, skipping {len(groups_done)} groups already done"
+                )
+                group_ids = [group_id for group_id in group_ids if group_id not in groups_done]
+
+        n_groups = len(group_ids)
+        n_done = 0
+        action_logs = list()
+        before = time()
+
+        for group_id_chunk in split_into_chunks(group_ids, DefaultValues.BULK_CHUNK_SIZE):
+            chunk_before = time()
+
+            logs = await self._create_action_logs_in_chunk(user_id, group_id_chunk, query, db)
+            await self.env.db.update_groups_new_action_logs(logs, user_id, query, db)
+
+            action_logs.extend([message_base_to_message(log) for log in logs])
+            n_done += len(group_id_chunk)
+
+            if resumable:
+                await self.env.cache.add_action_log_groups_done(
+                    user_id, payload_hash, [log.group_id for log in logs]
+                )
+
+            report_timing("bulk.action_logs.chunk", (time() - chunk_before) * 1000)
+            if n_groups > DefaultValues.BULK_CHUNK_SIZE:
+                logger.info(f"created action logs in {n_done}/{n_groups} groups for user {user_id}")
+
+        if resumable:
+            await self.env.cache.remove_action_log_groups_done(user_id, payload_hash)
+
+        elapsed = time() - before
+        report_timing("bulk.action_logs", elapsed * 1000)
+
+        if n_groups > 100:
+            logger.info(f"creating action logs in {n_groups} groups for user {user_id} took {elapsed:.1f}s")
+
+        return action_logs
+
+    async def _create_action_logs_in_chunk(
+            self, user_id: int, group_ids: List[str], query: ActionLogQuery, db
+    ) -> List[MessageBase]:
+        if self.env.storage.room_message_ttl is None:
+            return await self.env.storage.create_action_logs(user_id, group_ids, query)
+
+        # rooms get a ttl on their action logs, other groups don't
+        group_id_to_type = await self.env.db.get_group_types(group_ids, db)
+        room_ids = {
+            group_id for group_id in group_ids
+            if group_id_to_type.get(group_id) in GroupTypes.public_group_types
+        }
+        other_ids = [group_id for group_id in group_ids if group_id not in room_ids]
+
+        logs = await self.env.storage.create_action_logs(user_id, other_ids, query)
+        logs.extend(await self.env.storage.create_action_logs(
+            user_id, list(room_ids), query, ttl=self.env.storage.room_message_ttl
+        ))
+
+        return logs
+
     async def _user_sends_a_message(
             self,
             group_id: str,
@@ -125,7 +254,9 @@ class BaseResource(ABC):
         """
         update database and cache with everything related to sending a message
         """
-        user_ids = await self.env.db.get_user_ids_and_join_time_in_group(group_id, db)
+        # only count and check membership, since fetching all users of big groups is expensive
+        user_count = await self.env.db.get_user_count_in_group(group_id, db)
+        in_group = user_count > 0 and await self.env.db.is_user_in_group(group_id, user_id, db)
 
         group_base = await self.env.db.update_group_new_message(
             message,
@@ -141,10 +272,10 @@ class BaseResource(ABC):
         )
 
         # if all users left the group, this message is an action log, and there's nothing more to do
-        if not len(user_ids):
+        if not user_count:
             return None
 
-        if user_id not in user_ids and unhide_group:
+        if not in_group and unhide_group:
             # if the user deleted the group, this is an action log for the
             # deletion, and we only have to un-hide it for the other user(s)
             await self.env.cache.set_hide_group(group_id, False)
@@ -155,11 +286,13 @@ class BaseResource(ABC):
             )
 
         if event_type == EventTypes.ATTACHMENT:
-            await self.env.cache.increase_attachment_count_in_group_for_users(group_id, list(user_ids.keys()))
+            async for user_ids in self.env.db.iter_user_ids_in_group(group_id, db):
+                await self.env.cache.increase_attachment_count_in_group_for_users(group_id, user_ids)
         elif event_type == EventTypes.DELETE_ATTACHMENT:
             # instead of decreasing, just remove it, since in case no count is cached, decreasing
             # a non-existing key will store -1, which is incorrect
-            await self.env.cache.remove_attachment_count_in_group_for_users(group_id, list(user_ids.keys()))
+            async for user_ids in self.env.db.iter_user_ids_in_group(group_id, db):
+                await self.env.cache.remove_attachment_count_in_group_for_users(group_id, user_ids)
             # TODO: decrease total unread count in redis? or remove it?
 
         return group_base
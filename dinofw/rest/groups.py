@@ -4,6 +4,7 @@ import json
 import random
 import time
 from datetime import datetime as dt
+from typing import Dict
 from typing import List
 from typing import Optional
 
@@ -12,9 +13,11 @@ from loguru import logger
 from sqlalchemy.orm import Session
 
 from dinofw.db.rdbms.schemas import UserGroupStatsBase
+from dinofw.db.storage.schemas import MessageBase
 from dinofw.rest.api_cache import _langs_key, _to_payload, _from_payload
 from dinofw.rest.base import BaseResource
 from dinofw.rest.groups_cache import PublicGroupsCacheMixin
+from dinofw.rest.groups_cache import dumps_to_bytes
 from dinofw.rest.models import Group
 from dinofw.rest.models import GroupJoinTime
 from dinofw.rest.models import GroupUsers
@@ -30,16 +33,19 @@ from dinofw.rest.queries import JoinGroupQuery
 from dinofw.rest.queries import MessageQuery
 from dinofw.rest.queries import UpdateGroupQuery
 from dinofw.rest.queries import UpdateUserGroupStats
-from dinofw.utils import to_dt, is_non_zero, one_year_ago
+from dinofw.utils import to_dt, is_non_zero, one_year_ago, group_id_to_users
 from dinofw.utils import to_ts
 from dinofw.utils import utcnow_dt
 from dinofw.utils import utcnow_ts
 from dinofw.utils.config import GroupTypes, GroupStatus
 from dinofw.utils.convert import group_base_to_group
+from dinofw.utils.convert import message_base_to_dict
 from dinofw.utils.convert import message_base_to_message
 from dinofw.utils.convert import to_user_group_stats
 from dinofw.utils.exceptions import InvalidRangeException, NoSuchGroupException, GroupIsFrozenOrArchivedException
 from dinofw.utils.exceptions import UserIsKickedException
+from dinofw.utils.exceptions import UserNotInGroupException
+from dinofw.utils.perf import report_timing
 
 SOFT_TTL_SEC = 60          # serve fresh for this long (+ jitter)
 HARD_TTL_SEC = 600         # Redis hard TTL in case rebuilds fail
@@ -187,30 +193,35 @@ class GroupResource(BaseResource, PublicGroupsCacheMixin):
         ]
 
     async def mark_all_as_read(self, user_id: int, db: Session) -> None:
-        group_ids_updated = await self.env.db.mark_all_groups_as_read(user_id, db)
-
-        group_to_user = await self.env.db.get_user_ids_in_groups(group_ids_updated, db)
+        group_id_to_type = await self.env.db.mark_all_groups_as_read(user_id, db)
         now_dt = utcnow_dt()
 
-        for group_id, user_ids in group_to_user.items():
-            if user_id in user_ids:
-                user_ids.remove(user_id)
+        # read receipts are only sent for 1v1 groups, where the receiver is part of
+        # the group id, so no need to look up the members of every updated group
+        for group_id, group_type in group_id_to_type.items():
+            if group_type != GroupTypes.ONE_TO_ONE:
+                continue
+
+            receiver_ids = [uid for uid in group_id_to_users(group_id) if uid != user_id]
 
             # marking a group as read sets bookmark=False
             self.env.client_publisher.read(
-                group_id, user_id, user_ids, now_dt, bookmark=False
+                group_id, user_id, receiver_ids, now_dt, bookmark=False
             )
 
-    async def _get_1v1_user_stats(self, group_id: str, user_id_a: int, user_id_b: int, db: Session) -> List[UserGroupStats]:
+    # noinspection PyMethodMayBeStatic
+    def _get_1v1_user_stats(
+            self,
+            user_stats_bases: Dict[int, UserGroupStatsBase],
+            user_id_a: int,
+            user_id_b: int,
+            attachment_amount: int
+    ) -> List[UserGroupStats]:
         user_stats = [
-            await self.get_user_group_stats(
-                group_id, user_id, db
-            ) for user_id in [user_id_a, user_id_b]
+            to_user_group_stats(user_stats_bases[user_id])
+            for user_id in [user_id_a, user_id_b]
         ]
 
-        delete_before = await self.env.db.get_delete_before(group_id, user_id_a, db)
-        attachment_amount = await self.count_attachments_in_group_for_user(group_id, user_id_a, delete_before)
-
         # only need ths count for the calling user
         for user_stat in user_stats:
             if user_stat.user_id == user_id_a:
@@ -221,36 +232,50 @@ class GroupResource(BaseResource, PublicGroupsCacheMixin):
                 if user_stat.unread == 0 and user_stat.bookmark:
                     user_stat.unread = 1
 
-        user_a: Optional[UserGroupStats] = user_stats[0]
-        user_b: Optional[UserGroupStats] = user_stats[1]
-
-        if user_a is not None and user_b is not None:
-            for this_user, that_user in itertools.permutations([user_a, user_b]):
-                this_user.receiver_unread = that_user.unread
-                this_user.receiver_hide = that_user.hide
-                this_user.receiver_deleted = that_user.deleted
-                this_user.receiver_highlight_time = that_user.highlight_time
-                this_user.receiver_delete_before = that_user.delete_before
+        for this_user, that_user in itertools.permutations(user_stats):
+            this_user.receiver_unread = that_user.unread
+            this_user.receiver_hide = that_user.hide
+            this_user.receiver_deleted = that_user.deleted
+            this_user.receiver_highlight_time = that_user.highlight_time
+            this_user.receiver_delete_before = that_user.delete_before
 
         return user_stats
 
     async def get_1v1_info(
         self, user_id_a: int, user_id_b: int, db: Session, only_group_info: bool = False
     ) -> OneToOneStats:
+        """
+        called every time a chat window is opened; the group and both users' stats are
+        fetched with one query, and the counts from cache/cassandra run concurrently
+        """
         users = sorted([user_id_a, user_id_b])
-        group = await self.env.db.get_group_for_1to1(users[0], users[1], db)
-
+        group, user_stats_bases = await self.env.db.get_group_and_user_stats_for_1to1(users[0], users[1], db)
         group_id = group.group_id
-        message_amount = await self.count_messages_in_group(group_id)
 
-        users_and_join_time = await self.env.db.get_user_ids_and_join_time_in_group(
-            group_id, db
-        )
+        # same as get_user_ids_and_join_time_in_group(), but we already have the stats
+        users_and_join_time = {
+            user_id: to_ts(stats.join_time)
+            for user_id, stats in user_stats_bases.items()
+            if not stats.kicked
+        }
 
         if only_group_info:
+            message_amount = await self.count_messages_in_group(group_id)
             user_stats = list()
+
         else:
-            user_stats = await self._get_1v1_user_stats(group_id, user_id_a, user_id_b, db)
+            for user_id in [user_id_a, user_id_b]:
+                if user_id not in user_stats_bases:
+                    raise UserNotInGroupException(f"user {user_id} is not in group {group_id}")
+
+            message_amount, attachment_amount = await asyncio.gather(
+                self.count_messages_in_group(group_id),
+                self.count_attachments_in_group_for_user(
+                    group_id, user_id_a, user_stats_bases[user_id_a].delete_before
+                )
+            )
+
+            user_stats = self._get_1v1_user_stats(user_stats_bases, user_id_a, user_id_b, attachment_amount)
 
         return OneToOneStats(
             stats=user_stats,
@@ -262,8 +287,11 @@ class GroupResource(BaseResource, PublicGroupsCacheMixin):
             ),
         )
 
-    async def set_last_updated_at_on_all_stats_related_to_user(self, user_id: int, db: Session) -> None:
-        await self.env.db.set_last_updated_at_on_all_stats_related_to_user(user_id, db)
+    async def set_last_updated_at_on_all_stats_related_to_user(
+            self, user_id: int, db: Session, since: float = None
+    ) -> None:
+        since = to_dt(since, allow_none=True)
+        await self.env.db.set_last_updated_at_on_all_stats_related_to_user(user_id, db, since=since)
 
     async def count_attachments_in_group_for_user(self, group_id: str, user_id: int, since: dt, query: CountMessageQuery = None) -> int:
         include_deleted = query is not None and query.include_deleted and is_non_zero(query.admin_id)
@@ -362,34 +390,51 @@ class GroupResource(BaseResource, PublicGroupsCacheMixin):
     async def histories(
         self, group_id: str, user_id: int, query: MessageQuery, db: Session
     ) -> Histories:
-        async def get_messages():
-            # need to batch query cassandra, can't filter by user id
-            if query.only_sender:
-                _messages = await self.env.storage.get_messages_in_group_only_from_user(
-                    group_id, user_stats, query
-                )
-            else:
-                _messages = await self.env.storage.get_messages_in_group_for_user(
-                    group_id, user_stats, query
-                )
+        messages = await self._get_histories(group_id, user_id, query, db)
 
-            return [
+        return Histories(
+            messages=[
                 message_base_to_message(message)
-                for message in _messages
+                for message in messages
             ]
+        )
 
+    async def histories_raw(
+        self, group_id: str, user_id: int, query: MessageQuery, db: Session
+    ) -> bytes:
+        """
+        same as histories() but serialized to json bytes, without pydantic models
+        """
+        messages = await self._get_histories(group_id, user_id, query, db)
+
+        return dumps_to_bytes({
+            "messages": [
+                message_base_to_dict(message)
+                for message in messages
+            ]
+        })
+
+    async def _get_histories(
+        self, group_id: str, user_id: int, query: MessageQuery, db: Session
+    ) -> List[MessageBase]:
         await self._check_that_query_is_valid_and_group_is_active(group_id, query, db)
         user_stats = await self._get_stats_and_check_that_user_is_not_kicked(group_id, user_id, db)
 
-        messages = await get_messages()
+        # need to batch query cassandra, can't filter by user id
+        if query.only_sender:
+            messages = await self.env.storage.get_messages_in_group_only_from_user(
+                group_id, user_stats, query
+            )
+        else:
+            messages = await self.env.storage.get_messages_in_group_for_user(
+                group_id, user_stats, query
+            )
 
         # history api can be called by the admin interface, in which case we don't want to change read status
         if query.admin_id is None or query.admin_id == 0:
             await self._user_opens_conversation(group_id, user_id, user_stats, db)
 
-        return Histories(
-            messages=messages
-        )
+        return messages
 
     async def count_messages_in_group(self, group_id: str) -> int:
         n_messages, until = await self.env.cache.get_messages_in_group(group_id)
@@ -491,15 +536,7 @@ class GroupResource(BaseResource, PublicGroupsCacheMixin):
             for user_id in query.users
         }
 
-        group_type = await self.env.cache.get_group_type(group_id)
-
-        if group_type is None:
-            group_types = await self.env.db.get_group_types([group_id], db)
-            if group_id not in group_types:
-                raise NoSuchGroupException(group_id)
-
-            group_type = group_types[group_id]
-            await self.env.cache.set_group_type(group_id, group_type)
+        group_type = await self._get_group_type(group_id, db)
 
         await self.env.db.set_groups_updated_at([group_id], now, db)
         await self.env.db.update_user_stats_on_join_or_create_group(
@@ -519,6 +556,7 @@ class GroupResource(BaseResource, PublicGroupsCacheMixin):
             self, group_ids: List[str], user_id: int, query: CreateActionLogQuery, db: Session
     ) -> List[Message]:
         now = utcnow_dt()
+        before = time.time()
 
         group_id_to_type = await self.env.db.get_group_types(group_ids, db)
 
@@ -527,14 +565,20 @@ class GroupResource(BaseResource, PublicGroupsCacheMixin):
         await self.env.db.set_groups_updated_at(group_ids, now, db)
         await self.env.cache.reset_count_group_types_for_user(user_id)
 
-        action_logs = list()
+        # no need for an action log in 1v1 groups, it's not going to be shown anyway
+        group_ids_for_action_logs = [
+            group_id for group_id, group_type in group_id_to_type.items()
+            if group_type != GroupTypes.ONE_TO_ONE
+        ]
 
-        for group_id, group_type in group_id_to_type.items():
-            # no need for an action log in 1v1 groups, it's not going to be shown anyway
-            if group_type != GroupTypes.ONE_TO_ONE:
-                action_logs.append(
-                    await self.create_action_log(query.action_log, db, user_id=user_id, group_id=group_id)
-                )
+        action_logs = await self.create_action_logs_in_groups(
+            query.action_log, group_ids_for_action_logs, user_id, db
+        )
+
+        if len(group_ids) > 1:
+            elapsed = time.time() - before
+            report_timing("bulk.leave_groups", elapsed * 1000)
+            logger.info(f"user {user_id} left {len(group_ids)} groups in {elapsed:.2f}s")
 
         return action_logs
 
@@ -547,8 +591,9 @@ class GroupResource(BaseResource, PublicGroupsCacheMixin):
     ) -> Message:
         group = await self.env.db.get_group_from_id(group_id, db)
 
+        ttl = await self._get_message_ttl(group_id, db, group_type=group.group_type)
         attachments = await self.env.storage.delete_attachments(
-            group_id, group.created_at, user_id, query
+            group_id, group.created_at, user_id, query, ttl=ttl
         )
 
         now = utcnow_ts()
@@ -559,6 +604,6 @@ class GroupResource(BaseResource, PublicGroupsCacheMixin):
 
     async def delete_all_groups_for_user(self, user_id: int, query: CreateActionLogQuery, db: Session) -> None:
         group_id_to_type = await self.env.db.get_all_group_ids_and_types_for_user(user_id, db)
+        logger.info(f"deleting all {len(group_id_to_type)} groups for user {user_id}")
 
-        # TODO: this is async, but check how long time this would take for like 5-10k groups
-        await self.leave_groups(group_id_to_type, user_id, query, db)
+        await self.leave_groups(list(group_id_to_type.keys()), user_id, query, db)
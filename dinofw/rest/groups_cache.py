@@ -77,8 +77,10 @@ class PublicGroupsCacheMixin(ABC):
         return f"{CACHE_PREFIX}:{_langs_key(langs)}"
 
     def _keys(self, base: str) -> Tuple[str, str, str]:
-        # meta stores only an int (soft_expire), data stores raw JSON bytes
-        return f"{base}:meta", f"{base}:data", f"{base}:lock"
+        # meta stores only an int (soft_expire), data stores raw JSON bytes; the base is
+        # hash tagged, so the keys are in the same cluster slot and can be read with MGET
+        tagged = f"{{{base}}}"
+        return f"{tagged}:meta", f"{tagged}:data", f"{tagged}:lock"
 
     # ---------- public entry points ----------
 
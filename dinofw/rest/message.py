@@ -30,7 +30,8 @@ class MessageResource(BaseResource):
             error_message = f"group {group_id} is {GroupStatus.to_str(group_status)}"
             raise GroupIsFrozenOrArchivedException(error_message)
 
-        message = await self.env.storage.store_message(group_id, user_id, query)
+        ttl = await self._get_message_ttl(group_id, db)
+        message = await self.env.storage.store_message(group_id, user_id, query, ttl=ttl)
 
         await self._user_sends_a_message(
             group_id,
@@ -131,8 +132,9 @@ class MessageResource(BaseResource):
                 user_id, query.receiver_id, db
             )
 
+        ttl = await self._get_message_ttl(group_id, db)
         attachment = await self.env.storage.store_attachment(
-            group_id, user_id, message_id, query
+            group_id, user_id, message_id, query, ttl=ttl
         )
 
         update_last_message = True
@@ -177,8 +179,9 @@ class MessageResource(BaseResource):
     async def delete_attachment(self, group_id: str, query: AttachmentQuery, db: Session) -> None:
         group = await self.env.db.get_group_from_id(group_id, db)
 
+        ttl = await self._get_message_ttl(group_id, db, group_type=group.group_type)
         attachment = await self.env.storage.delete_attachment(
-            group_id, group.created_at, query
+            group_id, group.created_at, query, ttl=ttl
         )
 
         now = utcnow_ts()
@@ -198,7 +201,8 @@ class MessageResource(BaseResource):
         if group_id is None or not len(group_id.strip()):
             group_id = users_to_group_id(user_id, query.receiver_id)
 
-        await self.env.storage.edit_message(group_id, user_id, message_id, query)
+        ttl = await self._get_message_ttl(group_id, db)
+        await self.env.storage.edit_message(group_id, user_id, message_id, query, ttl=ttl)
         action_log = await self.create_action_log(query.action_log, db, group_id=group_id)
 
         """
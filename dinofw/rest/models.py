@@ -1,3 +1,4 @@
+from typing import Dict
 from typing import List
 from typing import Optional
 
@@ -94,6 +95,39 @@ class OnlineCount(BaseModel):
     online_count: int
 
 
+class CacheFamilyStats(BaseModel):
+    calls: int
+    hits: int
+    misses: int
+    hit_ratio: Optional[float]
+    l1_hits: int
+    l1_misses: int
+    l1_hit_ratio: Optional[float]
+    avg_latency_ms: float
+    max_latency_ms: float
+
+
+class CachePipelineStats(BaseModel):
+    count: int
+    avg_size: float
+    max_size: int
+    avg_latency_ms: float
+
+
+class CacheStats(BaseModel):
+    l1: Dict[str, int]
+    families: Dict[str, CacheFamilyStats]
+    pipelines: CachePipelineStats
+
+
+class Readiness(BaseModel):
+    ready: bool
+    timed_out: bool
+    groups: int
+    users: int
+    elapsed: Optional[float]
+
+
 class AllUnDeletedGroups(BaseModel):
     stats: List[UnDeletedGroup]
 
@@ -187,3 +221,34 @@ class MessageCount(BaseModel):
     user_id: int
     delete_before: float
     message_count: int
+
+
+class DeletionPlanGroup(BaseModel):
+    group_id: str
+    delete_before: float
+    message_count: int
+    attachment_count: int
+
+    # one range tombstone per table and group
+    tombstones: int
+
+
+class DeletionPlan(BaseModel):
+    full_sweep: bool
+    groups: List[DeletionPlanGroup]
+    message_count: int
+    attachment_count: int
+    tombstones: int
+
+
+class DeletionRunSummary(BaseModel):
+    full_sweep: bool
+    candidates: int = 0
+    groups: int = 0
+    failed: int = 0
+
+    # summed over all groups, the deletions run concurrently so might exceed elapsed_ms
+    query_ms: float = 0
+    delete_ms: float = 0
+    update_ms: float = 0
+    elapsed_ms: float = 0
@@ -1,12 +1,12 @@
 from datetime import datetime as dt
-from time import time
-from typing import List, Tuple, Set, Optional
+from typing import List, Tuple, Optional
 
 from loguru import logger
 from sqlalchemy.orm import Session
 
-from dinofw.db.rdbms.schemas import UserGroupBase, DeletedStatsBase
+from dinofw.db.rdbms.schemas import UserGroupRecord, DeletedStatsBase
 from dinofw.rest.base import BaseResource
+from dinofw.rest.groups_cache import dumps_to_bytes
 from dinofw.rest.models import UserGroup, LastReads, DeletedStats, UnDeletedGroup
 from dinofw.rest.models import UserStats
 from dinofw.rest.queries import ActionLogQuery, UserIdQuery, SessionUser
@@ -18,6 +18,8 @@ from dinofw.utils import to_ts
 from dinofw.utils import utcnow_ts
 from dinofw.utils.config import GroupTypes
 from dinofw.utils.convert import to_user_group, to_last_reads, to_deleted_stats, to_undeleted_stats
+from dinofw.utils.convert import to_user_group_dicts
+from dinofw.utils.perf import report_gauge
 
 
 class UserResource(BaseResource):
@@ -29,27 +31,30 @@ class UserResource(BaseResource):
         return to_deleted_stats(deleted_groups)
 
     async def update_user_sessions(self, users: List[SessionUser], db: Session):
-        current_online_users: Set[int] = await self.env.db.get_online_users(db)
+        """
+        Called periodically by the mqtt bridge with all current sessions. The
+        online set in redis is the presence store; it's kept up to date by the
+        real-time session api, and reconciled here against the full list.
+        """
+        online_users = list({user.user_id for user in users if user.is_online})
 
-        online_users = {user.user_id for user in users if user.is_online}
-        offline_users = {
-            user.user_id for user in users
-            # avoid sending duplicate offline events to kafka by checking currently online users
-            if not user.is_online and user.user_id in current_online_users
-        }
+        # users reported as offline that were not online are skipped, to avoid duplicate offline events
+        offline_users = set(await self.env.cache.reconcile_online_users(online_users))
 
-        for user_id in current_online_users:
-            if user_id not in online_users:
-                offline_users.add(user_id)
+        # once in a while also find users stuck in public groups, e.g. if an offline event was missed
+        if await self.env.cache.get_online_users_ttl_expired():
+            dangling = await self.env.db.get_offline_users_in_public_groups(online_users, db)
+            offline_users.update(dangling)
 
-        offline_users = list(offline_users)
-        online_users = list(online_users)
+            await self.env.cache.set_online_users_ttl_expired()
+            report_gauge("presence.dangling", len(dangling))
 
-        await self.env.cache.set_online_users(offline_users, online_users)
+        report_gauge("presence.online", len(online_users))
+        report_gauge("presence.offline", len(offline_users))
 
         # only notify if someone left
         if offline_users:
-            self.env.server_publisher.offline_users(offline_users)
+            self.env.server_publisher.offline_users(list(offline_users))
 
     async def update_real_time_user_session(self, user: SessionUser):
         logger.debug(f"update_real_time_user_session: {user.json()}")
@@ -71,48 +76,53 @@ class UserResource(BaseResource):
     async def get_groups_for_user(
         self, user_id: int, query: GroupQuery, db: Session
     ) -> List[UserGroup]:
-        user_groups: List[UserGroupBase] = await self.env.db.get_groups_for_user(
+        user_groups: List[UserGroupRecord] = await self.env.db.get_groups_for_user(
             user_id, query, db
         )
 
         return to_user_group(user_groups)
 
+    async def get_groups_for_user_raw(self, user_id: int, query: GroupQuery, db: Session) -> bytes:
+        """
+        same as get_groups_for_user() but serialized to json bytes, without pydantic models
+        """
+        user_groups: List[UserGroupRecord] = await self.env.db.get_groups_for_user(
+            user_id, query, db
+        )
+
+        return dumps_to_bytes(to_user_group_dicts(user_groups))
+
     async def create_action_log_in_all_groups(
             self, user_id: int, query: ActionLogQuery, db: Session
     ) -> None:
         """
         This method is called only from an async rest api, so if it
-        takes a while it doesn't matter for the caller.
+        takes a while it doesn't matter for the caller. Progress is
+        recorded after each chunk of groups, so if the task dies it can
+        be called again with the same payload to finish the remaining
+        groups without duplicating the action logs in the finished ones.
         """
-        group_ids_and_created_at: Tuple[str, dt] = await self.env.db.get_group_ids_and_created_at_for_user(
+        group_ids_and_created_at: List[Tuple[str, dt]] = await self.env.db.get_group_ids_and_created_at_for_user(
             user_id, db
         )
 
-        n_groups = len(group_ids_and_created_at)
-        before = None
-        if n_groups > 100:
-            before = time()
-
         # ignore all fields except "payload"
         query.receiver_id = None
         query.user_id = None
         query.group_id = None
 
-        for group_id, _ in group_ids_and_created_at:
-            try:
-                await self.create_action_log(query, db, user_id=user_id, group_id=group_id)
-            except Exception as e:
-                logger.error(f"could not create action log in group {group_id} for user {user_id}: {str(e)}")
-                logger.exception(e)
-
-        if before is not None:
-            elapsed = time() - before
-            logger.info(f"creating action log in {n_groups} groups for user {user_id} took {elapsed:.1f}s")
+        await self.create_action_logs_in_groups(
+            query,
+            [group_id for group_id, _ in group_ids_and_created_at],
+            user_id,
+            db,
+            resumable=True
+        )
 
     async def get_groups_updated_since(
         self, user_id: int, query: GroupUpdatesQuery, db: Session
     ) -> List[UserGroup]:
-        user_groups: List[UserGroupBase] = await self.env.db.get_groups_updated_since(
+        user_groups: List[UserGroupRecord] = await self.env.db.get_groups_updated_since(
             user_id, query, db
         )
 
@@ -121,12 +131,21 @@ class UserResource(BaseResource):
     async def get_public_groups_updated_since(
         self, user_id: int, query: GroupUpdatesQuery, db: Session
     ) -> List[UserGroup]:
-        user_groups: List[UserGroupBase] = await self.env.db.get_groups_updated_since(
+        user_groups: List[UserGroupRecord] = await self.env.db.get_groups_updated_since(
             user_id, query, db, public_only=True
         )
 
         return to_user_group(user_groups)
 
+    async def get_groups_updated_since_raw(
+        self, user_id: int, query: GroupUpdatesQuery, db: Session, public_only: bool = False
+    ) -> bytes:
+        user_groups: List[UserGroupRecord] = await self.env.db.get_groups_updated_since(
+            user_id, query, db, public_only=public_only
+        )
+
+        return dumps_to_bytes(to_user_group_dicts(user_groups))
+
     async def get_last_read(self, group_id: str, query: UserIdQuery, db: Session) -> LastReads:
         if query.user_id is None:
             last_reads = await self.env.db.get_last_reads_in_group(group_id, db)
@@ -193,7 +212,18 @@ class UserResource(BaseResource):
 
     async def delete_all_user_attachments(self, user_id: int, query: DeleteAttachmentQuery, db: Session) -> None:
         group_created_at = await self.env.db.get_group_ids_and_created_at_for_user(user_id, db)
-        group_to_atts = await self.env.storage.delete_attachments_in_all_groups(group_created_at, user_id, query)
+
+        ttl_group_ids = None
+        if self.env.storage.room_message_ttl is not None:
+            group_id_to_type = await self.env.db.get_group_types([group_id for group_id, _ in group_created_at], db)
+            ttl_group_ids = {
+                group_id for group_id, group_type in group_id_to_type.items()
+                if group_type in GroupTypes.public_group_types
+            }
+
+        group_to_atts = await self.env.storage.delete_attachments_in_all_groups(
+            group_created_at, user_id, query, ttl_group_ids=ttl_group_ids
+        )
 
         now = utcnow_ts()
 
@@ -66,10 +66,15 @@ async def startup():
     await environ.startup()
     await environ.env.client_publisher.setup()
     environ.env.server_publisher.setup()
+    environ.env.cache.start_invalidation_listener()
+    environ.start_cache_warm_up(environ.env)
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    logger.info("🔌 stopping the cache invalidation listener...")
+    await environ.env.cache.stop_invalidation_listener()
+
     logger.info("🔌 stopping the MQTT publisher...")
     await environ.env.client_publisher.stop()
 
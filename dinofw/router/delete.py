@@ -5,7 +5,6 @@ from fastapi import APIRouter
 from fastapi import Depends
 from loguru import logger
 from sqlalchemy.orm import Session
-from starlette.background import BackgroundTask
 from starlette.responses import Response
 from starlette.status import HTTP_201_CREATED
 
@@ -16,7 +15,8 @@ from dinofw.utils import environ
 from dinofw.utils.api import get_db
 from dinofw.utils.api import log_error_and_raise_known
 from dinofw.utils.api import log_error_and_raise_unknown
-from dinofw.utils.config import ErrorCodes, GroupTypes
+from dinofw.utils.api import run_in_background
+from dinofw.utils.config import ErrorCodes, GroupTypes, JobTypes
 from dinofw.utils.decorators import wrap_exception
 from dinofw.utils.exceptions import NoSuchGroupException
 from dinofw.utils.perf import timeit
@@ -63,12 +63,10 @@ async def delete_all_groups_for_user(
     * `250`: if an unknown error occurred.
     """
 
-    async def leave_all_groups(user_id_, query_, db_):
-        await environ.env.rest.group.delete_all_groups_for_user(user_id_, query_, db_)
-
     try:
-        task = BackgroundTask(leave_all_groups, user_id_=user_id, query_=query, db_=db)
-        return Response(background=task, status_code=HTTP_201_CREATED)
+        return await run_in_background(
+            JobTypes.DELETE_ALL_GROUPS_FOR_USER, db, user_id=user_id, query=query
+        )
     except Exception as e:
         log_error_and_raise_unknown(sys.exc_info(), e)
 
@@ -88,14 +86,10 @@ async def delete_attachment_with_file_id(
     * `250`: if an unknown error occurred.
     """
 
-    async def _delete_attachment_with_file_id(group_id_, query_, db_):
-        await environ.env.rest.message.delete_attachment(group_id_, query_, db_)
-
     try:
-        task = BackgroundTask(
-            _delete_attachment_with_file_id, group_id_=group_id, query_=query, db_=db
+        return await run_in_background(
+            JobTypes.DELETE_ATTACHMENT, db, group_id=group_id, query=query
         )
-        return Response(background=task, status_code=HTTP_201_CREATED)
     except Exception as e:
         log_error_and_raise_unknown(sys.exc_info(), e)
 
@@ -138,13 +132,9 @@ async def delete_attachments_in_all_groups_from_user(
     * `250`: if an unknown error occurred.
     """
 
-    async def _delete_attachments_in_all_groups_from_user(user_id_, query_, db_):
-        await environ.env.rest.user.delete_all_user_attachments(user_id_, query_, db_)
-
     try:
-        task = BackgroundTask(
-            _delete_attachments_in_all_groups_from_user, user_id_=user_id, query_=query, db_=db
+        return await run_in_background(
+            JobTypes.DELETE_ALL_USER_ATTACHMENTS, db, user_id=user_id, query=query
         )
-        return Response(background=task, status_code=HTTP_201_CREATED)
     except Exception as e:
         log_error_and_raise_unknown(sys.exc_info(), e)
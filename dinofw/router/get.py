@@ -3,6 +3,7 @@ from typing import Optional
 
 from fastapi import APIRouter
 from fastapi import Depends
+from fastapi import Response
 from loguru import logger
 from sqlalchemy.orm import Session
 
@@ -11,6 +12,8 @@ from dinofw.rest.models import UserGroup
 from dinofw.rest.models import IsOnline
 from dinofw.rest.models import UsersGroup
 from dinofw.rest.models import OnlineCount
+from dinofw.rest.models import Readiness
+from dinofw.rest.models import CacheStats
 from dinofw.rest.queries import GroupInfoQuery
 from dinofw.utils import environ
 from dinofw.utils.api import get_db
@@ -55,6 +58,49 @@ async def count_users_online() -> OnlineCount:
     )
 
 
+@router.get("/ready", response_model=Readiness)
+@wrap_exception()
+async def get_readiness(response: Response) -> Readiness:
+    """
+    Check if the cache warm-up after startup has finished, either completely or by running out
+    of its time budget (`timed_out`). Responds with status 503 until then, so it can be used as
+    a readiness probe.
+
+    **Potential error codes in response:**
+    * `250`: if an unknown error occurred.
+    """
+    warmup = getattr(environ.env, "warmup", None)
+
+    # no warm-up when testing, or if it's the deleter
+    if warmup is None:
+        return Readiness(ready=True, timed_out=False, groups=0, users=0, elapsed=None)
+
+    if not warmup.finished:
+        response.status_code = 503
+
+    return Readiness(
+        ready=warmup.finished,
+        timed_out=warmup.timed_out,
+        groups=warmup.n_groups,
+        users=warmup.n_users,
+        elapsed=warmup.elapsed,
+    )
+
+
+@router.get("/cache/stats", response_model=CacheStats)
+@wrap_exception()
+async def get_cache_stats() -> CacheStats:
+    """
+    Get the hits, misses and latencies of the cache in this instance since it started, per
+    key family (e.g. `users_in_group` for the `group:users:{group_id}` keys). Commands sent in
+    a pipeline are counted in the families, but their latency is included in `pipelines`.
+
+    **Potential error codes in response:**
+    * `250`: if an unknown error occurred.
+    """
+    return CacheStats(**environ.env.cache.get_metrics())
+
+
 @router.get("/online/{user_id}", response_model=IsOnline)
 @wrap_exception()
 async def is_user_online(user_id: int) -> IsOnline:
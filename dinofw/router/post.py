@@ -9,9 +9,7 @@ from fastapi import APIRouter
 from fastapi import Depends
 from loguru import logger
 from sqlalchemy.orm import Session
-from starlette.background import BackgroundTask
 from starlette.responses import Response
-from starlette.status import HTTP_201_CREATED
 
 from dinofw.db.rdbms.schemas import UserGroupStatsBase
 from dinofw.rest.groups_cache import dumps_to_bytes
@@ -41,7 +39,9 @@ from dinofw.utils import to_ts
 from dinofw.utils.api import get_db
 from dinofw.utils.api import log_error_and_raise_known
 from dinofw.utils.api import log_error_and_raise_unknown
+from dinofw.utils.api import run_in_background
 from dinofw.utils.config import ErrorCodes
+from dinofw.utils.config import JobTypes
 from dinofw.utils.decorators import wrap_exception
 from dinofw.utils.exceptions import GroupIsFrozenOrArchivedException
 from dinofw.utils.exceptions import InvalidRangeException
@@ -236,7 +236,8 @@ async def get_group_history_for_user(
     * `250`: if an unknown error occurred.
     """
     try:
-        return await environ.env.rest.group.histories(group_id, user_id, query, db)
+        raw = await environ.env.rest.group.histories_raw(group_id, user_id, query, db)
+        return Response(content=raw, media_type="application/json")
     except UserIsKickedException as e:
         log_error_and_raise_known(ErrorCodes.USER_IS_KICKED, sys.exc_info(), e)
     except NoSuchGroupException as e:
@@ -291,7 +292,8 @@ async def get_groups_for_user(
     * `250`: if an unknown error occurred.
     """
     try:
-        return await environ.env.rest.user.get_groups_for_user(user_id, query, db)
+        raw = await environ.env.rest.user.get_groups_for_user_raw(user_id, query, db)
+        return Response(content=raw, media_type="application/json")
     except Exception as e:
         log_error_and_raise_unknown(sys.exc_info(), e)
 
@@ -331,7 +333,8 @@ async def get_groups_updated_since(
     * `250`: if an unknown error occurred.
     """
     try:
-        return await environ.env.rest.user.get_groups_updated_since(user_id, query, db)
+        raw = await environ.env.rest.user.get_groups_updated_since_raw(user_id, query, db)
+        return Response(content=raw, media_type="application/json")
     except Exception as e:
         log_error_and_raise_unknown(sys.exc_info(), e)
 
@@ -349,7 +352,8 @@ async def get_public_groups_updated_since(
     * `250`: if an unknown error occurred.
     """
     try:
-        return await environ.env.rest.user.get_public_groups_updated_since(user_id, query, db)
+        raw = await environ.env.rest.user.get_groups_updated_since_raw(user_id, query, db, public_only=True)
+        return Response(content=raw, media_type="application/json")
     except Exception as e:
         log_error_and_raise_unknown(sys.exc_info(), e)
 
@@ -628,15 +632,10 @@ async def create_action_log_in_all_groups_for_user(
     * `250`: if an unknown error occurred.
     """
 
-    async def _create_action_logs(user_id_, query_, db_):
-        query_.update_group_updated_at = False
-        await environ.env.rest.user.create_action_log_in_all_groups(user_id_, query_, db_)
-
     try:
-        task = BackgroundTask(
-            _create_action_logs, user_id_=user_id, query_=query, db_=db
+        return await run_in_background(
+            JobTypes.CREATE_ACTION_LOGS_FOR_USER, db, user_id=user_id, query=query
         )
-        return Response(background=task, status_code=HTTP_201_CREATED)
     except Exception as e:
         log_error_and_raise_unknown(sys.exc_info(), e)
 
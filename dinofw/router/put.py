@@ -5,7 +5,6 @@ from fastapi import APIRouter
 from fastapi import Depends
 from loguru import logger
 from sqlalchemy.orm import Session
-from starlette.background import BackgroundTask
 from starlette.responses import Response
 from starlette.status import HTTP_201_CREATED
 
@@ -17,7 +16,9 @@ from dinofw.utils import environ
 from dinofw.utils.api import get_db
 from dinofw.utils.api import log_error_and_raise_known
 from dinofw.utils.api import log_error_and_raise_unknown
+from dinofw.utils.api import run_in_background
 from dinofw.utils.config import ErrorCodes
+from dinofw.utils.config import JobTypes
 from dinofw.utils.decorators import wrap_exception
 from dinofw.utils.exceptions import NoSuchGroupException, NoSuchMessageException
 from dinofw.utils.exceptions import UserIsKickedException
@@ -30,13 +31,19 @@ router = APIRouter()
 @router.put("/userstats/{user_id}", status_code=HTTP_201_CREATED)
 @timeit(logger, "PUT", "/userstats/{user_id}")
 @wrap_exception()
-async def update_user_stats(user_id: int, db: Session = Depends(get_db)) -> Response:
+async def update_user_stats(
+    user_id: int, since: Optional[float] = None, db: Session = Depends(get_db)
+) -> Response:
     """
     Update user status, e.g. because the user got blocked, is a bot, was
     force fake-checked, etc. Will set `last_updated_at` on all user group
     stats that has had an interaction with this user (including this
     user's user group stats).
 
+    If the optional query parameter `since` (unix timestamp) is set, only
+    groups where this user's stats has been updated since then will be
+    updated.
+
     This API is run asynchronously, and returns a 201 Created instead of
     200 OK.
 
@@ -44,14 +51,8 @@ async def update_user_stats(user_id: int, db: Session = Depends(get_db)) -> Resp
     * `250`: if an unknown error occurred.
     """
 
-    async def set_last_updated(user_id_, db_):
-        await environ.env.rest.group.set_last_updated_at_on_all_stats_related_to_user(
-            user_id_, db_
-        )
-
     try:
-        task = BackgroundTask(set_last_updated, user_id_=user_id, db_=db)
-        return Response(background=task, status_code=HTTP_201_CREATED)
+        return await run_in_background(JobTypes.UPDATE_USER_STATS, db, user_id=user_id, since=since)
     except Exception as e:
         log_error_and_raise_unknown(sys.exc_info(), e)
 
@@ -111,12 +112,8 @@ async def mark_all_groups_as_read(
     * `250`: if an unknown error occurred.
     """
 
-    async def set_read_time(user_id_, db_):
-        await environ.env.rest.group.mark_all_as_read(user_id_, db_)
-
     try:
-        task = BackgroundTask(set_read_time, user_id_=user_id, db_=db)
-        return Response(background=task, status_code=HTTP_201_CREATED)
+        return await run_in_background(JobTypes.MARK_ALL_AS_READ, db, user_id=user_id)
     except Exception as e:
         log_error_and_raise_unknown(sys.exc_info(), e)
 
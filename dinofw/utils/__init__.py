@@ -14,6 +14,14 @@ def split_into_chunks(objects, n):
         yield objects[i:i + n]
 
 
+def config_or_default(env, key: str, domain: str, default):
+    # unset environment variables in config.yaml are kept as e.g. "$DINO_REDIS_..."
+    value = env.config.get(key, domain=domain, default=None)
+    if value is None or (isinstance(value, str) and (not len(value.strip()) or value.startswith("$"))):
+        return default
+    return value
+
+
 def unicode_len(string):
     return int(len(string.encode(encoding="utf_16_le")) / 2)
 
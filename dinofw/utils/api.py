@@ -3,7 +3,12 @@ import inspect
 from fastapi import HTTPException
 from fastapi import status
 from loguru import logger
+from starlette.background import BackgroundTask
+from starlette.responses import Response
+from starlette.status import HTTP_201_CREATED
 
+from dinofw.jobs.handlers import execute_job
+from dinofw.jobs.handlers import to_job_args
 from dinofw.utils import environ
 from dinofw.utils.config import ErrorCodes
 
@@ -14,6 +19,22 @@ async def get_db():
         yield db
 
 
+async def run_in_background(job_type: str, db, **kwargs) -> Response:
+    """
+    hand the job over to the job queue if one is configured, so it survives
+    restarts of this node, otherwise run it after the response has been sent
+    """
+    args = to_job_args(**kwargs)
+    job_queue = getattr(environ.env, "job_queue", None)
+
+    if job_queue is not None:
+        await job_queue.enqueue(job_type, args)
+        return Response(status_code=HTTP_201_CREATED)
+
+    task = BackgroundTask(execute_job, job_type, args, db)
+    return Response(background=task, status_code=HTTP_201_CREATED)
+
+
 def log_error_and_raise_unknown(exc_info, e):
     func_name = inspect.currentframe().f_back.f_code.co_name
     logger.error(f"{func_name}: {str(e)}")
@@ -77,6 +77,60 @@ class PayloadStatus:
 class DefaultValues:
     PER_PAGE: Final = 100
 
+    # how many groups to handle at a time when e.g. leaving or creating action logs in all groups of a user
+    BULK_CHUNK_SIZE: Final = 500
+
+    # max number of concurrent cassandra writes for bulk operations
+    MAX_CONCURRENT_WRITES: Final = 50
+
+    # max number of groups the deleter removes messages in at the same time
+    DELETER_CONCURRENCY: Final = 10
+
+    # background job queue (redis streams), used if not specified in the 'publisher' config
+    JOB_STREAM: Final = "dino:jobs"
+    JOB_GROUP: Final = "dino-workers"
+    JOB_BLOCK_MS: Final = 5000
+    JOB_CONCURRENCY: Final = 4
+    JOB_MAX_RETRIES: Final = 3
+
+    # jobs pending for longer than this on a dead/stuck worker will be claimed by another worker
+    JOB_CLAIM_IDLE_MS: Final = 5 * 60 * 1000
+
+    # redis connection pool for the cache, used if not specified in the 'cache' config; no max
+    # connections means unbounded, and health checks (seconds) ping connections that have been
+    # idle for longer than the interval before using them
+    REDIS_MAX_CONNECTIONS: Final = None
+    REDIS_HEALTH_CHECK_INTERVAL: Final = 30
+    REDIS_SOCKET_KEEPALIVE: Final = True
+
+    # max size of the in-process cache in front of redis; each key counts as one, except the users of a
+    # group, which count once per user (roughly 100 bytes each), so about 10MB at most
+    L1_CACHE_MAX_SIZE: Final = 100_000
+
+    # groups with at least this many users are cached as one packed value instead of a hash
+    PACKED_USERS_THRESHOLD: Final = 1_000
+
+    # fan-out to all users in a group is done in batches of user ids
+    USER_ID_BATCH_SIZE: Final = 500
+
+    # on startup, the cache is warmed up for this many recently active groups and users, for at most
+    # this many seconds, before the instance reports itself as ready
+    WARMUP_GROUPS: Final = 2_000
+    WARMUP_USERS: Final = 5_000
+    WARMUP_BUDGET: Final = 20
+
+    # seconds between reporting the cache hits, misses and latencies to the stats service
+    CACHE_METRICS_INTERVAL: Final = 10
+
+
+class JobTypes:
+    UPDATE_USER_STATS = "update_user_stats"
+    DELETE_ALL_GROUPS_FOR_USER = "delete_all_groups_for_user"
+    CREATE_ACTION_LOGS_FOR_USER = "create_action_logs_for_user"
+    MARK_ALL_AS_READ = "mark_all_as_read"
+    DELETE_ATTACHMENT = "delete_attachment"
+    DELETE_ALL_USER_ATTACHMENTS = "delete_all_user_attachments"
+
 
 class EventTypes:
     JOIN = "join"
@@ -94,6 +148,7 @@ class EventTypes:
 class RedisKeys:
     RKEY_AUTH: Final = "user:auth:{}"  # user:auth:user_id
     RKEY_USERS_IN_GROUP: Final = "group:users:{}"  # group:users:group_id
+    RKEY_USERS_IN_GROUP_PACKED: Final = "group:users:packed:{}"  # group:users:packed:group_id
     RKEY_LAST_SEND_TIME: Final = "group:lastsent:{}"  # group:lastsent:group_id
     RKEY_LAST_READ_TIME: Final = "group:lastread:{}"  # group:lastread:group_id
     RKEY_LAST_READ_TIME_OLDEST: Final = "group:lastread:oldest:{}"  # group:lastread:oldest:group_id
@@ -118,14 +173,57 @@ class RedisKeys:
     RKEY_PUBLIC_GROUP_IDS = "groups:public"
     RKEY_GROUP_TYPE = "group:type:{}"  # group:type:group_id
     RKEY_ONLINE_USERS = "users:online"
+    RKEY_ACTION_LOGS_DONE = "actionlogs:done:{}:{}"  # actionlogs:done:user_id:payload_hash
+    RKEY_DELETER = "deleter"
+    RKEY_DELETION_CANDIDATES = "{}:candidates"  # deleter:candidates
+    RKEY_CACHE_INVALIDATION = "cache:invalidation"  # pub/sub channel for the in-process caches
+    RKEY_DELETION_CANDIDATES_IN_PROGRESS = "{}:candidates:inprogress"  # deleter:candidates:inprogress
+
+    # the mqtt server reads the auth keys, so those are never tagged
+    hash_tags = False
+
+    @staticmethod
+    def use_hash_tags(enabled: bool) -> None:
+        RedisKeys.hash_tags = enabled
+
+    @staticmethod
+    def _tag(value) -> str:
+        # keys with the same hash tag are in the same cluster slot, so pipelines and
+        # scripts using only the keys of one group (or one user) only touch one node
+        if RedisKeys.hash_tags:
+            return f"{{{value}}}"
+        return str(value)
+
+    @staticmethod
+    def untagged(key: str) -> str:
+        """
+        the name of a key before hash tags were used; ids never contain braces
+        """
+        return key.replace("{", "").replace("}", "")
+
+    @staticmethod
+    def cache_invalidation() -> str:
+        return RedisKeys.RKEY_CACHE_INVALIDATION
+
+    @staticmethod
+    def deletion_candidates() -> str:
+        return RedisKeys.RKEY_DELETION_CANDIDATES.format(RedisKeys._tag(RedisKeys.RKEY_DELETER))
+
+    @staticmethod
+    def deletion_candidates_in_progress() -> str:
+        return RedisKeys.RKEY_DELETION_CANDIDATES_IN_PROGRESS.format(RedisKeys._tag(RedisKeys.RKEY_DELETER))
+
+    @staticmethod
+    def action_logs_done(user_id: int, payload_hash: str) -> str:
+        return RedisKeys.RKEY_ACTION_LOGS_DONE.format(RedisKeys._tag(user_id), payload_hash)
 
     @staticmethod
     def online_users() -> str:
-        return RedisKeys.RKEY_ONLINE_USERS
+        return RedisKeys._tag(RedisKeys.RKEY_ONLINE_USERS)
 
     @staticmethod
     def group_type(group_id: str) -> str:
-        return RedisKeys.RKEY_GROUP_TYPE.format(group_id)
+        return RedisKeys.RKEY_GROUP_TYPE.format(RedisKeys._tag(group_id))
 
     @staticmethod
     def public_group_ids() -> str:
@@ -133,91 +231,95 @@ class RedisKeys:
 
     @staticmethod
     def group_archived(group_id: str) -> str:
-        return RedisKeys.RKEY_GROUP_ARCHIVED.format(group_id)
+        return RedisKeys.RKEY_GROUP_ARCHIVED.format(RedisKeys._tag(group_id))
 
     @staticmethod
     def group_status(group_id: str) -> str:
-        return RedisKeys.RKEY_GROUP_STATUS.format(group_id)
+        return RedisKeys.RKEY_GROUP_STATUS.format(RedisKeys._tag(group_id))
 
     @staticmethod
     def client_id(domain: str, user_id: int) -> str:
-        return RedisKeys.RKEY_CLIENT_ID.format(domain, user_id)
+        return RedisKeys.RKEY_CLIENT_ID.format(domain, RedisKeys._tag(user_id))
 
     @staticmethod
     def total_unread_count(user_id: int) -> str:
-        return RedisKeys.RKEY_TOTAL_UNREAD_COUNT.format(user_id)
+        return RedisKeys.RKEY_TOTAL_UNREAD_COUNT.format(RedisKeys._tag(user_id))
 
     @staticmethod
     def unread_groups(user_id: int) -> str:
-        return RedisKeys.RKEY_UNREAD_GROUPS.format(user_id)
+        return RedisKeys.RKEY_UNREAD_GROUPS.format(RedisKeys._tag(user_id))
 
     @staticmethod
     def delete_before(group_id: str, user_id: int) -> str:
-        return RedisKeys.RKEY_DELETE_BEFORE.format(group_id, user_id)
+        return RedisKeys.RKEY_DELETE_BEFORE.format(RedisKeys._tag(group_id), user_id)
 
     @staticmethod
     def attachment_count_group_user(group_id: str, user_id: int) -> str:
-        return RedisKeys.RKEY_ATT_COUNT_GROUP_USER.format(group_id, user_id)
+        return RedisKeys.RKEY_ATT_COUNT_GROUP_USER.format(RedisKeys._tag(group_id), user_id)
 
     @staticmethod
     def sent_message_count_in_group(group_id: str) -> str:
-        return RedisKeys.RKEY_SENT_MSGS_COUNT_IN_GROUP.format(group_id)
+        return RedisKeys.RKEY_SENT_MSGS_COUNT_IN_GROUP.format(RedisKeys._tag(group_id))
 
     @staticmethod
     def group_exists(group_id: str) -> str:
-        return RedisKeys.RKEY_GROUP_EXISTS.format(group_id)
+        return RedisKeys.RKEY_GROUP_EXISTS.format(RedisKeys._tag(group_id))
 
     @staticmethod
     def last_message_time(group_id: str) -> str:
-        return RedisKeys.RKEY_LAST_MESSAGE_TIME.format(group_id)
+        return RedisKeys.RKEY_LAST_MESSAGE_TIME.format(RedisKeys._tag(group_id))
 
     @staticmethod
     def last_read_time_user(user_id: int) -> str:
-        return RedisKeys.RKEY_LAST_READ_TIME_USER.format(user_id)
+        return RedisKeys.RKEY_LAST_READ_TIME_USER.format(RedisKeys._tag(user_id))
 
     @staticmethod
     def last_sent_time_user(user_id: int) -> str:
-        return RedisKeys.RKEY_LAST_SENT_TIME_USER.format(user_id)
+        return RedisKeys.RKEY_LAST_SENT_TIME_USER.format(RedisKeys._tag(user_id))
 
     @staticmethod
     def count_group_types_including_hidden(user_id: int) -> str:
-        return RedisKeys.RKEY_GROUP_COUNT_INCL_HIDDEN.format(user_id)
+        return RedisKeys.RKEY_GROUP_COUNT_INCL_HIDDEN.format(RedisKeys._tag(user_id))
 
     @staticmethod
     def count_group_types_not_including_hidden(user_id: int) -> str:
-        return RedisKeys.RKEY_GROUP_COUNT_NO_HIDDEN.format(user_id)
+        return RedisKeys.RKEY_GROUP_COUNT_NO_HIDDEN.format(RedisKeys._tag(user_id))
 
     @staticmethod
     def messages_in_group(group_id: str) -> str:
-        return RedisKeys.RKEY_MESSAGES_IN_GROUP.format(group_id)
+        return RedisKeys.RKEY_MESSAGES_IN_GROUP.format(RedisKeys._tag(group_id))
 
     @staticmethod
     def hide_group(group_id: str) -> str:
-        return RedisKeys.RKEY_HIDE_GROUP.format(group_id)
+        return RedisKeys.RKEY_HIDE_GROUP.format(RedisKeys._tag(group_id))
 
     @staticmethod
     def user_stats_in_group(group_id: str) -> str:
-        return RedisKeys.RKEY_USER_STATS_IN_GROUP.format(group_id)
+        return RedisKeys.RKEY_USER_STATS_IN_GROUP.format(RedisKeys._tag(group_id))
 
     @staticmethod
     def oldest_last_read_time(group_id: str):
-        return RedisKeys.RKEY_LAST_READ_TIME_OLDEST.format(group_id)
+        return RedisKeys.RKEY_LAST_READ_TIME_OLDEST.format(RedisKeys._tag(group_id))
 
     @staticmethod
     def last_read_time(group_id: str) -> str:
-        return RedisKeys.RKEY_LAST_READ_TIME.format(group_id)
+        return RedisKeys.RKEY_LAST_READ_TIME.format(RedisKeys._tag(group_id))
 
     @staticmethod
     def last_send_time(group_id: str) -> str:
-        return RedisKeys.RKEY_LAST_SEND_TIME.format(group_id)
+        return RedisKeys.RKEY_LAST_SEND_TIME.format(RedisKeys._tag(group_id))
 
     @staticmethod
     def user_in_group(group_id: str) -> str:
-        return RedisKeys.RKEY_USERS_IN_GROUP.format(group_id)
+        return RedisKeys.RKEY_USERS_IN_GROUP.format(RedisKeys._tag(group_id))
+
+    @staticmethod
+    def user_in_group_packed(group_id: str) -> str:
+        return RedisKeys.RKEY_USERS_IN_GROUP_PACKED.format(RedisKeys._tag(group_id))
 
     @staticmethod
     def unread_in_group(group_id: str) -> str:
-        return RedisKeys.RKEY_UNREAD_IN_GROUP.format(group_id)
+        return RedisKeys.RKEY_UNREAD_IN_GROUP.format(RedisKeys._tag(group_id))
 
     @staticmethod
     def auth_key(user_id: str) -> str:
@@ -235,6 +337,11 @@ class ConfigKeys:
     KEY_SPACE = "key_space"
     CACHE_SERVICE = "cache"
     PUBLISHER = "publisher"
+    STREAM = "stream"
+    GROUP = "group"
+    BLOCK = "block"
+    CONCURRENCY = "concurrency"
+    MAX_RETRIES = "max_retries"
     STATS_SERVICE = "stats"
     KAFKA = "kafka"
     TOPIC = "topic"
@@ -258,10 +365,24 @@ class ConfigKeys:
     TRACE_SAMPLE_RATE = "trace_sample_rate"
     POOL_SIZE = "pool_size"
     MAX_CLIENT_IDS = "max_client_ids"
+    MAX_CONNECTIONS = "max_connections"
+    HEALTH_CHECK_INTERVAL = "health_check_interval"
+    SOCKET_KEEPALIVE = "socket_keepalive"
+    L1_MAX_SIZE = "l1_max_size"
+    CLUSTER = "cluster"
+    HASH_TAGS = "hash_tags"
+    LEGACY_KEYS = "legacy_keys"
+    PACKED_USERS_THRESHOLD = "packed_users_threshold"
+    WARMUP_GROUPS = "warmup_groups"
+    WARMUP_USERS = "warmup_users"
+    WARMUP_BUDGET = "warmup_budget"
+    METRICS_INTERVAL = "metrics_interval"
     HISTORY = "history"
 
     ROOM_MAX_HISTORY_DAYS = "room_max_history_days"
     ROOM_MAX_HISTORY_COUNT = "room_max_history_count"
+    ROOM_MESSAGE_TTL = "room_message_ttl"
+    ROOM_MESSAGE_TWCS = "room_message_twcs"
 
     # can be used to override the environment name used in `_environment`
     ENVIRONMENT_OVERRIDE = "environment_override"
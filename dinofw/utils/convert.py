@@ -4,7 +4,7 @@ from typing import List
 from typing import Union
 
 from dinofw.db.rdbms.schemas import GroupBase, DeletedStatsBase
-from dinofw.db.rdbms.schemas import UserGroupBase
+from dinofw.db.rdbms.schemas import UserGroupRecord
 from dinofw.db.rdbms.schemas import UserGroupStatsBase
 from dinofw.db.storage.schemas import MessageBase
 from dinofw.rest.models import Group, LastReads, LastRead, DeletedStats, UnDeletedGroup
@@ -110,7 +110,8 @@ def group_base_to_user_group(
 ) -> UserGroup:
     group = group_base_to_group(group_base, users, user_count)
 
-    stats_dict = stats_base.__dict__
+    # works for both UserGroupStatsBase and UserGroupStatsRecord
+    stats_dict = stats_base.dict()
     stats_dict["unread"] = unread
     stats_dict["receiver_unread"] = receiver_unread
     stats_dict["receiver_highlight_time"] = to_ts(stats_base.receiver_highlight_time)
@@ -207,7 +208,7 @@ def to_deleted_stats(deleted_stats: List[DeletedStatsBase]) -> List[DeletedStats
 
 
 def to_user_group(
-        user_groups: Optional[List[UserGroupBase]],
+        user_groups: Optional[List[UserGroupRecord]],
         deleted_groups: Optional[List[DeletedStatsBase]] = None
 ):
     groups: List[UserGroup] = list()
@@ -233,6 +234,115 @@ def to_user_group(
     return groups
 
 
+# The *_to_dict() functions below produce the same output as serializing the
+# corresponding api models, but without validating a pydantic model for each
+# item; used by endpoints that return raw json bytes instead of response models.
+
+
+def message_base_to_dict(message: MessageBase) -> dict:
+    return {
+        "group_id": message.group_id,
+        "created_at": to_ts(message.created_at, allow_none=True),
+        "user_id": message.user_id,
+        "message_id": message.message_id,
+        "message_type": message.message_type,
+        "message_payload": message.message_payload,
+        "context": message.context,
+        "updated_at": to_ts(message.updated_at, allow_none=True),
+    }
+
+
+def group_base_to_dict(group: GroupBase, users: Dict[int, float], user_count: int) -> dict:
+    join_times = [
+        {"user_id": user_id, "join_time": float(join_time)}
+        for user_id, join_time in users.items()
+    ]
+    join_times.sort(key=lambda user: user["join_time"], reverse=True)
+
+    return {
+        "group_id": group.group_id,
+        "users": join_times,
+        "user_count": user_count,
+        "name": group.name,
+        "description": group.description,
+        "status": group.status,
+        "status_changed_at": to_ts(group.status_changed_at, allow_none=True),
+        "language": group.language,
+        "group_type": group.group_type,
+        "created_at": to_ts(group.created_at),
+        "updated_at": to_ts(group.updated_at, allow_none=True),
+        "owner_id": group.owner_id,
+        "meta": group.meta,
+        "first_message_time": to_ts(group.first_message_time),
+        "last_message_time": to_ts(group.last_message_time),
+        "last_message_overview": group.last_message_overview,
+        "last_message_user_id": group.last_message_user_id,
+        "last_message_type": group.last_message_type,
+        "last_message_id": group.last_message_id,
+        "message_amount": -1,
+    }
+
+
+def user_group_to_dict(user_group: UserGroupRecord) -> dict:
+    stats = user_group.user_stats
+    receiver_stats = user_group.receiver_user_stats
+
+    stats_dict = {
+        "group_id": stats.group_id,
+        "user_id": stats.user_id,
+        "unread": user_group.unread,
+        "receiver_unread": user_group.receiver_unread,
+        "delete_before": to_ts(stats.delete_before),
+        "join_time": to_ts(stats.join_time),
+        "last_read_time": to_ts(stats.last_read),
+        "last_sent_time": to_ts(stats.last_sent),
+        "highlight_time": to_ts(stats.highlight_time, allow_none=True),
+        "last_updated_time": to_ts(stats.last_updated_time),
+        "first_sent": to_ts(stats.first_sent, allow_none=True),
+        "attachment_amount": -1,
+        "hide": stats.hide,
+        "pin": stats.pin,
+        "deleted": stats.deleted,
+        "bookmark": stats.bookmark,
+        "rating": stats.rating,
+        "notifications": stats.notifications,
+        "mentions": stats.mentions,
+        "kicked": stats.kicked,
+        "receiver_highlight_time": to_ts(stats.receiver_highlight_time),
+        "receiver_last_read_time": None,
+        "receiver_delete_before": None,
+        "receiver_hide": None,
+        "receiver_deleted": None,
+    }
+
+    if receiver_stats is not None:
+        stats_dict["receiver_last_read_time"] = to_ts(receiver_stats.last_read)
+        stats_dict["receiver_delete_before"] = to_ts(receiver_stats.delete_before)
+        stats_dict["receiver_hide"] = receiver_stats.hide
+        stats_dict["receiver_deleted"] = receiver_stats.deleted
+
+    return {
+        "group": group_base_to_dict(user_group.group, user_group.user_join_times, user_group.user_count),
+        "stats": stats_dict,
+    }
+
+
+def to_user_group_dicts(
+        user_groups: Optional[List[UserGroupRecord]],
+        deleted_groups: Optional[List[DeletedStatsBase]] = None
+) -> List[dict]:
+    groups: List[dict] = list()
+
+    if user_groups is not None:
+        groups.extend(user_group_to_dict(user_group) for user_group in user_groups)
+
+    # only used by the admin backend, not worth a separate conversion
+    if deleted_groups is not None:
+        groups.extend(deleted_group_base_to_user_group(deleted_group).dict() for deleted_group in deleted_groups)
+
+    return groups
+
+
 def stats_to_event_dict(user_stats: UserGroupStatsBase):
     stats_dict = user_stats.dict()
 
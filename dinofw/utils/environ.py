@@ -217,6 +217,27 @@ def _get_pub_host_port_db(gn_env: GNEnvironment) -> (str, int, int):
     return pub_host, pub_port, pub_db
 
 
+def init_job_queue(gn_env: GNEnvironment) -> None:
+    gn_env.job_queue = None
+
+    if len(gn_env.config) == 0 or gn_env.config.get(ConfigKeys.TESTING, False):
+        # assume we're testing
+        return
+
+    pub_host = gn_env.config.get(ConfigKeys.HOST, domain=ConfigKeys.PUBLISHER, default=None)
+    if pub_host is None or not len(pub_host.strip()) or pub_host.startswith("$"):
+        logger.warning("no publisher host configured, heavy apis will run as background tasks instead of jobs")
+        return
+
+    from dinofw.jobs.queue import JobQueue
+
+    pub_host, pub_port, pub_db = _get_pub_host_port_db(gn_env)
+    if isinstance(pub_db, str) and pub_db.startswith("$"):
+        pub_db = 0
+
+    gn_env.job_queue = JobQueue(gn_env, host=pub_host, port=pub_port, db=pub_db)
+
+
 def init_producer(gn_env: GNEnvironment) -> None:
     from dinofw.endpoint.mqtt import MqttPublishHandler
     from dinofw.endpoint.kafka import KafkaPublishHandler
@@ -237,11 +258,12 @@ async def initialize_env(dino_env):
     await init_database(dino_env)
     init_cassandra(dino_env)
     init_cache_service(dino_env)
+    init_stats_service(dino_env)
 
     if not is_deleter_service:
-        init_stats_service(dino_env)
         init_rest(dino_env)
         init_producer(dino_env)
+        init_job_queue(dino_env)
 
 
 ENV_KEY_ENVIRONMENT = "DINO_ENVIRONMENT"
@@ -250,6 +272,18 @@ gn_environment = os.getenv(ENV_KEY_ENVIRONMENT)
 env = create_env(gn_environment)
 
 
+def start_cache_warm_up(gn_env: GNEnvironment) -> None:
+    from dinofw.cache.warmup import CacheWarmUp
+
+    # only started by the rest api; the worker, cron and restore don't serve any reads
+    if gn_env.cache.testing:
+        return
+
+    # runs in the background; the readiness api reports when it's done
+    gn_env.warmup = CacheWarmUp(gn_env)
+    gn_env.warmup.start()
+
+
 async def startup():
     if not env.config.get(ConfigKeys.TESTING, False) and os.getenv(ConfigKeys.TESTING, "0") != "1":
         await initialize_env(env)
@@ -76,3 +76,25 @@ def timeit(_logger, method: str, tag: str = None, threshold_ms: int = 100, only_
 
         return decorator
     return factory
+
+
+def report_timing(tag: str, the_time_ms: float) -> None:
+    """
+    send a timing to the stats collector, if one is configured; the deleter and
+    the unit tests run without one, in which case this is a no-op
+    """
+    stats = getattr(environ.env, "stats", None)
+    if stats is not None:
+        stats.timing(tag, the_time_ms)
+
+
+def report_gauge(tag: str, value: int) -> None:
+    stats = getattr(environ.env, "stats", None)
+    if stats is not None:
+        stats.gauge(tag, value)
+
+
+def report_incr(tag: str) -> None:
+    stats = getattr(environ.env, "stats", None)
+    if stats is not None:
+        stats.incr(tag)
@@ -0,0 +1,185 @@
+import asyncio
+import os
+import socket
+import sys
+import time
+from typing import Optional
+
+from fastapi import FastAPI
+from loguru import logger
+
+from dinofw.jobs.handlers import execute_job
+from dinofw.jobs.queue import Job
+from dinofw.jobs.queue import JobQueue
+from dinofw.utils import environ
+from dinofw.utils.perf import report_timing
+
+
+class JobWorker:
+    def __init__(self, env, queue: Optional[JobQueue] = None):
+        self.env = env
+        self.queue = queue
+        # needs to be stable across restarts to pick up our own unacknowledged jobs
+        # again; set DINO_WORKER_ID if running more than one worker per host
+        self.consumer = os.getenv("DINO_WORKER_ID", socket.gethostname())
+        self.running = False
+        self.tasks = set()
+        self.last_claim = 0.0
+
+        logger.info("initializing JobWorker...")
+
+    def _incr(self, key: str) -> None:
+        stats = getattr(self.env, "stats", None)
+        if stats is not None:
+            stats.incr(key)
+
+    async def setup(self) -> None:
+        if self.queue is None:
+            self.queue = self.env.job_queue
+
+        await self.queue.create_group()
+
+    async def run(self) -> None:
+        await self.setup()
+        self.running = True
+
+        # first finish what this consumer was given before a restart, then any
+        # jobs left behind by other workers that died while processing them
+        await self.process_batch(pending=True)
+        await self.process_stale()
+
+        logger.info(f"consuming jobs from stream '{self.queue.stream}' as '{self.consumer}'...")
+        while self.running:
+            try:
+                await self.process_batch()
+                await self.process_stale_if_due()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"could not read jobs: {str(e)}")
+                logger.exception(e)
+                self.env.capture_exception(sys.exc_info())
+                await asyncio.sleep(1)
+
+        await self.drain()
+
+    async def stop(self) -> None:
+        self.running = False
+        await self.drain()
+
+    async def drain(self) -> None:
+        if len(self.tasks):
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def free_slots(self) -> int:
+        # only take as many jobs as we can run, the rest stays in the stream for other workers
+        if len(self.tasks) >= self.queue.concurrency:
+            await asyncio.wait(self.tasks, return_when=asyncio.FIRST_COMPLETED)
+
+        return self.queue.concurrency - len(self.tasks)
+
+    async def process_batch(self, pending: bool = False) -> int:
+        free_slots = await self.free_slots()
+
+        if pending:
+            jobs = await self.queue.read_pending(self.consumer, count=free_slots)
+        else:
+            jobs = await self.queue.read(self.consumer, count=free_slots)
+
+        self._schedule(jobs)
+        return len(jobs)
+
+    async def process_stale_if_due(self) -> int:
+        """
+        workers get a new consumer name when replaced, so jobs left by a dead worker are only
+        picked up by claiming them, which is checked twice per claim idle time
+        """
+        if time.monotonic() - self.last_claim < self.queue.claim_idle_ms / 2 / 1000:
+            return 0
+
+        return await self.process_stale()
+
+    async def process_stale(self) -> int:
+        self.last_claim = time.monotonic()
+        jobs = await self.queue.claim_stale(self.consumer, count=await self.free_slots())
+        if len(jobs):
+            logger.info(f"claimed {len(jobs)} stale jobs from other workers")
+
+        self._schedule(jobs)
+        return len(jobs)
+
+    def _schedule(self, jobs) -> None:
+        for job in jobs:
+            task = asyncio.create_task(self.handle(job))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def handle(self, job: Job) -> bool:
+        before = time.time()
+        tag = f"jobs.{job.job_type}"
+
+        try:
+            async with self.env.SessionLocal() as session:
+                await execute_job(job.job_type, job.args, session)
+        except Exception as e:
+            logger.error(f"job {job.job_type} ({job.job_id}) failed on attempt {job.attempt + 1}: {str(e)}")
+            logger.exception(e)
+            self.env.capture_exception(sys.exc_info())
+
+            if job.attempt + 1 < self.queue.max_retries:
+                self._incr(f"{tag}.retried")
+                await self.queue.retry(job)
+            else:
+                self._incr(f"{tag}.dead")
+                await self.queue.dead_letter(job, str(e))
+
+            # the original entry was acked when re-queued
+            return False
+
+        the_time = (time.time() - before) * 1000
+        report_timing(tag, the_time)
+        report_timing(f"{tag}.lag", (time.time() - job.created_at) * 1000)
+        self._incr(f"{tag}.done")
+
+        await self.queue.ack(job)
+        logger.info(f"job {job.job_type} ({job.job_id}) done in {the_time:.2f}ms")
+        return True
+
+
+worker = JobWorker(environ.env)
+app = FastAPI()
+worker_task: Optional[asyncio.Task] = None
+
+
+@app.get("/v1/health")
+async def health():
+    """
+    Used by the orchestrator to check that the worker is still consuming jobs.
+    """
+    return {
+        "running": worker.running,
+        "active_jobs": len(worker.tasks),
+    }
+
+
+@app.on_event("startup")
+async def startup():
+    global worker_task
+
+    await environ.startup()
+
+    if getattr(environ.env, "job_queue", None) is None:
+        logger.error("no job queue configured (publisher.host), worker will not consume any jobs")
+        return
+
+    environ.env.cache.start_invalidation_listener()
+    worker_task = asyncio.create_task(worker.run())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await worker.stop()
+    await environ.env.cache.stop_invalidation_listener()
+
+    if worker_task is not None:
+        worker_task.cancel()
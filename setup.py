@@ -24,7 +24,7 @@ setup(
         'bcrypt',
         'black',
         'cassandra-driver',
-        'fakeredis',
+        'fakeredis[lua]',
         'fastapi',
         'gitdb',
         'gmqtt',
@@ -0,0 +1,45 @@
+"""
+compare converting an inbox page of db rows to api models, using the pydantic
+*Base models vs. the slotted *Record dataclasses between the db and rest layers,
+and converting the records directly to dicts for the raw json responses:
+
+    python -m test.benchmark_inbox [n_rows] [n_runs]
+"""
+import sys
+from timeit import timeit
+
+from dinofw.utils.convert import to_user_group
+from dinofw.utils.convert import to_user_group_dicts
+from test.mocks import fake_inbox_rows
+from test.mocks import inbox_rows_to_base_models
+from test.mocks import inbox_rows_to_records
+
+
+def with_base_models(rows):
+    return to_user_group(inbox_rows_to_base_models(rows))
+
+
+def with_records(rows):
+    return to_user_group(inbox_rows_to_records(rows))
+
+
+def with_records_as_dicts(rows):
+    return to_user_group_dicts(inbox_rows_to_records(rows))
+
+
+def main():
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    n_runs = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    rows = fake_inbox_rows(n_rows)
+
+    for name, func in [
+        ("pydantic *Base", with_base_models),
+        ("slotted *Record", with_records),
+        ("*Record to dicts", with_records_as_dicts),
+    ]:
+        elapsed = timeit(lambda: func(rows), number=n_runs) / n_runs
+        print(f"{name:>16}: {elapsed * 1000:.2f}ms per page of {n_rows} rows")
+
+
+if __name__ == "__main__":
+    main()
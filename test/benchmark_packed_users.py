@@ -0,0 +1,45 @@
+"""
+compare the size and the time to parse the users of a big group, as returned by HGETALL on
+the hash vs. GET on the packed value; no redis server is needed, only the parsing is timed:
+
+    python -m test.benchmark_packed_users [n_users] [n_runs]
+"""
+import random
+import sys
+from timeit import timeit
+
+from dinofw.cache.redis import _pack_users
+from dinofw.cache.redis import _unpack_users
+
+
+def main():
+    n_users = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    n_runs = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    user_ids = random.sample(range(1_000_000, 9_000_000), n_users)
+    users = {user_id: 1700000000 + random.random() * 10_000_000 for user_id in user_ids}
+
+    # as decoded by the client from HGETALL
+    hashed = {str(user_id): str(join_time) for user_id, join_time in users.items()}
+    packed = _pack_users(users)
+
+    # each field and value in a RESP reply has a "$<length>\r\n" prefix and a "\r\n" suffix
+    hash_size = sum(len(k) + len(v) + 2 * (len(str(len(k))) + 5) for k, v in hashed.items())
+
+    def parse_hash():
+        return {int(user_id): float(join_time) for user_id, join_time in hashed.items()}
+
+    def parse_packed():
+        return _unpack_users(packed)
+
+    assert parse_hash() == parse_packed()
+
+    print(f"{n_users} users, hash: {hash_size / 1024:.0f}KB, packed: {len(packed) / 1024:.0f}KB")
+
+    for name, func in [("hash", parse_hash), ("packed", parse_packed)]:
+        elapsed = timeit(func, number=n_runs) / n_runs
+        print(f"{name:>6}: {elapsed * 1000:.2f}ms to parse")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+compare the overhead of creating a new redis client on every access of `CacheRedis.redis`
+(as was done before) vs. reusing one client per event loop; no redis server is needed,
+since only the client objects are created and no commands are sent:
+
+    python -m test.benchmark_redis_client [n_accesses] [n_runs]
+"""
+import asyncio
+import sys
+from timeit import timeit
+
+import redis
+
+from dinofw.cache.redis import CacheRedis
+from test.mocks import FakeCacheEnv
+
+
+def main():
+    # roughly the number of `self.redis` accesses when sending a message to a group with a few users
+    n_accesses = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    n_runs = int(sys.argv[2]) if len(sys.argv) > 2 else 10_000
+
+    cache = CacheRedis(FakeCacheEnv(), host="localhost")
+    pool = redis.asyncio.ConnectionPool(**cache.redis_pool_kwargs)
+
+    def new_client_per_access():
+        for _ in range(n_accesses):
+            redis.asyncio.Redis(connection_pool=pool, decode_responses=True)
+
+    def client_per_loop():
+        for _ in range(n_accesses):
+            _ = cache.redis
+
+    async def run():
+        for name, func in [("client per access", new_client_per_access), ("client per loop", client_per_loop)]:
+            elapsed = timeit(func, number=n_runs) / n_runs
+            print(f"{name:>17}: {elapsed * 1_000_000:.1f}µs per {n_accesses} accesses")
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
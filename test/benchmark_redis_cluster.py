@@ -0,0 +1,66 @@
+"""
+latency of the cache updates done in one pipeline when sending a message to a group, on a
+single node vs. a cluster (hash tagged keys); needs a running redis, or a node of a cluster:
+
+    python -m test.benchmark_redis_cluster <host:port> [single|cluster] [n_receivers] [n_runs]
+"""
+import asyncio
+import sys
+import time
+from uuid import uuid4 as uuid
+
+from dinofw.cache.redis import CacheRedis
+from test.mocks import FakeCacheEnv
+
+
+def percentile(values, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    host, port = sys.argv[1].split(":")
+    mode = sys.argv[2] if len(sys.argv) > 2 else "single"
+    n_receivers = int(sys.argv[3]) if len(sys.argv) > 3 else 500
+    n_runs = int(sys.argv[4]) if len(sys.argv) > 4 else 200
+
+    cache = CacheRedis(FakeCacheEnv({
+        "cluster": str(mode == "cluster"),
+        "hash_tags": "true",
+    }), host=host, port=int(port))
+
+    async def send_message(group_id: str, receiver_ids, total_unread):
+        async with cache.pipeline() as p:
+            await cache.set_last_message_time_in_group(group_id, time.time(), pipeline=p)
+            await cache.increase_unread_for_new_message(group_id, receiver_ids, total_unread, pipeline=p)
+
+    async def run():
+        group_id = str(uuid())
+        receiver_ids = list(range(1_000_000, 1_000_000 + n_receivers))
+
+        # about half the receivers have their total unread count cached
+        total_unread = {user_id: 1 for user_id in receiver_ids}
+        for user_id in receiver_ids[::2]:
+            await cache.set_total_unread_count(user_id, 0, list())
+
+        # warm up the connections and load the scripts
+        await send_message(group_id, receiver_ids, total_unread)
+
+        elapsed = list()
+        for _ in range(n_runs):
+            before = time.perf_counter()
+            await send_message(group_id, receiver_ids, total_unread)
+            elapsed.append((time.perf_counter() - before) * 1000)
+
+        print(
+            f"{mode}, {n_receivers} receivers: "
+            f"p50 {percentile(elapsed, 0.5):.2f}ms, "
+            f"p99 {percentile(elapsed, 0.99):.2f}ms, "
+            f"max {max(elapsed):.2f}ms"
+        )
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+from unittest.mock import patch
+
+from dinofw.utils import utcnow_ts
+from dinofw.utils.config import GroupTypes
+from test.base import BaseTest
+from test.functional.base_functional import BaseServerRestApi
+
+
+class TestDeletionCandidates(BaseServerRestApi):
+    async def delete_conversation(self, group_id: str, user_id: int) -> None:
+        await self.update_delete_before(group_id, delete_before=utcnow_ts(), user_id=user_id)
+
+    async def test_changing_delete_before_marks_group_as_candidate(self):
+        message = await self.send_1v1_message(receiver_id=BaseTest.OTHER_USER_ID)
+        self.assertEqual(set(), await self.env.cache.take_deletion_candidates())
+
+        await self.delete_conversation(message["group_id"], user_id=BaseTest.USER_ID)
+        self.assertEqual({message["group_id"]}, await self.env.cache.take_deletion_candidates())
+
+    async def test_leaving_marks_group_as_candidate(self):
+        group_id = await self.create_and_join_group(
+            user_id=BaseTest.USER_ID,
+            group_type=GroupTypes.PRIVATE_GROUP
+        )
+        await self.user_joins_group(group_id, user_id=BaseTest.OTHER_USER_ID)
+        self.assertEqual(set(), await self.env.cache.take_deletion_candidates())
+
+        await self.user_leaves_group(group_id, user_id=BaseTest.OTHER_USER_ID)
+        self.assertEqual({group_id}, await self.env.cache.take_deletion_candidates())
+
+    async def test_deleter_only_evaluates_candidates(self):
+        from dinofw.cron import Deleter
+
+        group_a = (await self.send_1v1_message(receiver_id=BaseTest.OTHER_USER_ID))["group_id"]
+        group_b = (await self.send_1v1_message(receiver_id=BaseTest.THIRD_USER_ID))["group_id"]
+
+        # both users deleted group a, only one user deleted group b
+        await self.delete_conversation(group_a, user_id=BaseTest.USER_ID)
+        await self.delete_conversation(group_a, user_id=BaseTest.OTHER_USER_ID)
+        await self.delete_conversation(group_b, user_id=BaseTest.USER_ID)
+
+        deleter = Deleter(self.env)
+        await deleter.run_deletions()
+
+        self.assertEqual({group_a}, set(self.env.storage.deleted_before.keys()))
+
+        # all candidates were evaluated, nothing left for the next run
+        self.assertEqual(set(), await self.env.cache.take_deletion_candidates())
+
+        # nothing new to evaluate
+        self.env.storage.deleted_before.clear()
+        await deleter.run_deletions()
+        self.assertEqual(dict(), self.env.storage.deleted_before)
+
+        # if the candidates are lost, e.g. the cache was flushed, a full sweep still finds the group
+        await self.delete_conversation(group_b, user_id=BaseTest.THIRD_USER_ID)
+        await self.env.cache.take_deletion_candidates()
+        await self.env.cache.remove_deletion_candidates_in_progress()
+
+        await deleter.run_deletions(full_sweep=True)
+        self.assertEqual({group_b}, set(self.env.storage.deleted_before.keys()))
+
+    async def test_failed_group_is_resumed_by_next_run(self):
+        from dinofw.cron import Deleter
+
+        group_a = (await self.send_1v1_message(receiver_id=BaseTest.OTHER_USER_ID))["group_id"]
+        group_b = (await self.send_1v1_message(receiver_id=BaseTest.THIRD_USER_ID))["group_id"]
+
+        for group_id, other_user_id in [(group_a, BaseTest.OTHER_USER_ID), (group_b, BaseTest.THIRD_USER_ID)]:
+            await self.delete_conversation(group_id, user_id=BaseTest.USER_ID)
+            await self.delete_conversation(group_id, user_id=other_user_id)
+
+        delete_messages = self.env.storage.delete_messages_in_group_before
+
+        async def fail_for_group_b(group_id, before):
+            if group_id == group_b:
+                raise RuntimeError("cassandra timed out")
+            await delete_messages(group_id, before)
+
+        deleter = Deleter(self.env)
+        with patch.object(self.env.storage, "delete_messages_in_group_before", fail_for_group_b):
+            await deleter.run_deletions()
+
+        self.assertEqual({group_a}, set(self.env.storage.deleted_before.keys()))
+
+        # only the failed group is left, and is picked up by the next run
+        self.env.storage.deleted_before.clear()
+        await deleter.run_deletions()
+
+        self.assertEqual({group_b}, set(self.env.storage.deleted_before.keys()))
+        self.assertEqual(set(), await self.env.cache.take_deletion_candidates())
+
+    async def test_rooms_are_skipped_when_messages_expire_by_ttl(self):
+        from dinofw.cron import Deleter
+
+        room_id = await self.create_and_join_group(
+            user_id=BaseTest.USER_ID,
+            group_type=GroupTypes.PUBLIC_ROOM
+        )
+        group_id = (await self.send_1v1_message(receiver_id=BaseTest.OTHER_USER_ID))["group_id"]
+
+        self.env.storage.room_message_ttl = 30 * 24 * 60 * 60
+        await self.send_message_to_group_from(room_id, user_id=BaseTest.USER_ID)
+        await self.send_1v1_message(receiver_id=BaseTest.OTHER_USER_ID)
+
+        # only messages in rooms are written with a ttl
+        room_message = self.env.storage.messages_by_group[room_id][-1]
+        group_message = self.env.storage.messages_by_group[group_id][-1]
+        self.assertEqual(30 * 24 * 60 * 60, self.env.storage.ttl_by_message[room_message.message_id])
+        self.assertIsNone(self.env.storage.ttl_by_message[group_message.message_id])
+
+        await self.delete_conversation(room_id, user_id=BaseTest.USER_ID)
+        for user_id in [BaseTest.USER_ID, BaseTest.OTHER_USER_ID]:
+            await self.delete_conversation(group_id, user_id=user_id)
+
+        deleter = Deleter(self.env)
+        await deleter.run_deletions()
+
+        self.assertEqual({group_id}, set(self.env.storage.deleted_before.keys()))
+        self.assertEqual(set(), await self.env.cache.take_deletion_candidates())
+
+        # a full sweep still cleans up rooms, for messages written before ttl was enabled
+        self.env.storage.deleted_before.clear()
+        await deleter.run_deletions(full_sweep=True)
+
+        self.assertIn(room_id, self.env.storage.deleted_before)
+
+    async def test_plan_counts_without_deleting(self):
+        from dinofw.cron import Deleter
+
+        for _ in range(3):
+            group_id = (await self.send_1v1_message(receiver_id=BaseTest.OTHER_USER_ID))["group_id"]
+        for user_id in [BaseTest.USER_ID, BaseTest.OTHER_USER_ID]:
+            await self.delete_conversation(group_id, user_id=user_id)
+
+        deleter = Deleter(self.env)
+        plan = await deleter.plan_deletions()
+
+        self.assertEqual([group_id], [group.group_id for group in plan.groups])
+        self.assertEqual(3, plan.message_count)
+        self.assertEqual(2, plan.tombstones)
+
+        # nothing was deleted, and the candidates are still there for the real run
+        self.assertEqual(dict(), self.env.storage.deleted_before)
+
+        summary = await deleter.run_deletions()
+
+        self.assertEqual({group_id}, set(self.env.storage.deleted_before.keys()))
+        self.assertEqual(1, summary.candidates)
+        self.assertEqual(1, summary.groups)
+        self.assertEqual(0, summary.failed)
@@ -789,6 +789,23 @@ class TestServerRestApi(BaseServerRestApi):
         stats = (await self.groups_for_user(count_unread=True))[0]["stats"]
         self.assertEqual(0, stats["unread"])
 
+    async def test_mark_all_groups_as_read_resets_count_in_all_groups(self):
+        for sender_id in range(BaseTest.OTHER_USER_ID, BaseTest.OTHER_USER_ID + 3):
+            await self.send_1v1_message(user_id=sender_id, receiver_id=BaseTest.USER_ID)
+
+        for group in await self.groups_for_user(count_unread=True):
+            self.assertEqual(1, group["stats"]["unread"])
+
+        await self.mark_as_read()
+
+        for group in await self.groups_for_user(count_unread=True):
+            self.assertEqual(0, group["stats"]["unread"])
+
+        # each sender should have gotten a read receipt for their own 1v1 group only
+        for sender_id in range(BaseTest.OTHER_USER_ID, BaseTest.OTHER_USER_ID + 3):
+            self.assertEqual(1, len(self.env.client_publisher.sent_reads[sender_id]))
+            self.assertEqual(BaseTest.USER_ID, self.env.client_publisher.sent_reads[sender_id][0][1])
+
     async def test_groups_for_user_only_unread_includes_bookmarks(self):
         group_message = await self.send_1v1_message()
         groups = await self.groups_for_user(only_unread=True)
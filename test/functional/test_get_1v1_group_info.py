@@ -49,3 +49,22 @@ class TestReceiverStats(BaseServerRestApi):
                 self.assertEqual(-1, stat["attachment_amount"])
 
         self.assertEqual(2, info["group"]["message_amount"])
+
+    async def test_users_in_1v1_info(self):
+        await self.send_1v1_message()
+
+        for only_group_info, n_stats in [(False, 2), (True, 0)]:
+            raw_response = await self.client.post(
+                f"/v1/users/{BaseTest.USER_ID}/group",
+                json={"receiver_id": BaseTest.OTHER_USER_ID, "only_group_info": only_group_info},
+            )
+            self.assertEqual(raw_response.status_code, 200)
+            info = raw_response.json()
+
+            self.assertEqual(n_stats, len(info["stats"]))
+            self.assertEqual(2, info["group"]["user_count"])
+            self.assertEqual(
+                {BaseTest.USER_ID, BaseTest.OTHER_USER_ID},
+                {user["user_id"] for user in info["group"]["users"]}
+            )
+            self.assertEqual(1, info["group"]["message_amount"])
@@ -0,0 +1,100 @@
+from dinofw.jobs.queue import JobQueue
+from dinofw.utils.config import JobTypes
+from dinofw.worker import JobWorker
+from test.base import BaseTest
+from test.functional.base_functional import BaseServerRestApi
+
+
+class TestJobQueue(BaseServerRestApi):
+    async def asyncSetUp(self) -> None:
+        await super().asyncSetUp()
+
+        self.env.job_queue = JobQueue(self.env, host="mock")
+        await self.env.job_queue.redis.delete(
+            self.env.job_queue.stream, self.env.job_queue.dead_letter_stream
+        )
+
+        self.worker = JobWorker(self.env)
+        await self.worker.setup()
+
+    async def run_worker_once(self) -> int:
+        n_jobs = await self.worker.process_batch()
+        await self.worker.drain()
+        return n_jobs
+
+    async def test_mark_as_read_is_queued_and_run_by_worker(self):
+        await self.send_1v1_message(user_id=BaseTest.OTHER_USER_ID, receiver_id=BaseTest.USER_ID)
+        await self.mark_as_read()
+
+        # only queued, not yet run
+        stats = (await self.groups_for_user(count_unread=True))[0]["stats"]
+        self.assertEqual(1, stats["unread"])
+        self.assertEqual(1, await self.env.job_queue.redis.xlen(self.env.job_queue.stream))
+
+        self.assertEqual(1, await self.run_worker_once())
+
+        stats = (await self.groups_for_user(count_unread=True))[0]["stats"]
+        self.assertEqual(0, stats["unread"])
+
+        # acknowledged jobs are removed from the stream
+        self.assertEqual(0, await self.env.job_queue.redis.xlen(self.env.job_queue.stream))
+
+    async def test_create_action_logs_query_survives_serialization(self):
+        message = await self.send_1v1_message(user_id=BaseTest.USER_ID, receiver_id=BaseTest.OTHER_USER_ID)
+
+        raw_response = await self.client.post(
+            f"/v1/users/{BaseTest.USER_ID}/groups/actions", json={
+                "payload": "nickname changed",
+                "unhide_group": False,
+            },
+        )
+        self.assertEqual(raw_response.status_code, 201)
+
+        self.assertEqual(1, await self.run_worker_once())
+
+        histories = await self.histories_for(message["group_id"])
+        self.assertIn("nickname changed", [m["message_payload"] for m in histories["messages"]])
+
+    async def test_failing_job_is_retried_then_dead_lettered(self):
+        queue = self.env.job_queue
+        await queue.enqueue("no_such_job", {"user_id": BaseTest.USER_ID})
+
+        for _ in range(queue.max_retries):
+            self.assertEqual(1, await self.run_worker_once())
+
+        self.assertEqual(0, await queue.redis.xlen(queue.stream))
+        self.assertEqual(1, await queue.redis.xlen(queue.dead_letter_stream))
+
+        _, fields = (await queue.redis.xrange(queue.dead_letter_stream))[0]
+        self.assertEqual("no_such_job", fields["type"])
+        self.assertEqual(str(queue.max_retries - 1), fields["attempt"])
+
+    async def test_unacked_jobs_are_picked_up_again_after_restart(self):
+        queue = self.env.job_queue
+        await queue.enqueue(JobTypes.MARK_ALL_AS_READ, {"user_id": BaseTest.USER_ID})
+
+        # delivered but never acknowledged, e.g. the worker was killed
+        jobs = await queue.read(self.worker.consumer, count=1)
+        self.assertEqual(1, len(jobs))
+        self.assertEqual(0, len(await queue.read(self.worker.consumer, count=1)))
+
+        self.assertEqual(1, await self.worker.process_batch(pending=True))
+        await self.worker.drain()
+
+        self.assertEqual(0, await queue.redis.xlen(queue.stream))
+
+    async def test_stale_jobs_of_dead_workers_are_claimed_while_running(self):
+        queue = self.env.job_queue
+        queue.claim_idle_ms = 0
+        await queue.enqueue(JobTypes.MARK_ALL_AS_READ, {"user_id": BaseTest.USER_ID})
+
+        # delivered to a worker that was replaced, and got a new consumer name
+        self.assertEqual(1, len(await queue.read("dead-worker", count=1)))
+
+        self.assertEqual(1, await self.worker.process_stale_if_due())
+        await self.worker.drain()
+        self.assertEqual(0, await queue.redis.xlen(queue.stream))
+
+        # not checked again until half the claim idle time has passed
+        queue.claim_idle_ms = 60_000
+        self.assertEqual(0, await self.worker.process_stale_if_due())
@@ -84,3 +84,36 @@ class TestLeaveGroup(BaseServerRestApi):
 
         await self.assert_deleted_groups_for_user(1)
         await self.assert_groups_for_user(0)
+
+    async def test_leave_all_groups_creates_deleted_copies_and_action_logs(self):
+        group_ids = [
+            await self.create_and_join_group(
+                user_id=BaseTest.USER_ID,
+                users=[
+                    BaseTest.OTHER_USER_ID,
+                    BaseTest.THIRD_USER_ID
+                ]
+            )
+            for _ in range(3)
+        ]
+        one_to_one = await self.send_1v1_message()
+
+        await self.assert_deleted_groups_for_user(0)
+        await self.assert_groups_for_user(4)
+
+        await self.leave_all_groups()
+
+        await self.assert_deleted_groups_for_user(4)
+        await self.assert_groups_for_user(0)
+
+        # action logs are only created in the non-1v1 groups
+        self.assertNotIn(one_to_one["group_id"], self.env.storage.action_log)
+
+        for group_id in group_ids:
+            self.assertEqual(1, len(self.env.storage.action_log[group_id]))
+            log = self.env.storage.action_log[group_id][0]
+
+            # the remaining users should see the action log as the last message
+            group_info = await self.get_group_info(group_id, count_messages=False)
+            self.assertEqual(log.message_id, group_info["last_message_id"])
+            self.assertNotIn(BaseTest.USER_ID, {u["user_id"] for u in group_info["users"]})
@@ -40,3 +40,29 @@ class TestNicknameChange(BaseServerRestApi):
         # should still be deleted for the third user
         await self.assert_groups_for_user(0, user_id=BaseTest.THIRD_USER_ID)
         await self.assert_groups_for_user(1, user_id=BaseTest.OTHER_USER_ID)
+
+    async def test_nickname_change_resumes_without_duplicating_action_logs(self):
+        import hashlib
+
+        group_ids = [
+            await self.create_and_join_group(
+                user_id=BaseTest.USER_ID,
+                users=[BaseTest.OTHER_USER_ID]
+            )
+            for _ in range(3)
+        ]
+
+        # pretend a previous run died after finishing the first group
+        payload_hash = hashlib.sha1("some action log payload".encode("utf-8")).hexdigest()
+        await self.env.cache.add_action_log_groups_done(BaseTest.USER_ID, payload_hash, group_ids[:1])
+
+        await self.create_action_log_in_all_groups_for_user(user_id=BaseTest.USER_ID)
+        await asyncio.sleep(0.02)  # wait for the action log to be processed
+
+        self.assertNotIn(group_ids[0], self.env.storage.action_log)
+        for group_id in group_ids[1:]:
+            self.assertEqual(1, len(self.env.storage.action_log[group_id]))
+
+        # progress is removed when all groups are done
+        groups_done = await self.env.cache.get_action_log_groups_done(BaseTest.USER_ID, payload_hash)
+        self.assertEqual(0, len(groups_done))
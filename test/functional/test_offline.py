@@ -46,6 +46,98 @@ class TestOfflineUsers(BaseServerRestApi):
         await self.assert_user_in_group(group_id, user_id=BaseTest.USER_ID)
         await self.assert_user_in_group(group_id, user_id=BaseTest.OTHER_USER_ID)
 
+    @BaseServerRestApi.init_db_session
+    async def test_offline_users_removed_from_public_groups_in_bulk(self):
+        room_id = await self.create_and_join_group(
+            user_id=BaseTest.USER_ID,
+            group_type=GroupTypes.PUBLIC_ROOM
+        )
+        group_id = await self.create_and_join_group(
+            user_id=BaseTest.USER_ID,
+            group_type=GroupTypes.PRIVATE_GROUP
+        )
+        for user_id in [BaseTest.OTHER_USER_ID, BaseTest.THIRD_USER_ID]:
+            await self.user_joins_group(room_id, user_id=user_id)
+            await self.user_joins_group(group_id, user_id=user_id)
+
+        room = await self.get_group_info(room_id, count_messages=False)
+        self.assertEqual(BaseTest.USER_ID, room["owner_id"])
+
+        n_removed = await self.env.db.remove_user_stats_for_offline_users(
+            user_ids=[BaseTest.USER_ID, BaseTest.OTHER_USER_ID],
+            db=self.env.db_session
+        )
+        self.assertEqual(2, n_removed)
+
+        await self.assert_user_not_in_group(room_id, user_id=BaseTest.USER_ID)
+        await self.assert_user_not_in_group(room_id, user_id=BaseTest.OTHER_USER_ID)
+        await self.assert_user_in_group(room_id, user_id=BaseTest.THIRD_USER_ID)
+
+        # private groups are not affected
+        for user_id in [BaseTest.USER_ID, BaseTest.OTHER_USER_ID, BaseTest.THIRD_USER_ID]:
+            await self.assert_user_in_group(group_id, user_id=user_id)
+
+        # the owner left the room
+        room = await self.get_group_info(room_id, count_messages=False)
+        self.assertIsNone(room["owner_id"])
+
+        for user_id in [BaseTest.USER_ID, BaseTest.OTHER_USER_ID]:
+            deleted = await self.env.db.get_deleted_groups_for_user(user_id, self.env.db_session)
+            self.assertEqual([room_id], [stats.group_id for stats in deleted])
+
+    async def test_session_batch_only_sends_offline_for_users_that_were_online(self):
+        await self.update_session(BaseTest.USER_ID, is_online=True)
+        await self.update_session(BaseTest.OTHER_USER_ID, is_online=True)
+
+        # the ttl is checked to find users stuck in public groups, no such users here
+        await self.update_sessions({
+            BaseTest.USER_ID: True,
+            BaseTest.OTHER_USER_ID: False,
+            BaseTest.THIRD_USER_ID: False,
+        })
+
+        self.assertEqual([BaseTest.OTHER_USER_ID], self.env.server_publisher.sent_offline)
+        self.assertEqual({BaseTest.USER_ID}, await self.env.cache.get_online_users())
+
+    async def test_session_batch_finds_users_stuck_in_public_groups(self):
+        group_id = await self.create_and_join_group(
+            user_id=BaseTest.USER_ID,
+            group_type=GroupTypes.PUBLIC_ROOM
+        )
+        await self.user_joins_group(group_id, user_id=BaseTest.OTHER_USER_ID)
+
+        # never reported as online, but still in the public room
+        await self.update_sessions({BaseTest.OTHER_USER_ID: True})
+        self.assertEqual([BaseTest.USER_ID], self.env.server_publisher.sent_offline)
+
+        # not checked again until the ttl expires
+        await self.update_sessions({BaseTest.OTHER_USER_ID: True})
+        self.assertEqual([BaseTest.USER_ID], self.env.server_publisher.sent_offline)
+
+    async def update_session(self, user_id: int, is_online: bool):
+        raw_response = await self.client.put(
+            "/v1/mqtt/session", json={"users": [self.session_user(user_id, is_online)]},
+        )
+        self.assertEqual(raw_response.status_code, 200)
+
+    async def update_sessions(self, users: dict):
+        raw_response = await self.client.put(
+            "/v1/mqtt/sessions", json={"users": [
+                self.session_user(user_id, is_online) for user_id, is_online in users.items()
+            ]},
+        )
+        self.assertEqual(raw_response.status_code, 200)
+
+    @staticmethod
+    def session_user(user_id: int, is_online: bool) -> dict:
+        return {
+            "client_id": f"client-{user_id}",
+            "is_online": is_online,
+            "topic": "test",
+            "community": "test",
+            "user_id": user_id,
+        }
+
     async def assert_user_in_group(self, group_id: str, user_id: int):
         await self._assert_user_in_group(group_id, user_id, should_exist=True)
 
@@ -746,3 +746,95 @@ class TestUnreadCount(BaseServerRestApi):
         cached_unread_count, cached_unread_groups = await self.env.cache.get_total_unread_count(BaseTest.USER_ID)
         self.assertEqual(1, cached_unread_count)
         self.assertEqual(1, cached_unread_groups)
+
+    @BaseServerRestApi.init_db_session
+    async def test_count_total_unread_agrees_with_per_row_computation(self):
+        session = self.env.db_session
+
+        # one group per sender, each ending up in a different unread/bookmark/notifications state
+        group_ids = dict()
+        for sender_offset, n_messages in enumerate([1, 2, 3, 4, 5, 6]):
+            sender_id = BaseTest.OTHER_USER_ID + sender_offset
+            for _ in range(n_messages):
+                message = await self.env.rest.message.send_message_to_user(
+                    sender_id,
+                    SendMessageQuery(
+                        receiver_id=BaseTest.USER_ID,
+                        message_type=MessageTypes.MESSAGE,
+                        message_payload="some message"
+                    ),
+                    session
+                )
+            group_ids[sender_offset] = message.group_id
+
+        # read and then bookmark, so bookmarked without any unread messages
+        await self.env.rest.group.histories(
+            group_ids[1], BaseTest.USER_ID, MessageQuery(per_page=30, since=0), session
+        )
+        await self.env.rest.group.update_user_group_stats(
+            group_ids[1], BaseTest.USER_ID, UpdateUserGroupStats(bookmark=True), session
+        )
+
+        # bookmarked with unread messages
+        await self.env.rest.group.update_user_group_stats(
+            group_ids[2], BaseTest.USER_ID, UpdateUserGroupStats(bookmark=True), session
+        )
+
+        # notifications disabled without any mentions
+        await self.env.rest.group.update_user_group_stats(
+            group_ids[3], BaseTest.USER_ID, UpdateUserGroupStats(notifications=False), session
+        )
+
+        # notifications disabled, but mentioned after disabling them
+        await self.env.rest.group.update_user_group_stats(
+            group_ids[4], BaseTest.USER_ID, UpdateUserGroupStats(notifications=False), session
+        )
+        await self.env.rest.message.send_message_to_user(
+            BaseTest.OTHER_USER_ID + 4,
+            SendMessageQuery(
+                receiver_id=BaseTest.USER_ID,
+                message_type=MessageTypes.MESSAGE,
+                message_payload="some message",
+                mention_user_ids=[BaseTest.USER_ID]
+            ),
+            session
+        )
+
+        # hidden groups shouldn't count at all
+        await self.env.rest.group.update_user_group_stats(
+            group_ids[5], BaseTest.USER_ID, UpdateUserGroupStats(hide=True), session
+        )
+
+        from dinofw.db.rdbms.models import UserGroupStatsEntity
+        all_stats = await session.run_sync(lambda _db:
+            _db.query(UserGroupStatsEntity)
+            .filter(UserGroupStatsEntity.user_id == BaseTest.USER_ID)
+            .all()
+        )
+
+        expected_count = 0
+        expected_group_ids = set()
+
+        for stats in all_stats:
+            if stats.hide or stats.deleted:
+                continue
+
+            if stats.bookmark:
+                expected_count += 1
+            elif stats.notifications:
+                expected_count += stats.unread_count
+            if not stats.notifications:
+                expected_count += stats.mentions
+
+            if stats.bookmark or \
+                    (stats.notifications and stats.unread_count > 0) or \
+                    (not stats.notifications and stats.mentions > 0):
+                expected_group_ids.add(stats.group_id)
+
+        unread_count, unread_groups = await self.env.db.count_total_unread(BaseTest.USER_ID, session)
+        self.assertEqual(expected_count, unread_count)
+        self.assertSetEqual(expected_group_ids, set(unread_groups))
+        self.assertEqual(len(unread_groups), len(set(unread_groups)))
+
+        # bookmarked groups with and without unread, the unread one, and the mentioned one
+        self.assertSetEqual({group_ids[0], group_ids[1], group_ids[2], group_ids[4]}, set(unread_groups))
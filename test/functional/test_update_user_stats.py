@@ -1,5 +1,9 @@
 import time
+from unittest.mock import patch
 
+from dinofw.utils import group_id_to_users
+from dinofw.utils import utcnow_dt
+from dinofw.utils.config import DefaultValues
 from test.base import BaseTest
 from test.functional.base_db import BaseDatabaseTest
 from test.functional.base_functional import BaseServerRestApi
@@ -63,3 +67,45 @@ class TestUpdateUserStats(BaseServerRestApi):
 
         s1 = await self.get_user_stats(group_id=m1["group_id"], user_id=BaseTest.OTHER_USER_ID)
         self.assertEqual(0, s1["stats"]["unread"])
+
+    @BaseServerRestApi.init_db_session
+    async def test_set_last_updated_at_in_batches_includes_other_users(self):
+        messages = [
+            await self.send_1v1_message(receiver_id=receiver_id)
+            for receiver_id in range(BaseTest.OTHER_USER_ID, BaseTest.OTHER_USER_ID + 3)
+        ]
+
+        time.sleep(0.05)
+
+        with patch.object(DefaultValues, "BULK_CHUNK_SIZE", 2):
+            n_updated = await self.env.db.set_last_updated_at_on_all_stats_related_to_user(
+                BaseDatabaseTest.USER_ID, db=self.env.db_session
+            )
+
+        # both users in all three groups
+        self.assertEqual(6, n_updated)
+
+        for message in messages:
+            receiver_id = set(group_id_to_users(message["group_id"])) - {BaseTest.USER_ID}
+            receiver_id = receiver_id.pop()
+            stats = await self.get_user_stats(group_id=message["group_id"], user_id=receiver_id)
+            self.assertGreater(stats["stats"]["last_updated_time"], message["created_at"])
+
+    @BaseServerRestApi.init_db_session
+    async def test_set_last_updated_at_only_since(self):
+        m1 = await self.send_1v1_message(receiver_id=2345)
+        time.sleep(0.05)
+
+        since = utcnow_dt()
+        m2 = await self.send_1v1_message(receiver_id=4567)
+        time.sleep(0.05)
+
+        n_updated = await self.env.db.set_last_updated_at_on_all_stats_related_to_user(
+            BaseDatabaseTest.USER_ID, db=self.env.db_session, since=since
+        )
+        self.assertEqual(2, n_updated)
+
+        s1 = await self.get_user_stats(group_id=m1["group_id"])
+        s2 = await self.get_user_stats(group_id=m2["group_id"])
+        self.assertEqual(s1["stats"]["last_updated_time"], m1["created_at"])
+        self.assertGreater(s2["stats"]["last_updated_time"], m2["created_at"])
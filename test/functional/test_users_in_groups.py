@@ -39,9 +39,10 @@ class TestUsersInGroups(BaseServerRestApi):
         _group_to_users = await self.env.db.get_user_ids_in_groups(group_ids, db=session)
         assert_users_in_groups(_group_to_users)
 
-        # delete from cache and get from db
+        # delete from cache (and the in-process cache in front of it) and get from db
         for group_id in group_ids:
             await self.env.cache.redis.delete(RedisKeys.user_in_group(group_id))
+            self.env.cache.cache.delete(RedisKeys.user_in_group(group_id))
 
         self.assertEqual(0, len(await self.env.cache.get_user_ids_and_join_time_in_groups(group_ids)))
         _group_to_users = await self.env.db.get_user_ids_in_groups(group_ids, db=session)
@@ -1,9 +1,11 @@
 import copy
 import json
 from datetime import datetime as dt
+from types import SimpleNamespace
 from typing import Dict
 from typing import List
 from typing import Optional
+from typing import Set
 from typing import Tuple
 from uuid import uuid4 as uuid
 
@@ -11,8 +13,11 @@ import arrow
 
 from dinofw.cache.redis import CacheRedis
 from dinofw.db.rdbms.schemas import GroupBase, DeletedStatsBase
+from dinofw.db.rdbms.schemas import GroupRecord
 from dinofw.db.rdbms.schemas import UserGroupBase
+from dinofw.db.rdbms.schemas import UserGroupRecord
 from dinofw.db.rdbms.schemas import UserGroupStatsBase
+from dinofw.db.rdbms.schemas import UserGroupStatsRecord
 from dinofw.db.storage.schemas import MessageBase
 from dinofw.endpoint import IClientPublishHandler, IClientPublisher
 from dinofw.rest.broadcast import BroadcastResource
@@ -24,6 +29,7 @@ from dinofw.rest.queries import DeleteAttachmentQuery, EditMessageQuery
 from dinofw.rest.queries import GroupQuery
 from dinofw.rest.queries import MessageQuery
 from dinofw.rest.queries import SendMessageQuery
+from dinofw.stats.statsd import MockStatsd
 from dinofw.utils import trim_micros, to_ts, to_dt
 from dinofw.utils import utcnow_dt
 from dinofw.utils.config import MessageTypes, PayloadStatus, DefaultValues
@@ -42,8 +48,31 @@ class FakeStorage:
         self.attachments_by_group = dict()
         self.attachments_by_message = dict()
         self.action_log = dict()
+        self.deleted_before = dict()
+        self.ttl_by_message = dict()
+        self.room_message_ttl = None
+
+    async def count_messages_in_group_before(self, group_id: str, before: dt) -> int:
+        return len([
+            message for message in self.messages_by_group.get(group_id, list())
+            if to_ts(message.created_at) <= to_ts(before)
+        ])
+
+    async def count_attachments_in_group_before(self, group_id: str, before: dt) -> int:
+        return len([
+            attachment for attachment in self.attachments_by_group.get(group_id, list())
+            if to_ts(attachment.created_at) <= to_ts(before)
+        ])
+
+    async def delete_messages_in_group_before(self, group_id: str, before: dt) -> None:
+        self.deleted_before[group_id] = before
+
+    async def delete_attachments_in_group_before(self, group_id: str, before: dt) -> None:
+        pass
 
-    async def edit_message(self, group_id: str, user_id: int, message_id: str, query: EditMessageQuery) -> MessageBase:
+    async def edit_message(
+        self, group_id: str, user_id: int, message_id: str, query: EditMessageQuery, ttl: int = None
+    ) -> MessageBase:
         messages = await self.get_all_messages_in_group(group_id)
         if not messages:
             raise NoSuchMessageException(message_id)
@@ -128,7 +157,7 @@ class FakeStorage:
 
         raise NoSuchMessageException(message_id)
 
-    async def create_action_log(self, user_id: int, group_id: str, query: ActionLogQuery):
+    async def create_action_log(self, user_id: int, group_id: str, query: ActionLogQuery, ttl: int = None):
         if group_id not in self.action_log:
             self.action_log[group_id] = list()
 
@@ -146,9 +175,18 @@ class FakeStorage:
 
         self.action_log[group_id].append(log)
         self.messages_by_group[group_id].append(log)
+        self.ttl_by_message[log.message_id] = ttl
         return log
 
-    async def delete_attachment(self, group_id: str, created_at: dt, query: AttachmentQuery) -> MessageBase:
+    async def create_action_logs(self, user_id: int, group_ids: List[str], query: ActionLogQuery, ttl: int = None):
+        return [
+            await self.create_action_log(user_id, group_id, query, ttl=ttl)
+            for group_id in group_ids
+        ]
+
+    async def delete_attachment(
+        self, group_id: str, created_at: dt, query: AttachmentQuery, ttl: int = None
+    ) -> MessageBase:
         file_id = query.file_id
         att_copy = None
 
@@ -182,7 +220,8 @@ class FakeStorage:
         group_id: str,
         group_created_at: dt,
         user_id: int,
-        query: DeleteAttachmentQuery
+        query: DeleteAttachmentQuery,
+        ttl: int = None
     ) -> List[MessageBase]:
         attachments = list()
 
@@ -223,7 +262,8 @@ class FakeStorage:
         self,
         group_created_at: List[Tuple[str, dt]],
         user_id: int,
-        query: DeleteAttachmentQuery
+        query: DeleteAttachmentQuery,
+        ttl_group_ids: Set[str] = None
     ) -> Dict[str, List[MessageBase]]:
         attachments = dict()
 
@@ -248,7 +288,7 @@ class FakeStorage:
         return unread
 
     async def store_attachment(
-        self, group_id: str, user_id: int, message_id: str, query: CreateAttachmentQuery
+        self, group_id: str, user_id: int, message_id: str, query: CreateAttachmentQuery, ttl: int = None
     ) -> MessageBase:
 
         message_type = None
@@ -281,7 +321,7 @@ class FakeStorage:
         return attachment
 
     async def store_message(
-        self, group_id: str, user_id: int, query: SendMessageQuery
+        self, group_id: str, user_id: int, query: SendMessageQuery, ttl: int = None
     ) -> MessageBase:
         if group_id not in self.messages_by_group:
             self.messages_by_group[group_id] = list()
@@ -298,6 +338,7 @@ class FakeStorage:
         )
 
         self.messages_by_group[group_id].append(message)
+        self.ttl_by_message[message.message_id] = ttl
 
         return message
 
@@ -579,6 +620,21 @@ class FakeDatabase:
                 else:
                     stat.unread_count += 1
 
+    async def update_groups_new_action_logs(
+        self, logs: List[MessageBase], sender_user_id: int, query: ActionLogQuery, db
+    ) -> None:
+        for log in logs:
+            await self.update_group_new_message(
+                log,
+                db,
+                sender_user_id=sender_user_id,
+                update_unread_count=query.update_unread_count,
+                update_last_message=query.update_last_message,
+                update_last_message_time=query.update_last_message_time,
+                update_group_updated_at=query.update_group_updated_at,
+                unhide_group=query.unhide_group
+            )
+
     async def set_last_updated_at_for_all_in_group(self, group_id: str, _):
         now = arrow.utcnow().datetime
 
@@ -824,6 +880,22 @@ class FakeDatabase:
 
         return response  # noqa
 
+    async def is_user_in_group(self, group_id: str, user_id: int, _=None) -> bool:
+        return user_id in await self.get_user_ids_and_join_time_in_group(group_id)
+
+    async def get_user_count_in_group(self, group_id: str, _=None) -> int:
+        return len(await self.get_user_ids_and_join_time_in_group(group_id))
+
+    async def iter_user_ids_in_group(self, group_id: str, _=None, batch_size: int = 500):
+        user_ids = list(await self.get_user_ids_and_join_time_in_group(group_id))
+
+        for i in range(0, len(user_ids), batch_size):
+            yield user_ids[i:i + batch_size]
+
+    async def get_read_receipt_receivers(self, group_id: str, user_id: int, _=None) -> List[int]:
+        users = await self.get_user_ids_and_join_time_in_group(group_id)
+        return [receiver_id for receiver_id in users.keys() if receiver_id != user_id]
+
     async def get_user_stats_in_group(
         self, group_id: str, user_id: int, _
     ) -> Optional[UserGroupStatsBase]:
@@ -853,10 +925,14 @@ class FakePublisherHandler(IClientPublishHandler):
         self.sent_reads = dict()
         self.sent_per_user = dict()
         self.sent_per_topic = dict()
+        self.sent_offline = list()
 
     async def stop(self):
         pass
 
+    def offline_users(self, user_ids: List[int]) -> None:
+        self.sent_offline.extend(user_ids)
+
     def delete_attachments(
         self,
         group_id: str,
@@ -923,6 +999,26 @@ class FakePublisherHandler(IClientPublishHandler):
         self.sent_per_topic[topic].append(data)
 
 
+class FakeConfig:
+    """
+    config values given by the test, the same in all domains
+    """
+    def __init__(self, values: dict = None):
+        self.values = values or dict()
+
+    def get(self, key, domain=None, default=None):
+        return self.values.get(key, default)
+
+
+class FakeCacheEnv:
+    """
+    only what's needed to create a CacheRedis, configured by each test; use `host="mock"` for fakeredis
+    """
+    def __init__(self, values: dict = None):
+        self.config = FakeConfig(values)
+        self.stats = MockStatsd()
+
+
 class FakeEnv:
     class Config:
         def __init__(self):
@@ -938,6 +1034,12 @@ class FakeEnv:
                 "cache": {
                     "max_client_ids": 10
                 },
+                "publisher": {
+                    "stream": "dino:jobs:test",
+                    "group": "dino-workers-test",
+                    "block": 10,
+                    "max_retries": 3,
+                },
                 "history": {
                     "room_max_history_days": 5,
                     "room_max_history_count": 10,
@@ -982,3 +1084,63 @@ class FakeEnv:
 
     def capture_exception(self, _):
         pass
+
+
+def fake_inbox_rows(n_rows: int) -> List[Tuple[SimpleNamespace, SimpleNamespace]]:
+    """
+    group and user stats rows like the inbox query returns them, with the same attributes
+    as the sqlalchemy entities, including the internal ones
+    """
+    now = arrow.utcnow().datetime
+    rows = list()
+
+    for i in range(n_rows):
+        group_id = str(uuid())
+
+        group = SimpleNamespace(
+            _sa_instance_state=None, id=i, group_id=group_id, name=f"group {i}", description=None,
+            created_at=now, updated_at=now, language=None, status=0, status_changed_at=None,
+            first_message_time=now, last_message_time=now, last_message_id=str(uuid()),
+            last_message_overview='{"content":"hi"}', last_message_type=0, last_message_user_id=1,
+            group_type=0, owner_id=1, meta=None,
+        )
+        stats = SimpleNamespace(
+            _sa_instance_state=None, id=i, group_id=group_id, user_id=1, last_read=now, last_sent=now,
+            delete_before=now, join_time=now, highlight_time=None, last_updated_time=now,
+            first_sent=now, receiver_highlight_time=now, sent_message_count=1, unread_count=2,
+            deleted=False, hide=False, pin=False, bookmark=False, mentions=0, notifications=True,
+            kicked=False, rating=None,
+        )
+        rows.append((group, stats))
+
+    return rows
+
+
+def inbox_rows_to_base_models(rows) -> List[UserGroupBase]:
+    return [
+        UserGroupBase(
+            group=GroupBase(**group.__dict__),
+            user_stats=UserGroupStatsBase(**stats.__dict__),
+            receiver_user_stats=None,
+            user_join_times={1: 1.0, 2: 2.0},
+            user_count=2,
+            receiver_unread=-1,
+            unread=stats.unread_count,
+        )
+        for group, stats in rows
+    ]
+
+
+def inbox_rows_to_records(rows) -> List[UserGroupRecord]:
+    return [
+        UserGroupRecord(
+            group=GroupRecord.from_entity(group),
+            user_stats=UserGroupStatsRecord.from_entity(stats),
+            receiver_user_stats=None,
+            user_join_times={1: 1.0, 2: 2.0},
+            user_count=2,
+            receiver_unread=-1,
+            unread=stats.unread_count,
+        )
+        for group, stats in rows
+    ]
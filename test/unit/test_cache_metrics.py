@@ -0,0 +1,57 @@
+import asyncio
+from unittest import TestCase
+
+from dinofw.cache.metrics import key_family
+from dinofw.cache.redis import CacheRedis
+from dinofw.utils.config import RedisKeys
+from test.mocks import FakeCacheEnv
+
+
+class TestCacheMetrics(TestCase):
+    def test_key_families(self):
+        self.assertEqual("users_in_group", key_family(RedisKeys.user_in_group("group-a")))
+        self.assertEqual("users_in_group_packed", key_family(RedisKeys.user_in_group_packed("group-a")))
+        self.assertEqual("total_unread_count", key_family("unread:msgs:{1234}"))
+        self.assertEqual("other", key_family("public_groups:v2:none:data"))
+
+    def test_hits_and_misses_per_family(self):
+        cache = CacheRedis(FakeCacheEnv(), host="mock")
+
+        async def read_and_write():
+            await cache.redis.flushdb()
+
+            # a miss, then a hit from redis, then a hit from the in-process cache
+            await cache.get_group_type("group-a")
+            await cache.redis.set(RedisKeys.group_type("group-a"), 1)
+            await cache.get_group_type("group-a")
+            await cache.get_group_type("group-a")
+
+            async with cache.pipeline() as p:
+                await p.get(RedisKeys.group_status("group-a"))
+                await p.get(RedisKeys.group_status("group-b"))
+
+        asyncio.run(read_and_write())
+        metrics = cache.get_metrics()
+
+        group_type = metrics["families"]["group_type"]
+        self.assertEqual(1, group_type["hits"])
+        self.assertEqual(1, group_type["misses"])
+        self.assertEqual(1, group_type["l1_hits"])
+        self.assertEqual(3, group_type["calls"])
+
+        self.assertEqual(2, metrics["families"]["group_status"]["misses"])
+        self.assertEqual(2, metrics["pipelines"]["max_size"])
+
+    def test_reported_to_stats_service(self):
+        env = FakeCacheEnv({"metrics_interval": "0"})
+        cache = CacheRedis(env, host="mock")
+
+        async def read():
+            await cache.redis.flushdb()
+            await cache.redis.set(RedisKeys.group_status("group-a"), 1)
+            await cache.redis.get(RedisKeys.group_status("group-a"))
+
+        asyncio.run(read())
+
+        self.assertEqual(100, env.stats.vals["cache.group_status.hit_ratio"])
+        self.assertIn("cache.group_status.latency", env.stats.timings)
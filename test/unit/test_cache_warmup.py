@@ -0,0 +1,88 @@
+import asyncio
+from types import SimpleNamespace
+from unittest import TestCase
+
+from dinofw.cache.redis import CacheRedis
+from dinofw.cache.warmup import CacheWarmUp
+from dinofw.utils.config import RedisKeys
+from test.mocks import FakeCacheEnv
+
+
+class FakeSession:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class FakeDatabase:
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+
+    async def get_recently_active_groups(self, limit: int, _):
+        return [("group-a", 0, 1), ("group-b", 1, 0)][:limit]
+
+    async def get_recently_active_user_ids(self, group_ids, limit: int, _):
+        return [1, 2, 3][:limit]
+
+    async def get_user_ids_and_join_time_in_groups(self, group_ids, _):
+        await asyncio.sleep(self.delay)
+        return {group_id: {1: 1.0} for group_id in group_ids}
+
+
+class FakeUsers:
+    def __init__(self):
+        self.counted = list()
+
+    async def count_unread(self, user_id: int, _):
+        self.counted.append(user_id)
+        return 0, 0
+
+
+class FakeEnv(FakeCacheEnv):
+    def __init__(self, values: dict, delay: float = 0):
+        super().__init__(values)
+        self.db = FakeDatabase(delay)
+        self.rest = SimpleNamespace(user=FakeUsers())
+        self.cache = CacheRedis(self, host="mock")
+        self.SessionLocal = FakeSession
+
+
+class TestCacheWarmUp(TestCase):
+    def test_warms_up_groups_and_users(self):
+        env = FakeEnv({"warmup_users": "2"})
+        warmup = CacheWarmUp(env)
+
+        async def warm_up():
+            await env.cache.redis.flushdb()
+            await env.cache.redis.set(RedisKeys.group_status("group-a"), 2)
+
+            await warmup.run()
+
+            return (
+                await env.cache.redis.get(RedisKeys.group_status("group-a")),
+                await env.cache.get_group_type("group-b"),
+            )
+
+        status, group_type = asyncio.run(warm_up())
+
+        self.assertTrue(warmup.finished)
+        self.assertFalse(warmup.timed_out)
+        self.assertEqual(2, warmup.n_groups)
+        self.assertEqual([1, 2], env.rest.user.counted)
+
+        # an existing key is not overwritten by the possibly outdated value from the db
+        self.assertEqual("2", status)
+        self.assertEqual(1, group_type)
+
+    def test_finishes_when_budget_runs_out(self):
+        env = FakeEnv({"warmup_budget": "1"}, delay=5)
+        warmup = CacheWarmUp(env)
+
+        asyncio.run(warmup.run())
+
+        self.assertTrue(warmup.finished)
+        self.assertTrue(warmup.timed_out)
+        self.assertLess(warmup.elapsed, 5)
+        self.assertEqual(0, warmup.n_users)
@@ -0,0 +1,68 @@
+from unittest import TestCase
+from uuid import uuid4 as uuid
+
+import arrow
+
+from dinofw.db.rdbms.schemas import GroupBase
+from dinofw.db.rdbms.schemas import GroupRecord
+from dinofw.db.rdbms.schemas import UserGroupRecord
+from dinofw.db.rdbms.schemas import UserGroupStatsBase
+from dinofw.db.rdbms.schemas import UserGroupStatsRecord
+from dinofw.db.storage.schemas import MessageBase
+from dinofw.utils.convert import message_base_to_dict
+from dinofw.utils.convert import message_base_to_message
+from dinofw.utils.convert import to_user_group
+from dinofw.utils.convert import to_user_group_dicts
+from test.mocks import fake_inbox_rows
+from test.mocks import inbox_rows_to_base_models
+from test.mocks import inbox_rows_to_records
+
+
+class TestConvertRecords(TestCase):
+    def test_records_have_same_fields_as_base_models(self):
+        self.assertEqual(list(GroupBase.__fields__.keys()), list(GroupRecord.__slots__))
+        self.assertEqual(list(UserGroupStatsBase.__fields__.keys()), list(UserGroupStatsRecord.__slots__))
+
+    def test_records_convert_to_same_api_models(self):
+        rows = fake_inbox_rows(10)
+
+        self.assertEqual(
+            [user_group.dict() for user_group in to_user_group(inbox_rows_to_base_models(rows))],
+            [user_group.dict() for user_group in to_user_group(inbox_rows_to_records(rows))]
+        )
+
+    def test_dicts_match_api_models(self):
+        rows = fake_inbox_rows(10)
+        user_groups = [
+            UserGroupRecord(
+                group=GroupRecord.from_entity(group),
+                user_stats=UserGroupStatsRecord.from_entity(stats),
+                # every other group with receiver stats
+                receiver_user_stats=UserGroupStatsRecord.from_entity(stats) if i % 2 else None,
+                user_join_times={1: 1.0, 2: 3.0, 3: 2},
+                user_count=3,
+                receiver_unread=-1,
+                unread=stats.unread_count,
+            )
+            for i, (group, stats) in enumerate(rows)
+        ]
+
+        self.assertEqual(
+            [user_group.dict() for user_group in to_user_group(user_groups)],
+            to_user_group_dicts(user_groups)
+        )
+
+    def test_message_dict_matches_api_model(self):
+        now = arrow.utcnow().datetime
+        message = MessageBase(
+            group_id=str(uuid()),
+            created_at=now,
+            user_id=1,
+            message_id=str(uuid()),
+            message_type=0,
+            message_payload='{"content":"hi"}',
+            context=None,
+            updated_at=None,
+        )
+
+        self.assertEqual(message_base_to_message(message).dict(), message_base_to_dict(message))
@@ -0,0 +1,67 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from dinofw.cache.redis import LruCache
+
+
+class TestLruCache(TestCase):
+    def test_least_recently_used_is_evicted(self):
+        cache = LruCache(max_size=2)
+
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(1, cache.get("a"))
+
+        cache.set("c", 3)
+
+        self.assertEqual(1, cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(3, cache.get("c"))
+        self.assertEqual(1, cache.evicted)
+        self.assertEqual(2, len(cache.vals))
+
+    def test_expired_keys_are_removed_when_read(self):
+        cache = LruCache()
+
+        with patch("dinofw.cache.redis.time.monotonic", return_value=100.0):
+            cache.set("a", 1, ttl=5)
+            self.assertEqual(1, cache.get("a"))
+
+        with patch("dinofw.cache.redis.time.monotonic", return_value=106.0):
+            self.assertIsNone(cache.get("a"))
+
+        self.assertNotIn("a", cache.vals)
+        self.assertEqual({
+            "keys": 0,
+            "size": 0,
+            "max_size": cache.max_size,
+            "hits": 1,
+            "misses": 1,
+            "expired": 1,
+            "evicted": 0,
+            "too_big": 0,
+        }, cache.stats())
+
+    def test_users_of_a_group_count_once_per_user(self):
+        cache = LruCache(max_size=100)
+
+        cache.set("a", 1)
+        cache.set("group-a", {user_id: 1.0 for user_id in range(10)})
+        cache.set("group-b", {user_id: 1.0 for user_id in range(10)})
+        self.assertEqual(21, cache.size)
+
+        # replacing a value doesn't count it twice
+        cache.set("group-b", {user_id: 1.0 for user_id in range(5)})
+        self.assertEqual(16, cache.size)
+
+        # heavier than a tenth of the cache
+        cache.set("group-c", {user_id: 1.0 for user_id in range(11)})
+        self.assertIsNone(cache.get("group-c"))
+        self.assertEqual(1, cache.too_big)
+
+        for i in range(90):
+            cache.set(f"key-{i}", i)
+
+        self.assertLessEqual(cache.size, 100)
+        self.assertIsNone(cache.get("group-a"))
+        self.assertEqual(89, cache.get("key-89"))
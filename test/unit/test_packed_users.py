@@ -0,0 +1,100 @@
+import asyncio
+from unittest import TestCase
+
+from dinofw.cache.redis import CacheRedis
+from dinofw.cache.redis import _pack_users
+from dinofw.cache.redis import _unpack_user_count
+from dinofw.cache.redis import _unpack_users
+from dinofw.utils.config import RedisKeys
+from test.mocks import FakeCacheEnv
+
+
+class TestPackedUsers(TestCase):
+    def test_delta_encoded_ids(self):
+        users = {8000 + i * 3: 1700000000.123456 + i for i in range(100)}
+        packed = _pack_users(users)
+
+        self.assertEqual(users, _unpack_users(packed))
+        self.assertEqual(100, _unpack_user_count(packed[:8]))
+
+    def test_ids_that_dont_fit_deltas(self):
+        users = {-1: 1.5, 3: 2.5, 2 ** 40: 3.5}
+        self.assertEqual(users, _unpack_users(_pack_users(users)))
+
+    def test_large_groups_are_packed_in_the_cache(self):
+        cache = CacheRedis(FakeCacheEnv({"testing": True, "packed_users_threshold": "3"}), host="mock")
+        users = {1: 10.0, 2: 20.0, 3: 30.0}
+
+        async def set_and_get():
+            await cache.redis.flushdb()
+            await cache.set_user_ids_and_join_time_in_group("group-a", users)
+            cache.cache.flushall()
+
+            return (
+                await cache.redis.exists(RedisKeys.user_in_group("group-a")),
+                await cache.get_user_count_in_group("group-a"),
+                await cache.get_user_ids_and_join_time_in_groups(["group-a"]),
+            )
+
+        n_hashes, user_count, group_users = asyncio.run(set_and_get())
+
+        self.assertEqual(0, n_hashes)
+        self.assertEqual(3, user_count)
+        self.assertEqual({"group-a": users}, group_users)
+
+    def test_joining_a_packed_group_removes_it(self):
+        cache = CacheRedis(FakeCacheEnv({"testing": True, "packed_users_threshold": "3"}), host="mock")
+
+        async def join():
+            await cache.redis.flushdb()
+            await cache.set_user_ids_and_join_time_in_group("group-a", {1: 10.0, 2: 20.0, 3: 30.0})
+            await cache.add_user_ids_and_join_time_in_group("group-a", {4: 40.0})
+
+            return await cache.get_user_ids_and_join_time_in_group("group-a")
+
+        # not only the new user, the group will be read from the db instead
+        self.assertIsNone(asyncio.run(join()))
+
+
+class TestUserMembership(TestCase):
+    def test_membership_without_fetching_all_users(self):
+        cache = CacheRedis(FakeCacheEnv({"testing": True, "packed_users_threshold": "10"}), host="mock")
+
+        async def check(group_id: str, n_users: int):
+            await cache.redis.flushdb()
+            await cache.set_user_ids_and_join_time_in_group(group_id, {i: float(i) for i in range(1, n_users + 1)})
+            cache.cache.flushall()
+
+            batches = await cache.iter_user_ids_in_group(group_id, batch_size=4)
+            user_ids = [batch async for batch in batches]
+
+            return (
+                await cache.is_user_in_group(group_id, 2),
+                await cache.is_user_in_group(group_id, 99),
+                await cache.get_user_count_in_group(group_id),
+                user_ids,
+            )
+
+        for n_users in [5, 12]:
+            in_group, not_in_group, user_count, user_ids = asyncio.run(check("group-a", n_users))
+
+            self.assertTrue(in_group)
+            self.assertFalse(not_in_group)
+            self.assertEqual(n_users, user_count)
+            self.assertTrue(all(len(batch) <= 4 for batch in user_ids))
+            self.assertEqual(list(range(1, n_users + 1)), sorted(sum(user_ids, [])))
+
+    def test_unknown_membership_when_not_cached(self):
+        cache = CacheRedis(FakeCacheEnv({"testing": True}), host="mock")
+
+        async def check():
+            await cache.redis.flushdb()
+            cache.cache.flushall()
+
+            return (
+                await cache.is_user_in_group("group-b", 1),
+                await cache.get_user_count_in_group("group-b"),
+                await cache.iter_user_ids_in_group("group-b"),
+            )
+
+        self.assertEqual((None, None, None), asyncio.run(check()))
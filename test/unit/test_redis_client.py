@@ -0,0 +1,303 @@
+import asyncio
+import os
+import time
+from unittest import TestCase
+from unittest import skipUnless
+
+import redis
+from redis.crc import key_slot
+
+from dinofw.cache.redis import CacheRedis
+from dinofw.cache.redis import L1_GROUP_STATUS_TTL
+from dinofw.rest.groups_cache import PublicGroupsCacheMixin
+from dinofw.rest.queries import PublicGroupQuery
+from dinofw.utils.config import RedisKeys
+from test.mocks import FakeCacheEnv
+
+
+class TestRedisClient(TestCase):
+    def test_one_client_per_loop(self):
+        cache = CacheRedis(FakeCacheEnv(), host="localhost")
+
+        async def get_clients():
+            return cache.redis, cache.redis
+
+        client_a, client_b = asyncio.run(get_clients())
+        client_c, _ = asyncio.run(get_clients())
+
+        self.assertIs(client_a, client_b)
+        self.assertIsNot(client_a, client_c)
+
+    def test_pool_options_from_config(self):
+        cache = CacheRedis(FakeCacheEnv({
+            "max_connections": "20",
+            "health_check_interval": "$DINO_REDIS_HEALTH_CHECK_INTERVAL",
+            "socket_keepalive": "false",
+        }), host="localhost")
+
+        async def get_pool():
+            return cache.redis.connection_pool
+
+        pool = asyncio.run(get_pool())
+
+        self.assertIsInstance(pool, redis.asyncio.BlockingConnectionPool)
+        self.assertEqual(20, pool.max_connections)
+        self.assertEqual(30, pool.connection_kwargs["health_check_interval"])
+        self.assertFalse(pool.connection_kwargs["socket_keepalive"])
+
+
+class TestUnreadScripts(TestCase):
+    def setUp(self):
+        self.cache = CacheRedis(FakeCacheEnv({"testing": True}), host="mock")
+
+        # fakeredis shares the data between instances
+        asyncio.run(self.cache.redis.flushdb())
+
+    def test_only_cached_total_unread_is_increased(self):
+        async def increase():
+            await self.cache.redis.set(RedisKeys.total_unread_count(1), 3)
+            await self.cache.increase_total_unread_message_count([1, 2], 2)
+
+            return (
+                await self.cache.redis.get(RedisKeys.total_unread_count(1)),
+                await self.cache.redis.get(RedisKeys.total_unread_count(2)),
+                await self.cache.redis.ttl(RedisKeys.total_unread_count(1)),
+            )
+
+        cached, not_cached, ttl = asyncio.run(increase())
+
+        self.assertEqual("5", cached)
+        self.assertIsNone(not_cached)
+        self.assertGreater(ttl, 0)
+
+    def test_new_message_in_pipeline(self):
+        group_id = "group-a"
+
+        async def increase():
+            await self.cache.redis.set(RedisKeys.total_unread_count(2), 1)
+
+            async with self.cache.pipeline() as p:
+                await self.cache.increase_unread_for_new_message(group_id, [2, 3], {2: 4, 4: 1}, pipeline=p)
+
+            return (
+                await self.cache.redis.hgetall(RedisKeys.unread_in_group(group_id)),
+                await self.cache.redis.smembers(RedisKeys.unread_groups(3)),
+                await self.cache.redis.ttl(RedisKeys.unread_groups(3)),
+                await self.cache.redis.get(RedisKeys.total_unread_count(2)),
+                await self.cache.redis.get(RedisKeys.total_unread_count(4)),
+            )
+
+        unread_in_group, unread_groups, ttl, total_unread, not_cached = asyncio.run(increase())
+
+        self.assertEqual({"2": "1", "3": "1"}, unread_in_group)
+        self.assertEqual({group_id}, unread_groups)
+        self.assertGreater(ttl, 0)
+        self.assertEqual("5", total_unread)
+        self.assertIsNone(not_cached)
+
+
+class TestHideGroup(TestCase):
+    def setUp(self):
+        self.cache = CacheRedis(FakeCacheEnv({"testing": True}), host="mock")
+        asyncio.run(self.cache.redis.flushdb())
+
+    def test_only_hidden_users_are_kept(self):
+        key = RedisKeys.hide_group("group-a")
+
+        async def hide_and_unhide():
+            await self.cache.set_hide_group("group-a", True, [1, 2])
+            await self.cache.set_hide_group("group-a", False, [1])
+            hidden = await self.cache.redis.hgetall(key)
+
+            # un-hiding for everyone on a new message
+            await self.cache.set_hide_group("group-a", False)
+
+            return hidden, await self.cache.redis.exists(key)
+
+        hidden, exists = asyncio.run(hide_and_unhide())
+
+        self.assertEqual({"2": "t"}, hidden)
+        self.assertEqual(0, exists)
+
+
+class TestOnlineUsers(TestCase):
+    def setUp(self):
+        self.cache = CacheRedis(FakeCacheEnv({"testing": True}), host="mock")
+        asyncio.run(self.cache.redis.flushdb())
+
+    def test_only_changes_are_applied(self):
+        async def reconcile():
+            await self.cache.redis.sadd(RedisKeys.online_users(), *range(1, 2001))
+
+            went_offline = await self.cache.reconcile_online_users(list(range(1001, 3001)))
+            online = await self.cache.redis.smembers(RedisKeys.online_users())
+            all_offline = await self.cache.reconcile_online_users(list())
+
+            return went_offline, online, all_offline
+
+        went_offline, online, all_offline = asyncio.run(reconcile())
+
+        self.assertEqual(list(range(1, 1001)), sorted(went_offline))
+        self.assertEqual({str(user_id) for user_id in range(1001, 3001)}, online)
+        self.assertEqual(list(range(1001, 3001)), sorted(all_offline))
+
+
+class TestCacheInvalidation(TestCase):
+    def test_changes_by_other_instances_are_evicted(self):
+        listening = CacheRedis(FakeCacheEnv({"testing": True}), host="mock")
+        changing = CacheRedis(FakeCacheEnv({"testing": True}), host="mock")
+        key = RedisKeys.group_status("group-a")
+
+        async def change_status():
+            await listening.redis.flushdb()
+            task = asyncio.create_task(listening.listen_for_invalidations())
+
+            while not listening.invalidation_subscribed:
+                await asyncio.sleep(0.01)
+
+            await changing.set_group_status("group-a", 0)
+            self.assertEqual(0, await listening.get_group_status("group-a"))
+
+            # kept longer while subscribed
+            expires_at, _, _ = listening.cache.vals[key]
+            self.assertGreater(expires_at - time.monotonic(), L1_GROUP_STATUS_TTL)
+
+            await changing.set_group_status("group-a", 1)
+            for _ in range(100):
+                if key not in listening.cache.vals:
+                    break
+                await asyncio.sleep(0.01)
+
+            status = await listening.get_group_status("group-a")
+
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+            return status
+
+        self.assertEqual(1, asyncio.run(change_status()))
+        self.assertFalse(listening.invalidation_subscribed)
+        self.assertEqual(0, len(listening.cache.vals))
+
+
+class TestHashTags(TestCase):
+    def tearDown(self):
+        RedisKeys.use_hash_tags(False)
+
+    def test_keys_of_a_group_or_user_are_in_one_slot(self):
+        RedisKeys.use_hash_tags(True)
+
+        group_keys = [
+            RedisKeys.user_in_group("group-a"),
+            RedisKeys.unread_in_group("group-a"),
+            RedisKeys.last_message_time("group-a"),
+            RedisKeys.attachment_count_group_user("group-a", 1),
+            RedisKeys.delete_before("group-a", 2),
+        ]
+        user_keys = [
+            RedisKeys.total_unread_count(1),
+            RedisKeys.unread_groups(1),
+            RedisKeys.client_id("chat", 1),
+            RedisKeys.action_logs_done(1, "abc"),
+        ]
+        deleter_keys = [
+            RedisKeys.deletion_candidates(),
+            RedisKeys.deletion_candidates_in_progress(),
+        ]
+
+        public_groups_keys = PublicGroupsCacheMixin()._keys(
+            PublicGroupsCacheMixin()._base_cache_key(PublicGroupQuery())
+        )
+
+        for keys in [group_keys, user_keys, deleter_keys, public_groups_keys]:
+            self.assertEqual(1, len({key_slot(key.encode()) for key in keys}), keys)
+
+        self.assertEqual("group:users:group-a", RedisKeys.untagged(group_keys[0]))
+        self.assertEqual("user:auth:1", RedisKeys.auth_key("1"))
+
+    def test_keys_are_unchanged_without_hash_tags(self):
+        self.assertEqual("group:users:group-a", RedisKeys.user_in_group("group-a"))
+        self.assertEqual("unread:msgs:1", RedisKeys.total_unread_count(1))
+        self.assertEqual("deleter:candidates", RedisKeys.deletion_candidates())
+        self.assertEqual("users:online", RedisKeys.online_users())
+
+    def test_legacy_keys_are_moved_when_read(self):
+        cache = CacheRedis(FakeCacheEnv({"testing": True, "hash_tags": "true", "legacy_keys": "true"}), host="mock")
+
+        async def read():
+            await cache.redis.flushdb()
+            await cache.redis.lpush("user:chat:1:clientids", "1_chat_0", "1_chat_1")
+            await cache.redis.sadd("deleter:candidates", "group-a")
+            await cache.add_deletion_candidates(["group-b"])
+
+            return (
+                await cache.get_next_client_id("chat", 1),
+                await cache.take_deletion_candidates(),
+                await cache.redis.exists("user:chat:1:clientids", "deleter:candidates"),
+            )
+
+        client_id, candidates, n_legacy_keys = asyncio.run(read())
+
+        self.assertEqual("1_chat_3", client_id)
+        self.assertEqual({"group-a", "group-b"}, candidates)
+        self.assertEqual(0, n_legacy_keys)
+
+
+# e.g. DINO_REDIS_CLUSTER=localhost:7000, any node of a cluster
+REDIS_CLUSTER = os.environ.get("DINO_REDIS_CLUSTER")
+
+
+@skipUnless(REDIS_CLUSTER, "needs a redis cluster")
+class TestCluster(TestCase):
+    def setUp(self):
+        host, port = REDIS_CLUSTER.split(":")
+        self.cache = CacheRedis(FakeCacheEnv({"cluster": "true"}), host=host, port=int(port))
+
+    def tearDown(self):
+        RedisKeys.use_hash_tags(False)
+
+    def test_pipeline_with_scripts_and_invalidations(self):
+        group_id = "group-a"
+
+        async def send_message():
+            await self.cache.redis.delete(RedisKeys.unread_in_group(group_id), RedisKeys.user_in_group(group_id))
+            await self.cache.redis.set(RedisKeys.total_unread_count(2), 1)
+            await self.cache.redis.hset(RedisKeys.user_in_group(group_id), "2", "1.0")
+
+            # commands queued in the pipeline are awaited, and scripts or publish would be blocked
+            async with self.cache.pipeline() as p:
+                await self.cache.increase_unread_for_new_message(group_id, [2, 3], {2: 4}, pipeline=p)
+                await self.cache.add_user_ids_and_join_time_in_group(group_id, {3: 2.0}, pipeline=p)
+
+            return (
+                await self.cache.redis.hgetall(RedisKeys.unread_in_group(group_id)),
+                await self.cache.redis.get(RedisKeys.total_unread_count(2)),
+                await self.cache.redis.hgetall(RedisKeys.user_in_group(group_id)),
+            )
+
+        unread_in_group, total_unread, users = asyncio.run(send_message())
+
+        self.assertEqual({"2": "1", "3": "1"}, unread_in_group)
+        self.assertEqual("5", total_unread)
+        self.assertEqual({"2": "1.0", "3": "2.0"}, users)
+
+    def test_take_deletion_candidates(self):
+        async def take():
+            await self.cache.remove_deletion_candidates_in_progress()
+            await self.cache.add_deletion_candidates_in_progress(["group-a"])
+            await self.cache.add_deletion_candidates(["group-b"])
+
+            return (
+                await self.cache.take_deletion_candidates(),
+                await self.cache.get_deletion_candidates(),
+                await self.cache.redis.exists(RedisKeys.deletion_candidates()),
+            )
+
+        taken, in_progress, n_new = asyncio.run(take())
+
+        self.assertEqual({"group-a", "group-b"}, taken)
+        self.assertEqual({"group-a", "group-b"}, in_progress)
+        self.assertEqual(0, n_new)
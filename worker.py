@@ -0,0 +1,19 @@
+import logging
+
+from dinofw.utils.config import ConfigKeys
+
+logging.basicConfig(
+    format=ConfigKeys.DEFAULT_LOG_FORMAT,
+    datefmt=ConfigKeys.DEFAULT_DATE_FORMAT,
+    level=logging.DEBUG
+)
+
+logging.getLogger("cassandra").setLevel(logging.INFO)
+logging.getLogger("gmqtt").setLevel(logging.WARNING)
+logging.getLogger("kafka").setLevel(logging.INFO)
+
+from dinofw.utils import environ
+environ.env.node = "worker"
+
+# keep this import; even though unused, uvicorn needs it, otherwise it will not start
+from dinofw.worker import app  # noqa